@@ -4,32 +4,28 @@
 # - Local cluster insets (anchors, label style, connector)
 # - Safe extents + clipped elements + robust export
 # Requires utils/
+#   render_engine.py (headless map builder used here and by batch_render.py)
 #   inset_overview.py (latest safe-extent version)
 #   cluster_utils.py, label_declutter.py, local_inset_clusters.py (advanced)
 #   coord_utils_v2.py, overlay_loader.py, plot_helpers.py, config.py
 
 from PIL import Image
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import matplotlib.patheffects as pe
-import numpy as np
-import tempfile, os, base64
-from matplotlib import ticker as mticker
+import base64, warnings
+from collections import OrderedDict
+
+from utils.config import shape_map
+from utils.render_engine import (
+    CLUSTER_KM_RANGE, NE_COUNTRIES_ZIP, RenderWarning, coord_spec, detect_utm_columns, render_map,
+)
+from utils.density import DENSITY_SHAPES, POINT_MODES
+from utils.symbology import CLASS_METHODS, SYMBOLOGY_MODES
+from utils.render_cache import digest_bytes, get_render_cache, render_key
+from utils.ingest import ingest_stations, table_columns
 
-from utils.coord_utils_v2 import convert_coords, get_buffered_extent
-from utils.overlay_loader import overlay_gdf
-from utils.plot_helpers import dd_fmt_lon, dd_fmt_lat, dms_fmt_lon, dms_fmt_lat, draw_scale_bar
-from utils.config import shape_map, get_page_size
-from utils.inset_overview import draw_inset_overview
-from utils.cluster_utils import greedy_cluster
-from utils.label_declutter import declutter_texts
-from utils.local_inset_clusters import draw_cluster_insets
-
-NE_COUNTRIES_ZIP = "assets/ne_10m_admin_0_countries.zip"
 logo = "assets/logo.png"
+PREVIEW_DPI = 100   # on-screen preview; the Export DPI only applies to the download
+MAX_DECLUTTER_REPORTS = 16   # declutter reports kept per session, most recent render keys
 
 def _icon():
     try:
@@ -40,25 +36,16 @@ def _icon():
 
 st.set_page_config(page_title="CartoZen v1.1.0", page_icon=_icon(), layout="wide")
 
-# ── helpers ─────────────────────────────────────────────────────────────────
 
-def _find_col(cols, candidates):
-    lower = {c.lower(): c for c in cols}
-    for cand in candidates:
-        if cand in lower:
-            return lower[cand]
-    return None
+@st.cache_data(max_entries=8, show_spinner=False)
+def _table_columns(raw: bytes, name: str):
+    # header only; the used columns are ingested (and persisted) on render
+    return table_columns(raw, name)
+
 
+def _index_of(options, value):
+    return options.index(value) if value in options else 0
 
-def _safe_extent(b):
-    lo, hi, la, lb = map(float, b)
-    lo = max(-179.999, min(179.999, lo))
-    hi = max(-179.999, min(179.999, hi))
-    la = max(-89.9,   min(89.9,   la))
-    lb = max(-89.9,   min(89.9,   lb))
-    if hi <= lo: hi = lo + 0.01
-    if lb <= la: lb = la + 0.01
-    return (lo, hi, la, lb)
 
 # ── UI ──────────────────────────────────────────────────────────────────────
 view = st.selectbox("View", ["Map", "About", "Changelog"])
@@ -86,13 +73,18 @@ if view == "Map":
         if not auto_ext:
             buffer_deg = st.number_input("Buffer around data (°)", min_value=0, max_value=60, value=5, step=1)
         with st.expander("**Overlay**", expanded=False):
-            ov_file = st.file_uploader("zip / GeoJSON / KML", ["zip","geojson","kml"])
+            ov_file = st.file_uploader("zip / GeoJSON / KML / GeoParquet / FlatGeobuf",
+                                       ["zip","geojson","kml","parquet","geoparquet","fgb"])
             show_ov = st.checkbox("Show overlay", True)
             ov_main_color = st.color_picker("Main overlay colour", "#0000ff")
         with st.expander("**Map Colors**", expanded=False):
             land_col = st.color_picker("Land color", "#f0e8d8")
             ocean_col = st.color_picker("Water color", "#cce6ff")
+            bm_scale = st.selectbox("Basemap detail", ["auto", "10m", "50m", "110m"],
+                                    help="auto: Natural Earth scale from the map extent and output DPI")
+            bm_simplify = st.checkbox("Simplify basemap to screen resolution", False)
         with st.expander("**Marker**", expanded=False):
+            markers_on = st.checkbox("Show markers", True)
             shape = st.selectbox("Shape", list(shape_map.keys()))
             m_col = st.color_picker("Colour", "#00cc44")
             m_size = st.slider("Size", 5, 20, 10)
@@ -102,12 +94,46 @@ if view == "Map":
             m_halo_on  = st.checkbox("Marker halo (outer stroke)", False)
             m_halo_col = st.color_picker("Halo colour", "#FFFFFF") if m_halo_on else "#FFFFFF"
             m_halo_w   = st.number_input("Halo width", min_value=0.0, max_value=10.0, value=2.0, step=0.1) if m_halo_on else 0.0
+            symbology = st.selectbox("Symbology", list(SYMBOLOGY_MODES),
+                                     help="graduated / categorical: colour markers by the Attribute column")
+            cls_method, cls_k, cls_cmap, cat_cmap, cls_sizes, cls_smin, cls_smax = "quantile", 5, "viridis", "tab10", False, 5, 16
+            if symbology == "graduated":
+                cls_method = st.selectbox("Class breaks", list(CLASS_METHODS))
+                cls_k      = st.slider("Classes", 2, 9, 5)
+                cls_cmap   = st.selectbox("Class colour ramp", ["viridis", "YlOrRd", "Blues", "RdYlBu_r", "magma"])
+                cls_sizes  = st.checkbox("Size by class", False)
+                if cls_sizes:
+                    cls_smin, cls_smax = st.slider("Class marker sizes", 3, 30, (5, 16))
+            elif symbology == "categorical":
+                cat_cmap = st.selectbox("Category palette", ["tab10", "Set1", "Dark2", "Paired", "tab20"])
+            point_mode = st.selectbox("Point rendering", list(POINT_MODES),
+                                      help="density: count stations per hex/square cell; auto: density above the threshold")
+            dens_thr, dens_shape, dens_cell, dens_cmap, dens_log, dens_leg = 100_000, "hex", 12, "viridis", True, "center right"
+            if point_mode != "markers":
+                if point_mode == "auto":
+                    dens_thr = st.number_input("Density above (stations)", min_value=1_000, max_value=10_000_000, value=100_000, step=10_000)
+                dens_shape = st.selectbox("Cell shape", list(DENSITY_SHAPES))
+                dens_cell  = st.slider("Cell size (px)", 4, 40, 12)
+                dens_cmap  = st.selectbox("Colour ramp", ["viridis", "magma", "cividis", "YlOrRd", "Blues"])
+                dens_log   = st.checkbox("Logarithmic colour ramp", True)
+                dens_leg   = st.selectbox("Colour bar", ["center right", "upper right", "lower right",
+                                                         "upper left", "lower left", "center left", "none"])
             show_lab = st.checkbox("Show labels", True)
             dx = dy = 0.0
             if show_lab:
                 dx = st.number_input("Label offset °lon (float)", value=0.01, step=0.01, format="%.2f")
                 dy = st.number_input("Label offset °lat (float)", value=0.05, step=0.01, format="%.2f")
 
+        with st.expander("**Heatmap**", expanded=False):
+            heat_on = st.checkbox("Station density heatmap", False)
+            heat_bw, heat_cmap, heat_alpha, heat_leg = 10.0, "YlOrRd", 0.7, "center left"
+            if heat_on:
+                heat_bw    = st.number_input("Bandwidth (km)", min_value=0.5, max_value=500.0, value=10.0, step=0.5)
+                heat_cmap  = st.selectbox("Heatmap colour ramp", ["YlOrRd", "magma", "viridis", "Reds", "Blues"])
+                heat_alpha = st.slider("Heatmap opacity", 0.1, 1.0, 0.7, 0.05)
+                heat_leg   = st.selectbox("Heatmap colour bar", ["center left", "upper left", "lower left",
+                                                                 "center right", "upper right", "lower right", "none"])
+
         with st.expander("**Grid & Axis**", expanded=False):
             grid_on = st.checkbox("Grid", False)
             g_int = st.number_input("Interval ° (float)", min_value=0.01, max_value=30.0, value=1.00, step=0.01, format="%.2f")
@@ -147,9 +173,16 @@ if view == "Map":
             frame_on = st.checkbox("Inset frame", True)
             frame_lw = st.slider("Inset frame width", 0.5, 3.0, 0.8, 0.1)
         with st.expander("**Declutter & Cluster**", expanded=False):
-            declutter_on = st.checkbox("Avoid label overlap (repel)", False)
+            declutter_on = st.checkbox("Avoid label overlap", False)
+            declutter_mode = st.selectbox("Declutter method", ["repel", "place"],
+                                          help="repel: push overlapping labels apart; "
+                                               "place: try 8 positions around each station, drop labels that don't fit")
+            label_drop = st.selectbox("Labels that don't fit (place)", ["hide", "count"],
+                                      help="count: show \"+k\" for dropped labels where room allows")
+            declutter_budget = st.number_input("Declutter time budget (s)", min_value=0.5, max_value=60.0, value=5.0, step=0.5,
+                                               help="repel: stop moving labels after this long and keep the best result so far")
             cluster_on = st.checkbox("Cluster nearby stations", False)
-            cluster_km = st.slider("Cluster distance (km)", 1, 50, 12)
+            cluster_km = st.slider("Cluster distance (km)", *CLUSTER_KM_RANGE, 12)
             show_cluster_counts = st.checkbox("Show cluster counts on map", True)
             local_insets = st.checkbox("Local insets for largest clusters", False)
             max_insets = st.slider("Number of local insets", 0, 3, 2)
@@ -205,9 +238,7 @@ if view == "Map":
             sb_f = st.slider("Scale-bar", 6, 16, 8)
             north_f = st.slider("North arrow", 10, 30, 18)
         if up_file:
-            is_csv = up_file.name.lower().endswith(".csv")
-            df0 = pd.read_csv(up_file) if is_csv else pd.read_excel(up_file)
-            df_cols = df0.columns
+            df_cols = _table_columns(up_file.getvalue(), up_file.name)
             with st.expander("**Legend / Label columns**", expanded=False):
                 stn = st.selectbox("Station ID", df_cols)
                 at = st.selectbox("Attribute", df_cols)
@@ -215,8 +246,18 @@ if view == "Map":
             with st.expander("**Legend header**", expanded=False):
                 head1 = st.text_input("Header line 1", value=f"{stn} – {at}")
                 head2 = st.text_input("Header line 2 (optional)", value="")
+            utm_cols = None
+            if coord_fmt == "UTM":
+                with st.expander("**UTM columns**", expanded=True):
+                    guess = detect_utm_columns(df_cols)
+                    e_col = st.selectbox("Easting", list(df_cols), index=_index_of(list(df_cols), guess[0]))
+                    n_col = st.selectbox("Northing", list(df_cols), index=_index_of(list(df_cols), guess[1]))
+                    z_col = st.selectbox("Zone", list(df_cols), index=_index_of(list(df_cols), guess[2]))
+                    h_opts = ["(letter in zone, e.g. 43Q)"] + list(df_cols)
+                    h_col = st.selectbox("Hemisphere / band letter", h_opts, index=_index_of(h_opts, guess[3]))
+                utm_cols = (e_col, n_col, z_col, None if h_col == h_opts[0] else h_col)
         else:
-            stn = at = lab = head1 = head2 = None
+            stn = at = lab = head1 = head2 = utm_cols = None
         with st.expander("**Export**", expanded=False):
             fmt = st.selectbox("Format", ["PNG","JPEG"]) 
             dpi = st.slider("DPI", 100, 600, 300)
@@ -230,365 +271,123 @@ if view == "Map":
             st.link_button("💬 Feedback", "https://forms.gle/pF2LAJ76gniiiT2a7")
 
     if up_file and stn and at and lab:
-        # Coordinates
-        lat_col = _find_col(df0.columns, ["lat","latitude","lat_dd","y","ycoord","y_coord"])
-        lon_col = _find_col(df0.columns, ["lon","long","longitude","lon_dd","x","xcoord","x_coord"])
-        if not lat_col or not lon_col:
-            st.error("❌ Couldn’t detect latitude/longitude columns."); st.stop()
-        try:
-            df = convert_coords(df0, coord_fmt, lat_col, lon_col)
-        except Exception as e:
-            st.error("❌ Coordinate conversion crashed."); st.exception(e); st.stop()
-        if df is None or "Lat_DD" not in df.columns or "Lon_DD" not in df.columns:
-            st.error("❌ Converted coordinate columns not found."); st.stop()
-        if df["Lat_DD"].isnull().all() or df["Lon_DD"].isnull().all():
-            st.error("❌ Coordinate conversion failed. Make sure you've selected the proper coordinate format as per your data"); st.stop()
-
-        # Extent (safe)
-        if auto_ext:
-            lo, hi = df["Lon_DD"].agg(["min","max"]) ; la, lb = df["Lat_DD"].agg(["min","max"])
-            if hi == lo: hi, lo = hi + 0.01, lo - 0.01
-            if lb == la: lb, la = lb + 0.01, la - 0.01
-            bounds = (
-                lo - (hi - lo) * margin / 100.0,
-                hi + (hi - lo) * margin / 100.0,
-                la - (lb - la) * margin / 100.0,
-                lb + (lb - la) * margin / 100.0,
-            )
-        else:
-            bounds = get_buffered_extent(df, buffer_deg)
-        bounds = _safe_extent(bounds)
-
-        # Figure
-        halo = [pe.withStroke(linewidth=3, foreground="white")]
-        fig = plt.figure(figsize=get_page_size(p_sz, ori), dpi=dpi)
-        ax = fig.add_subplot(111, projection=ccrs.PlateCarree())
-        ax.set_extent(bounds, crs=ccrs.PlateCarree())
-        fig.subplots_adjust(left=0.05, right=0.95, top=0.95, bottom=0.05)
-
-        # Base
-        ax.add_feature(cfeature.LAND.with_scale("50m"), fc=land_col)
-        ax.add_feature(cfeature.OCEAN.with_scale("50m"), fc=ocean_col)
-        ax.add_feature(cfeature.BORDERS, ls=":"); ax.add_feature(cfeature.COASTLINE)
-
-        # Grid
-        tol = 1e-9
-        xt = np.arange(bounds[0], bounds[1] + g_int, g_int)
-        yt = np.arange(bounds[2], bounds[3] + g_int, g_int)
-        # keep only interior ticks (remove edges)
-        xt_in = xt[(xt > bounds[0] + tol) & (xt < bounds[1] - tol)]
-        yt_in = yt[(yt > bounds[2] + tol) & (yt < bounds[3] - tol)]
-        if grid_on:
-            gl = ax.gridlines(draw_labels=True, xlocs=xt, ylocs=yt, color=g_col, ls=g_style, lw=g_wid)
-            gl.top_labels = gl.right_labels = True
-            gl.xlabel_style = gl.ylabel_style = {"size": axis_f}
-            gl.xformatter = (mticker.FuncFormatter(dms_fmt_lon) if axis_fmt=="DMS" else mticker.FuncFormatter(dd_fmt_lon))
-            gl.yformatter = (mticker.FuncFormatter(dms_fmt_lat) if axis_fmt=="DMS" else mticker.FuncFormatter(dd_fmt_lat))
-        else:                     
-            ax.set_xticks(xt_in, crs=ccrs.PlateCarree()); ax.set_yticks(yt_in, crs=ccrs.PlateCarree())
-            if axis_fmt == "DMS":
-                ax.xaxis.set_major_formatter(mticker.FuncFormatter(dms_fmt_lon))
-                ax.yaxis.set_major_formatter(mticker.FuncFormatter(dms_fmt_lat))
-            else:
-                ax.xaxis.set_major_formatter(mticker.FuncFormatter(dd_fmt_lon))
-                ax.yaxis.set_major_formatter(mticker.FuncFormatter(dd_fmt_lat))
-
-            ax.tick_params(
-                axis="both", direction="out", length=4, width=g_wid, color=g_col,
-                labelsize=axis_f, #bottom=True, top=False, left=True, right=False
-            )
+        config = dict(
+            auto_extent=auto_ext, margin_pct=margin, buffer_deg=buffer_deg,
+            overlay=ov_file, show_overlay=show_ov, overlay_color=ov_main_color,
+            land_color=land_col, ocean_color=ocean_col, basemap_scale=bm_scale, basemap_simplify=bm_simplify,
+            markers_on=markers_on, marker_shape=shape, marker_color=m_col, marker_size=m_size,
+            marker_edge_on=m_edge_on, marker_edge_color=m_edge_col, marker_edge_width=m_edge_w,
+            marker_halo_on=m_halo_on, marker_halo_color=m_halo_col, marker_halo_width=m_halo_w,
+            symbology=symbology, class_method=cls_method, class_count=cls_k, class_cmap=cls_cmap, category_cmap=cat_cmap,
+            class_sizes=cls_sizes, class_size_min=cls_smin, class_size_max=cls_smax,
+            point_mode=point_mode, density_threshold=dens_thr, density_shape=dens_shape, density_cell_px=dens_cell,
+            density_cmap=dens_cmap, density_log=dens_log, density_legend_pos=None if dens_leg == "none" else dens_leg,
+            heatmap_on=heat_on, heatmap_bandwidth_km=heat_bw, heatmap_cmap=heat_cmap, heatmap_alpha=heat_alpha,
+            heatmap_legend_pos=None if heat_leg == "none" else heat_leg,
+            show_labels=show_lab, label_dx=dx, label_dy=dy,
+            grid_on=grid_on, grid_interval=g_int, grid_color=g_col, grid_style=g_style, grid_width=g_wid, axis_format=axis_fmt,
+            station_col=stn, attribute_col=at, label_col=lab, legend_header=[head1, head2],
+            legend_on=leg_on, legend_pos=leg_pos,
+            scalebar_on=sb_on, scalebar_length=sb_len, scalebar_segments=sb_seg, scalebar_thickness=sb_thk,
+            scalebar_pos=sb_pos, scalebar_unit=sb_unit,
+            north_on=na_on, north_pos=na_pos, north_color=na_col,
+            north_arrow_halo_on=na_arrow_halo_on, north_arrow_halo_color=na_arrow_halo_col, north_arrow_halo_width=na_arrow_halo_w,
+            inset_on=inset_on, inset_pos=inset_pos, inset_size_pct=inset_size,
+            inset_extent_mode=extent_mode, inset_extent_pad=extent_pad, inset_rect_color=inset_rect_color,
+            inset_overlay=inset_ov, inset_overlay_color=inset_ov_color, inset_frame=frame_on, inset_frame_lw=frame_lw,
+            ne_countries_path=NE_COUNTRIES_ZIP,
+            declutter_on=declutter_on, declutter_mode=declutter_mode, label_drop=label_drop, declutter_budget_s=declutter_budget, cluster_on=cluster_on, cluster_km=cluster_km, cluster_hierarchy=True,
+            show_cluster_counts=show_cluster_counts, local_insets=local_insets, max_insets=max_insets,
+            cluster_anchor=cluster_anchor, connector_color=conn_color, connector_lw=conn_lw,
+            inset_label_color=inset_label_color, inset_label_halo=inset_label_halo,
+            inset_label_halo_width=inset_label_halo_w, inset_label_align=inset_label_align,
+            inset_label_dx=inset_lbl_dx, inset_label_dy=inset_lbl_dy,
+            cluster_inset_size_pct=cluster_inset_size_pct, cluster_marker_size=cluster_marker_size,
+            cluster_label_size=cluster_label_size, cluster_frame_lw=cluster_frame_lw,
+            cluster_offset_frac=cluster_offset_frac,
+            custom_on=custom_on, custom_text=custom_txt, custom_x=custom_x, custom_y=custom_y,
+            custom_fontsize=custom_fs, custom_color=custom_col, custom_bold=custom_bold, custom_italic=custom_ital,
+            custom_rotation=custom_rot, custom_ha=custom_ha, custom_va=custom_va,
+            custom_box=custom_box, custom_box_fc=custom_box_fc, custom_box_ec=custom_box_ec, custom_box_alpha=custom_box_alpha,
+            custom_halo=custom_halo, custom_halo_width=custom_halo_w, custom_halo_color=custom_halo_col,
+            axis_fontsize=axis_f, label_fontsize=label_f, legend_fontsize=legend_f, scalebar_fontsize=sb_f, north_fontsize=north_f,
+            format=fmt, dpi=dpi, page_size=p_sz, orientation=ori,
+        )
 
-        # Overlay on main map
-        if ov_file and show_ov:
+        # Preview at screen resolution; the full-DPI export renders only on download
+        preview_config = {**config, "dpi": PREVIEW_DPI, "format": "PNG"}
+        raw = up_file.getvalue()
+        data_digest = digest_bytes(raw)
+        coords = coord_spec(coord_fmt, utm_cols)
+
+        # Render cache: same upload bytes + coordinate format + style → stored image
+        cache = get_render_cache()
+        key = render_key(data_digest, coords, preview_config)
+        img = cache.get(key)
+        reports = st.session_state.setdefault("declutter_reports", OrderedDict())
+        if key in reports:
+            reports.move_to_end(key)
+        if img is None:
+            # Coordinates
             try:
-                overlay_gdf(ov_file).to_crs("EPSG:4326").plot(ax=ax, edgecolor=ov_main_color, facecolor="none", lw=1)
+                df = ingest_stations(raw, up_file.name, coord_fmt, utm_cols, keep=(stn, at, lab), digest=data_digest)
+            except ValueError as e:
+                st.error(f"❌ {e}"); st.stop()
             except Exception as e:
-                st.warning(f"Overlay could not be rendered: {e}")
-
-        # ===== Cluster & Declutter integration =====
-        plot_df = df.copy(); clusters = None
-        if cluster_on:
-            rep_df, clusters = greedy_cluster(df, "Lat_DD", "Lon_DD", float(cluster_km))
-            plot_df = rep_df
-
-        # Markers
-        # Optional halo stroke (draw first, underneath)
-        if m_halo_on and m_halo_w > 0:
-            ax.scatter(
-                plot_df["Lon_DD"], plot_df["Lat_DD"],
-                s=m_size**2, c=m_col, marker=shape_map[shape],
-                edgecolors=m_halo_col, linewidths=m_halo_w,
-                transform=ccrs.PlateCarree(), zorder=4
-            )
-
-        # Main markers (+ optional border)
-        edgecols = m_edge_col if m_edge_on and m_edge_w > 0 else "none"
-        edgew    = m_edge_w if m_edge_on and m_edge_w > 0 else 0.0
-
-        ax.scatter(
-            plot_df["Lon_DD"], plot_df["Lat_DD"],
-            s=m_size**2, c=m_col, marker=shape_map[shape],
-            edgecolors=edgecols, linewidths=edgew,
-            transform=ccrs.PlateCarree(), zorder=5
-        )
-
-
-        # Labels (counts for clusters; label-of-representative otherwise)
-        texts = []
-        if show_lab:
-            if cluster_on and clusters is not None:
-                for _, r in plot_df.iterrows():
-                    cid  = int(r.get("cluster_id", -1))
-                    size = int(r.get("cluster_size", 1))
-                    rep_idx = clusters.get(cid, [None])[0]
-                    label = str(size) if (size > 1 and show_cluster_counts) else (str(df.iloc[rep_idx][lab]) if rep_idx is not None and lab in df.columns else "")
-                    t = ax.text(r["Lon_DD"] + dx, r["Lat_DD"] + dy, label, fontsize=label_f, transform=ccrs.PlateCarree(), path_effects=halo, clip_on=True)
-                    texts.append(t)
-            else:
-                for _, r in plot_df.iterrows():
-                    t = ax.text(r["Lon_DD"] + dx, r["Lat_DD"] + dy, str(r[lab]), fontsize=label_f, transform=ccrs.PlateCarree(), path_effects=halo, clip_on=True)
-                    texts.append(t)
-
-        # Declutter labels if requested
-        if show_lab and declutter_on and texts:
-            declutter_texts(ax, texts)
-
-        # Local mini-insets for biggest clusters (adjacent placement + label styles)
-        if cluster_on and local_insets and clusters:
-            draw_cluster_insets(
-                ax, df, clusters,
-                max_insets=max_insets, pad_deg=0.2, box_frac=float(cluster_inset_size_pct)/100.0,
-                land_color=land_col, ocean_color=ocean_col, marker_color=m_col, marker_size=int(cluster_marker_size),
-                show_labels=True, label_col=lab, label_fontsize=int(cluster_label_size),
-                label_color=inset_label_color, label_align=inset_label_align,
-                label_halo=inset_label_halo, label_halo_width=float(inset_label_halo_w),
-                label_offset_px=(inset_lbl_dx, inset_lbl_dy),
-                anchor=cluster_anchor, offset_frac=float(cluster_offset_frac),
-                frame_lw=float(cluster_frame_lw), link=True, link_color=conn_color, link_lw=float(conn_lw),
-            )
-
-        # Global inset overview (figure-level)
-        if inset_on:
-            draw_inset_overview(
-                ax_main=ax, bounds=bounds,
-                overlay_path=ov_file if inset_ov else None, plot_overlay=inset_ov,
-                inset_pos=inset_pos, inset_size_pct=inset_size,
-                aoi_edge_color=inset_rect_color, overlay_edge_color=inset_ov_color,
-                land_color=land_col, ocean_color=ocean_col,
-                extent_mode=extent_mode, extent_pad_deg=extent_pad,
-                inset_frame=frame_on, inset_frame_lw=frame_lw,
-                ne_countries_path=NE_COUNTRIES_ZIP,
-            )
-            
-            
-        # Legend / Scale / North Arrow (draw after labels, clip to axes)
-        if leg_on:
-            # Build rows + bold header text
-            rows = df[[stn, at]].astype(str).agg(" – ".join, axis=1)
-            max_items = 50
-            rows = list(rows.head(max_items)) + ([f"... (+{len(df)-max_items} more)"] if len(df) > max_items else [])
-            header_lines = [h for h in [head1, head2] if h]
-            if header_lines:
-                def _mt(s): return s.replace("{","\\{").replace("}","\\}")
-                bold_header = "\n".join([rf"$\bf{{{_mt(h)}}}$" for h in header_lines])
-                leg_text = "\n".join([bold_header] + rows)
-            else:
-                leg_text = "\n".join(rows)
-
-            # if leg_table:
-            #     # === TABLE LEGEND (aligned columns, no borders, auto width/height) ===
-            #     from matplotlib.table import Table
-                
-
-            #     # data for table
-            #     _df_ = df[[stn, at]].astype(str).head(max_items)
-            #     table_data = _df_.values.tolist()
-
-            #     # Robust column headers (avoid duplicates)
-            #     def _table_headers(stn, at, head1, head2):
-            #         if head2 and head2.strip():
-            #             h1 = (head1 or str(stn)).strip()
-            #             h2 = (head2 or str(at)).strip()
-            #         else:
-            #             h1 = h2 = None
-            #             if head1:
-            #                 for delim in ["–", "-", "|", ",", "/"]:
-            #                     if delim in head1:
-            #                         p1, p2 = [p.strip() for p in head1.split(delim, 1)]
-            #                         if p1 and p2:
-            #                             h1, h2 = p1, p2
-            #                             break
-            #             if not h1 or not h2:
-            #                 h1 = str(stn).strip()
-            #                 h2 = str(at).strip()
-            #         if h1 == h2:
-            #             h2 = str(at).strip() if h1 != str(at).strip() else "Value"
-            #         return [h1, h2]
-                
-            #     col_labels = _table_headers(stn, at, head1, head2)
-                
-            #     # Start with a tiny inset; we will resize and move it after measuring content
-            #     tbl_ax = ax.inset_axes([0, 0, 0.01, 0.01], transform=ax.transAxes)
-            #     tbl_ax.axis("off")
-
-            #     tbl = tbl_ax.table(
-            #         cellText=table_data,
-            #         colLabels=col_labels,
-            #         loc="upper left",
-            #         cellLoc="left",
-            #     )
-            #     tbl.auto_set_font_size(False)
-            #     tbl.set_fontsize(legend_f)
-            #     tbl.scale(1.0, 1.2)
-
-            #     try:
-            #         tbl.auto_set_column_width(col=list(range(len(col_labels))))
-            #     except Exception:
-            #         pass
-                
-            #     # Style: bold header, no borders
-            #     for (r, c), cell in tbl.get_celld().items():
-            #         if r == 0:
-            #             cell.set_text_props(fontweight="bold")
-            #             cell.set_facecolor("#f4f4f4")
-            #         cell.set_linewidth(0.0)
-            #         cell.set_edgecolor((0, 0, 0, 0))
-
-            #     # --- Measure & size ---
-            #     fig.canvas.draw()
-            #     renderer = fig.canvas.get_renderer()
-            #     bb_pix = tbl.get_window_extent(renderer=renderer).expanded(1.05, 1.10)  # padding
-            #     ax_w_pix, ax_h_pix = ax.bbox.width, ax.bbox.height
-            #     w_frac = min(bb_pix.width  / ax_w_pix, 0.95)
-            #     h_frac = min(bb_pix.height / ax_h_pix, 0.95)
-                
-            #     # --- Positioning by lower-left corner (no anchors) ---
-            #     pad = 0.01
-            #     if leg_pos == "upper left":
-            #         x = pad
-            #         y = 1.0 - pad - h_frac
-            #     elif leg_pos == "upper right":
-            #         x = 1.0 - pad - w_frac
-            #         y = 1.0 - pad - h_frac
-            #     elif leg_pos == "lower left":
-            #         x = pad
-            #         y = pad
-            #     elif leg_pos == "lower right":
-            #         x = 1.0 - pad - w_frac
-            #         y = pad
-            #     elif leg_pos == "center left":
-            #         x = pad
-            #         y = 0.5 - h_frac / 2.0
-            #     elif leg_pos == "center right":
-            #         x = 1.0 - pad - w_frac
-            #         y = 0.5 - h_frac / 2.0
-            #     else:
-            #         # default: upper right
-            #         x = 1.0 - pad - w_frac
-            #         y = 1.0 - pad - h_frac
-
-            #     # Clamp inside [0,1] just in case
-            #     x = max(0.0, min(x, 1.0 - w_frac))
-            #     y = max(0.0, min(y, 1.0 - h_frac))
-                
-            #     tbl_ax.set_position([x, y, w_frac, h_frac], which="active")
-            #     tbl_ax.set_clip_on(True)
-            #     tbl_ax.set_clip_path(ax.patch)
-
-            # else:
-            # === TEXT LEGEND (your original, now correctly separated) ===
-            box = dict(boxstyle="round", fc="white", ec="black", alpha=0.8)
-            pos_map = {
-                "upper left":  (0.01, 0.99),
-                "upper right": (0.99, 0.99),
-                "lower left":  (0.01, 0.01),
-                "lower right": (0.99, 0.01),
-                "center left": (0.01, 0.50),
-                "center right":(0.99, 0.50),
-            }
-            xp, yp = pos_map[leg_pos]
-            lt = ax.text(
-                xp, yp, leg_text, transform=ax.transAxes, fontsize=legend_f,
-                ha=("left" if "left" in leg_pos else "right"),
-                va=("top"  if "upper" in leg_pos else "bottom" if "lower" in leg_pos else "center"),
-                bbox=box
-            )
-            lt.set_clip_on(True); lt.set_clip_path(ax.patch)
-
-        # Scale-bar
-        if sb_on:
-            km_len = sb_len if sb_unit == "km" else sb_len * 1.60934
-            draw_scale_bar(ax, bounds, km_len, sb_seg, sb_thk, sb_pos, sb_unit, sb_f)
-
-        # North Arrow
-        if na_on:
-            pos = {"Top-Right": (0.95, 0.95), "Top-Left": (0.05, 0.95), "Bottom-Right": (0.95, 0.05), "Bottom-Left": (0.05, 0.05)}[na_pos]
-            na = ax.annotate("N", xy=pos, xytext=(pos[0], pos[1] - 0.1), xycoords="axes fraction", ha="center", va="center", fontsize=north_f, color=na_col, arrowprops=dict(facecolor=na_col, width=5, headwidth=15))
-            na.set_clip_on(True); na.set_clip_path(ax.patch)
-          
-        # Halo around the arrow patch
-        patch = getattr(na, "arrow_patch", None)
-        if patch is not None and na_arrow_halo_on and na_arrow_halo_w > 0:
-            patch.set_path_effects([pe.withStroke(linewidth=na_arrow_halo_w, foreground=na_arrow_halo_col)])
-
-            na.set_clip_on(True); na.set_clip_path(ax.patch)
-            
-        #Drawing for Custom Text
-        if custom_on and custom_txt.strip():
-            style = {}
-            if custom_box:
-                style = dict(boxstyle="round", fc=custom_box_fc, ec=custom_box_ec, alpha=custom_box_alpha)
-
-            txt_obj = ax.text(
-                custom_x, custom_y, custom_txt,
-                transform=ax.transAxes, ha=custom_ha, va=custom_va,
-                fontsize=custom_fs, color=custom_col, rotation=custom_rot,
-                fontweight=("bold" if custom_bold else "normal"),
-                style=("italic" if custom_ital else "normal"),
-                bbox=(style if custom_box else None)
-            )
-            txt_obj.set_clip_on(True); txt_obj.set_clip_path(ax.patch)
-
-            if custom_halo and custom_halo_w > 0:
-                txt_obj.set_path_effects([pe.withStroke(linewidth=custom_halo_w, foreground=custom_halo_col)])
-
-
-        # Watermark
-        wm = ax.text(0.99, 0.01, "CartoZen v1.1.0", transform=ax.transAxes, ha="right", va="bottom", fontsize=11, color="gray", alpha=0.6)
-        wm.set_clip_on(True); wm.set_clip_path(ax.patch)
-
-        # Export (avoid tight bbox when any inset present)
-        tmp = tempfile.mkdtemp(); out = os.path.join(tmp, f"map.{fmt.lower()}")
-        fig.canvas.draw()
-        try:
-            if inset_on or getattr(fig, "_cz_has_local_insets", False):
-                fig.savefig(out, format=fmt.lower(), dpi=dpi)
-            else:
-                fig.savefig(out, bbox_inches="tight", pad_inches=0.3, format=fmt.lower(), dpi=dpi)
-        except Exception:
-            fig.savefig(out, format=fmt.lower(), dpi=dpi)
-        plt.close()
-
-        with open(out, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-
-        st.markdown(
-            f'<a href="data:image/{fmt.lower()};base64,{b64}" '
-            f'download="station_map.{fmt.lower()}">📥 Download Map</a>',
-            unsafe_allow_html=True,
+                st.error("❌ Coordinate conversion crashed."); st.exception(e); st.stop()
+
+            # Render (headless engine); surface non-fatal problems as warnings
+            report = {}
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always", RenderWarning)
+                img = render_map(df, preview_config, report=report)
+            reports[key] = report.get("declutter")
+            while len(reports) > MAX_DECLUTTER_REPORTS:
+                reports.popitem(last=False)
+            for w in caught:
+                if issubclass(w.category, RenderWarning):
+                    st.warning(str(w.message))
+            cache.put(key, img)
+
+        def _export_bytes(raw=raw, name=up_file.name, coord_fmt=coord_fmt, utm_cols=utm_cols,
+                          keep=(stn, at, lab), config=config, data_digest=data_digest):
+            # runs on click, in its own thread; served from the cache when unchanged
+            def _render():
+                df = ingest_stations(raw, name, coord_fmt, utm_cols, keep=keep, digest=data_digest)
+                return render_map(df, config)
+            return cache.get_or_render(render_key(data_digest, coord_spec(coord_fmt, utm_cols), config), _render)
+
+        ext = fmt.lower()
+        st.download_button(
+            f"📥 Download Map ({fmt}, {dpi} dpi)", data=_export_bytes,
+            file_name=f"station_map.{ext}", mime=f"image/{ext}",
         )
 
         # Fit image to screen height (~calc 85vh leaves room for sidebar/header)
+        b64 = base64.b64encode(img).decode()
+        max_h = "none" if full else "85vh"
         st.markdown(
             f"""
             <div style="display:flex; justify-content:center;">
-                <img src="data:image/{fmt.lower()};base64,{b64}"
-                    style="max-width:100%; max-height:85vh; object-fit:contain;" />
+                <img src="data:image/png;base64,{b64}"
+                    style="max-width:100%; max-height:{max_h}; object-fit:contain;" />
             </div>
             """,
             unsafe_allow_html=True,
         )
 
+        # Declutter report of this preview (kept for the last MAX_DECLUTTER_REPORTS render keys)
+        rep = reports.get(key)
+        if declutter_on and show_lab and rep:
+            if rep["engine"] == "place":
+                st.caption(f"Declutter: place — {rep['placed']}/{rep['labels']} labels placed, "
+                           f"{rep['dropped']} dropped, {rep['seconds']:.2f} s")
+            else:
+                its = "" if rep["iterations"] is None else f", {rep['iterations']} iterations"
+                st.caption(f"Declutter: {rep['engine']}{its}, {rep['seconds']:.2f} s ({rep['stopped']}) — "
+                           f"overlaps {rep['overlaps_before']} → {rep['overlaps_after']}, "
+                           f"labels moved {rep['displacement_px']:.0f} px in total")
+
 
 elif view == "About":
     try:
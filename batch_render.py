@@ -0,0 +1,139 @@
+# batch_render.py — render many station maps from recipe files (no browser needed)
+#
+#   python batch_render.py recipes/*.json --jobs 8
+#
+# A recipe is a JSON file describing which station tables to render and how:
+#
+#   {
+#     "data": ["stations/*.csv", "extra/site_42.xlsx"],   # globs, relative to the recipe
+#     "coord_format": "Decimal Degrees",                   # DMS | Decimal Degrees | UTM
+#     "utm_columns": ["E", "N", "Zone", "Hemisphere"],     # UTM only (default: first 4 columns)
+#     "output_dir": "maps",                                # relative to the recipe
+#     "config": {"marker_color": "#ff0000", "dpi": 200, "overlay": "rivers.zip"}
+#   }
+#
+# "config" accepts any key of utils.render_engine.DEFAULT_CONFIG. Each matched
+# table is written to <output_dir>/<table stem>.<png|jpeg>. Tables are rendered
+# in parallel with a process pool (one Matplotlib/Cartopy state per worker).
+# Unchanged tables with unchanged recipes are served from the render cache
+# (utils/render_cache.py) unless --no-cache is given.
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use("Agg")
+
+from utils.render_engine import coord_spec, prepare_stations, read_station_table, render_map
+from utils.render_cache import digest_bytes, get_render_cache, render_key
+
+# config keys holding file paths, resolved relative to the recipe
+_PATH_KEYS = ("overlay", "ne_countries_path")
+
+
+def _resolve(base, path):
+    return path if os.path.isabs(path) else os.path.normpath(os.path.join(base, path))
+
+
+def load_recipe_jobs(recipe_path, output_dir=None):
+    """Expand one recipe into a list of render jobs (dicts)."""
+    with open(recipe_path, "r", encoding="utf-8") as f:
+        recipe = json.load(f)
+    base = os.path.dirname(os.path.abspath(recipe_path))
+
+    config = dict(recipe.get("config", {}))
+    for key in _PATH_KEYS:
+        if config.get(key):
+            config[key] = _resolve(base, config[key])
+
+    patterns = recipe.get("data", [])
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    files = []
+    for pat in patterns:
+        files.extend(sorted(glob.glob(_resolve(base, pat))))
+    if not files:
+        raise ValueError(f"{recipe_path}: no station files match {patterns}")
+
+    out_dir = output_dir or _resolve(base, recipe.get("output_dir", "maps"))
+    ext = str(config.get("format", "PNG")).lower()
+    return [
+        {
+            "recipe": recipe_path,
+            "data": path,
+            "coord_format": recipe.get("coord_format", "Decimal Degrees"),
+            "utm_columns": recipe.get("utm_columns"),
+            "config": config,
+            "out": os.path.join(out_dir, f"{os.path.splitext(os.path.basename(path))[0]}.{ext}"),
+        }
+        for path in files
+    ]
+
+
+def render_job(job):
+    """Render one station table to disk. Returns (job, error message or None)."""
+    try:
+        img = key = None
+        if job.get("use_cache", True):
+            with open(job["data"], "rb") as f:
+                coords = coord_spec(job["coord_format"], job.get("utm_columns"))
+                key = render_key(digest_bytes(f.read()), coords, job["config"])
+            img = get_render_cache().get(key)
+        if img is None:
+            df = prepare_stations(read_station_table(job["data"]), job["coord_format"], job.get("utm_columns"))
+            img = render_map(df, job["config"])
+            if key is not None:
+                get_render_cache().put(key, img)
+        os.makedirs(os.path.dirname(job["out"]) or ".", exist_ok=True)
+        with open(job["out"], "wb") as f:
+            f.write(img)
+        return job, None
+    except Exception as e:
+        return job, f"{type(e).__name__}: {e}"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Render CartoZen station maps from recipe files.")
+    ap.add_argument("recipes", nargs="+", help="recipe JSON file(s)")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    ap.add_argument("-o", "--output-dir", default=None, help="override every recipe's output_dir")
+    ap.add_argument("--no-cache", action="store_true", help="always re-render (skip the render cache)")
+    args = ap.parse_args(argv)
+
+    jobs = []
+    for recipe in args.recipes:
+        try:
+            jobs.extend(load_recipe_jobs(recipe, args.output_dir))
+        except Exception as e:
+            print(f"✗ {recipe}: {e}", file=sys.stderr)
+            return 2
+    for job in jobs:
+        job["use_cache"] = not args.no_cache
+
+    t0 = time.perf_counter()
+    failed = 0
+    if args.jobs <= 1:
+        results = map(render_job, jobs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=args.jobs)
+        results = (f.result() for f in as_completed([pool.submit(render_job, j) for j in jobs]))
+    for job, err in results:
+        if err:
+            failed += 1
+            print(f"✗ {job['data']}: {err}", file=sys.stderr)
+        else:
+            print(f"✓ {job['out']}")
+    if args.jobs > 1:
+        pool.shutdown()
+
+    print(f"{len(jobs) - failed}/{len(jobs)} maps rendered in {time.perf_counter() - t0:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
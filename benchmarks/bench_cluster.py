@@ -0,0 +1,73 @@
+# benchmarks/bench_cluster.py — greedy_cluster: grid-indexed vs. original O(n^2) loop
+#
+#   python benchmarks/bench_cluster.py                    # 1k / 10k / 100k / 1M points
+#   python benchmarks/bench_cluster.py --sizes 1000 5000 --threshold 12
+#
+# Points are uniform over a ~2000 km box (a national station network). The
+# reference loop is only run up to --naive-max points; where it runs, cluster
+# assignments and seed order are checked for equality.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.cluster_utils import _haversine_km, greedy_cluster  # noqa: E402
+
+
+def naive_greedy_cluster(df, lat_col, lon_col, threshold_km):
+    """The pre-index implementation, kept verbatim as the reference."""
+    coords = df[[lat_col, lon_col]].to_numpy()
+    n = len(coords)
+    unassigned = set(range(n))
+    clusters = {}
+    cid = 0
+    while unassigned:
+        i = min(unassigned)
+        unassigned.remove(i)
+        members = [i]
+        lat_i, lon_i = coords[i]
+        for j in list(unassigned):
+            lat_j, lon_j = coords[j]
+            if _haversine_km(lat_i, lon_i, lat_j, lon_j) <= threshold_km:
+                members.append(j)
+                unassigned.remove(j)
+        clusters[cid] = members
+        cid += 1
+    return clusters
+
+
+def make_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"Lat_DD": rng.uniform(8.0, 26.0, n), "Lon_DD": rng.uniform(68.0, 88.0, n)})
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    ap.add_argument("--threshold", type=float, default=12.0, help="cluster distance (km)")
+    ap.add_argument("--naive-max", type=int, default=10_000, help="largest n for the O(n^2) reference")
+    args = ap.parse_args(argv)
+
+    print(f"{'n':>10} {'clusters':>9} {'indexed s':>10} {'naive s':>9} {'speedup':>8}  identical")
+    for n in args.sizes:
+        df = make_points(n)
+        t0 = time.perf_counter()
+        rep_df, clusters = greedy_cluster(df, "Lat_DD", "Lon_DD", args.threshold)
+        t_idx = time.perf_counter() - t0
+        if n <= args.naive_max:
+            t0 = time.perf_counter()
+            ref = naive_greedy_cluster(df, "Lat_DD", "Lon_DD", args.threshold)
+            t_ref = time.perf_counter() - t0
+            same = "yes" if ref == clusters else "NO"
+            print(f"{n:>10,} {len(rep_df):>9,} {t_idx:>10.3f} {t_ref:>9.2f} {t_ref / t_idx:>7.0f}x  {same}")
+        else:
+            print(f"{n:>10,} {len(rep_df):>9,} {t_idx:>10.3f} {'-':>9} {'-':>8}  -")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# build_basemap_pack.py — one-time conversion of Natural Earth layers into an offline pack
+#
+#   python build_basemap_pack.py                                   # all scales → assets/ne_basemap.pack
+#   python build_basemap_pack.py --scales 110m 50m --countries assets/ne_10m_admin_0_countries.zip
+#   python build_basemap_pack.py --source-dir ~/natural_earth -o /srv/cartozen/ne_basemap.pack
+#
+# Land, ocean, coastline and border layers of each scale plus admin-0 countries
+# (ADMIN / CONTINENT) are stored as WKB with a bounds table in one memory-mapped
+# file (utils/basemap_pack.py). The main basemap and the overview inset load
+# from it in milliseconds without shapefiles or network access. Layers are
+# read from --source-dir (ne_<scale>_<layer>.shp|.zip) when given, else from
+# Cartopy's data cache, which downloads missing files once. A pack built from
+# a countries zip also serves inset lookups that name that zip. Point
+# $CARTOZEN_BASEMAP_PACK at the output when it is not assets/ne_basemap.pack.
+
+import argparse
+import os
+import sys
+import time
+
+from utils.basemap_pack import build_pack, default_pack_path, get_basemap_pack
+from utils.render_engine import NE_COUNTRIES_ZIP
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build the offline Natural Earth basemap pack.")
+    ap.add_argument("-o", "--output", default=None, help=f"pack file (default: {default_pack_path()})")
+    ap.add_argument("--scales", nargs="+", default=["110m", "50m", "10m"], choices=["110m", "50m", "10m"])
+    ap.add_argument("--source-dir", default=None, help="directory with ne_<scale>_<layer>.shp or .zip files")
+    ap.add_argument("--countries", default=NE_COUNTRIES_ZIP if os.path.exists(NE_COUNTRIES_ZIP) else "110m",
+                    help=f"admin-0 countries: a scale (110m/50m/10m) or a local NE file/zip "
+                         f"(default: {NE_COUNTRIES_ZIP} if present, else 110m)")
+    args = ap.parse_args(argv)
+
+    t0 = time.time()
+    try:
+        out = build_pack(args.output, scales=args.scales, source_dir=args.source_dir, countries=args.countries)
+    except Exception as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    pack = get_basemap_pack(out)
+    print(f"wrote {out} ({os.path.getsize(out) / 1e6:.1f} MB, {len(pack.layers)} layers) in {time.time() - t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+# tests/test_basemap_pack.py — pack bounds table and per-extent decoding
+import numpy as np
+import shapely
+
+from utils.basemap_pack import BasemapPack, write_pack
+
+
+def _pack(tmp_path):
+    boxes = [shapely.box(x, 0, x + 1, 1) for x in range(0, 100, 10)]        # 10 squares along the equator
+    path = write_pack(str(tmp_path / "t.pack"), {"land/50m": (boxes, None)})
+    return BasemapPack(path), np.array(boxes, dtype=object)
+
+
+def test_query_matches_strtree(tmp_path):
+    pack, boxes = _pack(tmp_path)
+    tree = shapely.STRtree(boxes)
+    for x0, x1, y0, y1 in [(5, 25, -1, 2), (11, 19, 0, 1), (-50, -10, 0, 1), (0, 100, 0.5, 0.6), (31, 40, 1, 3)]:
+        expected = np.sort(tree.query(shapely.box(x0, y0, x1, y1)))
+        assert np.array_equal(pack.query("land/50m", (x0, x1, y0, y1)), expected)
+
+
+def test_only_queried_geometries_are_decoded(tmp_path):
+    pack, boxes = _pack(tmp_path)
+    idx = pack.query("land/50m", (15, 35, 0, 1))
+    geoms = pack.geometries("land/50m", idx)
+    assert list(idx) == [2, 3]
+    assert all(g.equals(b) for g, b in zip(geoms, boxes[idx]))
+    assert int(pack._geoms["land/50m"][1].sum()) == 2
+    assert all(g.equals(b) for g, b in zip(pack.geometries("land/50m"), boxes))
@@ -0,0 +1,32 @@
+# tests/test_cluster_utils.py — greedy clustering and the cached hierarchy
+import numpy as np
+import pandas as pd
+
+from utils.cluster_utils import get_cluster_hierarchy, greedy_cluster
+
+
+def _stations(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"Lat_DD": rng.uniform(10, 12, n), "Lon_DD": rng.uniform(70, 72, n)})
+
+
+def _same(a, b):
+    rep_a, cl_a = a
+    rep_b, cl_b = b
+    assert {k: list(v) for k, v in cl_a.items()} == {k: list(v) for k, v in cl_b.items()}
+    pd.testing.assert_frame_equal(rep_a.reset_index(drop=True), rep_b.reset_index(drop=True), check_dtype=False)
+
+
+def test_hierarchy_matches_greedy():
+    df = _stations()
+    for km in (3, 12, 30):
+        _same(get_cluster_hierarchy(df, max_km=50).resolve(km), greedy_cluster(df, "Lat_DD", "Lon_DD", km))
+
+
+def test_hierarchy_not_reused_for_reordered_rows():
+    df = _stations(seed=1)
+    get_cluster_hierarchy(df, max_km=50).resolve(12)
+    rev = df.iloc[::-1].reset_index(drop=True)
+    h = get_cluster_hierarchy(rev, max_km=50)
+    assert h is not get_cluster_hierarchy(df, max_km=50)
+    _same(h.resolve(12), greedy_cluster(rev, "Lat_DD", "Lon_DD", 12))
@@ -0,0 +1,34 @@
+# tests/test_ingest.py — compact station tables and their disk copy
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import ingest, render_cache
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("CARTOZEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(render_cache, "_caches", {})
+    monkeypatch.setattr(ingest, "_frames", type(ingest._frames)())
+    return tmp_path
+
+
+def test_coordinates_keep_full_precision_through_disk_cache(cache_dir):
+    # fractional parts >= .6 so the Decimal Degrees reader does not treat them as DMM
+    lat = np.array([12.745678912345, -33.900000123456, 45.65])
+    lon = np.array([77.723456789012, 151.6093000001, -73.86])
+    raw = pd.DataFrame({"Station": ["A", "B", "C"], "lat": lat, "lon": lon}).to_csv(index=False).encode()
+
+    first = ingest.ingest_stations(raw, "s.csv", "Decimal Degrees", keep=("Station",))
+    ingest._frames.clear()                                  # force the Feather copy
+    again = ingest.ingest_stations(raw, "s.csv", "Decimal Degrees", keep=("Station",))
+
+    for df in (first, again):
+        assert df["Lat_DD"].dtype == np.float64
+        # convert_coords rounds to 4 decimals; nothing more may be lost
+        np.testing.assert_array_equal(df["Lat_DD"].to_numpy(), lat.round(4))
+        np.testing.assert_array_equal(df["Lon_DD"].to_numpy(), lon.round(4))
+    assert list(again["Station"]) == ["A", "B", "C"]
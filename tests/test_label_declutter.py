@@ -0,0 +1,50 @@
+# tests/test_label_declutter.py — declutter engine choice and run report
+import inspect
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from utils import label_declutter
+from utils.label_batch import LabelCollection
+
+adjustText = pytest.importorskip("adjustText")
+
+
+def _texts(n=2):
+    fig, ax = plt.subplots()
+    return ax, [ax.text(0.5, 0.5, f"S{i}") for i in range(n)]
+
+
+def test_residual_overlap_is_not_a_budget_stop(monkeypatch):
+    def finished_early(texts, **kwargs):                   # returns at once, overlaps left
+        pass
+    finished_early.__signature__ = inspect.signature(adjustText.adjust_text)
+    monkeypatch.setattr(adjustText, "adjust_text", finished_early)
+    ax, texts = _texts()
+    rep = {}
+    assert label_declutter.declutter_texts(ax, texts, time_budget=5.0, report=rep)
+    assert (rep["engine"], rep["stopped"], rep["overlaps_after"]) == ("adjustText", "residual_overlap", 1)
+
+
+def test_adjusttext_errors_fall_back(monkeypatch):
+    def broken(texts, **kwargs):
+        raise RuntimeError("boom")
+    broken.__signature__ = inspect.signature(adjustText.adjust_text)
+    monkeypatch.setattr(adjustText, "adjust_text", broken)
+    ax, texts = _texts()
+    rep = {}
+    assert not label_declutter.declutter_texts(ax, texts, report=rep)
+    assert rep["engine"] == "fallback"
+
+
+def test_label_collection_handles_take_the_fallback(monkeypatch):
+    monkeypatch.setattr(adjustText, "adjust_text", None)   # would fail if called
+    fig, ax = plt.subplots()
+    coll = ax.add_artist(LabelCollection(np.full(3, 0.5), np.full(3, 0.5), ["A", "B", "C"], transform=ax.transData))
+    rep = {}
+    assert not label_declutter.declutter_texts(ax, coll.labels(), report=rep)
+    assert rep["engine"] == "fallback" and rep["overlaps_before"] == 3
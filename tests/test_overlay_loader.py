@@ -0,0 +1,70 @@
+# tests/test_overlay_loader.py — overlay reading with extent filters
+import io
+
+import geopandas as gpd
+import pytest
+import shapely
+
+from utils.basemap import round_extent
+from utils.overlay_loader import load_overlay, overlay_key, overlay_path, overlay_view
+from utils import render_cache
+
+pytest.importorskip("pyarrow")
+
+EXTENT = (2.2, 3.8, 0.2, 0.8)       # lon0, lon1, lat0, lat1
+
+
+class _Upload(io.BytesIO):
+    """Minimal stand-in for a Streamlit UploadedFile."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def _lines():
+    # ten diagonal segments along x = 0..10
+    return gpd.GeoDataFrame(geometry=[shapely.LineString([(i, 0), (i + 1, 1)]) for i in range(10)], crs="EPSG:4326")
+
+
+def _expected():
+    x0, x1, y0, y1 = round_extent(EXTENT)
+    lines = _lines()
+    return sorted(lines.bounds.minx[lines.intersects(shapely.box(x0, y0, x1, y1))])
+
+
+@pytest.mark.parametrize("covering", [False, True])
+def test_geoparquet_bbox_with_and_without_covering(tmp_path, covering):
+    path = tmp_path / f"lines_{covering}.parquet"
+    _lines().to_parquet(path, write_covering_bbox=covering)      # default: no covering column
+    gdf = load_overlay(str(path), bbox=EXTENT)
+    assert 0 < len(gdf) < 10
+    assert sorted(gdf.bounds.minx) == _expected()
+    assert gdf.crs.to_epsg() == 4326
+
+
+def test_geoparquet_upload_without_covering_renders_view():
+    buf = io.BytesIO()
+    _lines().to_parquet(buf)
+    view = overlay_view(_Upload(buf.getvalue(), "lines.parquet"), EXTENT)
+    assert len(view) == len(_expected())
+    x0, x1, y0, y1 = round_extent(EXTENT)
+    bx0, by0, bx1, by1 = view.total_bounds
+    assert bx0 >= x0 and bx1 <= x1
+
+
+def test_upload_hashed_once_across_keys_and_axes(monkeypatch):
+    buf = io.BytesIO()
+    _lines().to_parquet(buf)
+    data = buf.getvalue()
+    hashed = []
+    digest = render_cache.digest_bytes
+    monkeypatch.setattr(render_cache, "digest_bytes", lambda b: hashed.append(len(b)) or digest(b))
+    up = _Upload(data, "lines.parquet")
+    for layer in ("overlay", "insets"):                     # one config digest per layer key
+        render_cache.config_digest({"layer": layer, "overlay": up})
+    overlay_path(up, EXTENT, 0.01)                          # main map
+    overlay_path(up, (0.0, 10.0, -1.0, 2.0), 0.05)          # overview inset
+    overlay_path(up, EXTENT, 0.01)                          # cache hit on the next rerun
+    assert hashed.count(len(data)) == 1
+    assert overlay_key(up) == overlay_key(_Upload(data, "lines.parquet"))
@@ -0,0 +1,64 @@
+# tests/test_symbology.py — class breaks and attribute classification
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from utils.symbology import classify, jenks_breaks
+
+
+def _brute_jenks(x, k):
+    """Interior breaks minimising the within-class squared deviation over all stations."""
+    x = np.sort(np.asarray(x, dtype=float))
+    u = np.unique(x)
+    best = None
+    for cut in itertools.combinations(range(1, len(u)), k - 1):
+        edges = [u[i - 1] for i in cut]
+        parts = np.split(x, np.searchsorted(x, edges, side="right"))
+        cost = sum(((p - p.mean()) ** 2).sum() for p in parts)
+        if best is None or cost < best[0] - 1e-9:
+            best = (cost, edges)
+    return best[1]
+
+
+def test_jenks_counts_tied_values():
+    # ten stations at 0 outweigh the gap between 5 and 10: the natural break is after 0
+    values = [0.0] * 10 + [4.0, 5.0, 10.0]
+    assert list(jenks_breaks(values, 2)) == [0.0, 0.0, 10.0]
+    assert list(jenks_breaks(np.unique(values), 2)) == [0.0, 5.0, 10.0]
+
+
+def test_jenks_matches_brute_force_on_tied_integers():
+    rng = np.random.default_rng(4)
+    for _ in range(20):
+        x = rng.choice(np.arange(9), size=60, p=rng.dirichlet(np.ones(9)))
+        for k in (2, 3, 4):
+            if len(np.unique(x)) <= k:
+                continue
+            assert list(jenks_breaks(x, k)[1:-1]) == _brute_jenks(x, k)
+
+
+def test_jenks_grouped_large_input_keeps_order():
+    rng = np.random.default_rng(5)
+    x = np.r_[rng.normal(0, 1, 20000), rng.normal(10, 1, 20000)].round(3)
+    edges = jenks_breaks(x, 2)
+    assert edges[0] == x.min() and edges[-1] == x.max()
+    assert 2 < edges[1] < 8
+
+
+def test_classify_graduated_and_missing():
+    codes, labels = classify(pd.Series([1, 2, 3, 4, None, "x"]), "graduated", "equal", 3)
+    assert len(labels) == 3
+    assert list(codes) == [0, 0, 1, 2, -1, -1]
+
+
+def test_classify_keeps_a_class_for_a_tied_minimum():
+    codes, labels = classify(pd.Series([0] * 10 + [4, 5, 10]), "graduated", "jenks", 2)
+    assert labels == ["0", "0 – 10"]
+    assert list(codes) == [0] * 10 + [1, 1, 1]
+
+
+def test_classify_single_value():
+    codes, labels = classify(pd.Series([7.0, 7.0, None]), "graduated", "quantile", 5)
+    assert labels == ["7"]
+    assert list(codes) == [0, 0, -1]
@@ -0,0 +1,231 @@
+# utils/basemap.py — cached, extent-clipped Natural Earth basemap layers
+"""Basemap features drawn from pre-clipped, cached paths.
+
+Usage (main map, overview inset, cluster insets):
+
+from utils.basemap import add_basemap_feature
+
+add_basemap_feature(ax, "ocean", "auto", fc=ocean_color)
+add_basemap_feature(ax, "land", "auto", fc=land_color, simplify=True)
+add_basemap_feature(ax, "borders", "50m", ls=":")
+
+Geometries come from the offline pack (utils/basemap_pack.py) when it is
+installed, else from Cartopy's Natural Earth cache.
+
+Call after the axes extent is set. "auto" picks the Natural Earth scale
+from degrees per output pixel (lod_scale), so a continental preview draws
+110m/50m and a small high-DPI AOI draws 10m; simplify=True additionally
+drops detail below half an output pixel. For an extent, the geometries of
+a (feature, scale) whose bounds intersect it are picked from the pack's
+bounds table (only those are decoded) or, from Cartopy, an STRtree built
+once; they are clipped to the extent rounded outward and turned into one
+compound Matplotlib path, kept in a process-wide LRU keyed by (feature,
+scale, rounded extent). Repeated renders, the overview inset and every cluster
+inset therefore reuse the same clipped paths instead of handing full global
+geometries to Cartopy. Styling matches ax.add_feature(cfeature.LAND, ...) etc.
+Non-PlateCarree axes fall back to Cartopy's FeatureArtist.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+from matplotlib.collections import PathCollection
+from matplotlib.path import Path
+from shapely import STRtree
+
+from utils.basemap_pack import get_basemap_pack
+
+# name: (Natural Earth category, layer, is_polygon, Cartopy's default style)
+FEATURES = {
+    "land":      ("physical", "land", True, dict(edgecolor="none", zorder=-1)),
+    "ocean":     ("physical", "ocean", True, dict(edgecolor="none", zorder=-1)),
+    "coastline": ("physical", "coastline", False, dict(edgecolor="black", facecolor="none", zorder=1.5)),
+    "borders":   ("cultural", "admin_0_boundary_lines_land", False, dict(edgecolor="black", facecolor="none", zorder=1.5)),
+}
+
+# coarsest scale usable down to this many degrees per output pixel (finer → 10m).
+# Natural Earth vertex spacing is roughly 0.3° (110m), 0.1° (50m), 0.02° (10m).
+LOD_LEVELS = (("110m", 0.15), ("50m", 0.03))
+SIMPLIFY_PX = 0.5                # screen tolerance for simplify=True (output pixels)
+
+_MAX_PATHS = 128                 # cached clipped paths (entries)
+_MAX_VERTICES = 30_000_000       # … and their total vertex count
+
+_sources: dict = {}
+_paths: OrderedDict = OrderedDict()
+_paths_vertices = 0
+_lock = threading.Lock()
+
+
+def degrees_per_pixel(extent, width_px, height_px=None) -> float:
+    """Degrees covered by one output pixel (the coarser axis wins)."""
+    dpp = abs(extent[1] - extent[0]) / max(float(width_px), 1.0)
+    if height_px:
+        dpp = max(dpp, abs(extent[3] - extent[2]) / max(float(height_px), 1.0))
+    return dpp
+
+
+def lod_scale(extent, width_px, height_px=None) -> str:
+    """Natural Earth scale ("10m" | "50m" | "110m") for extent drawn at width_px."""
+    dpp = degrees_per_pixel(extent, width_px, height_px)
+    for scale, min_dpp in LOD_LEVELS:
+        if dpp >= min_dpp:
+            return scale
+    return "10m"
+
+
+def simplify_tolerance(extent, width_px, height_px=None, px=SIMPLIFY_PX) -> float:
+    """Simplification tolerance in degrees for px output pixels, rounded down
+    to a power of two so nearby extents share cached paths."""
+    tol = px * degrees_per_pixel(extent, width_px, height_px)
+    return 2.0 ** math.floor(math.log2(tol)) if tol > 0 else 0.0
+
+
+def _source(name, scale):
+    """Function (x0, x1, y0, y1) → geometries of one feature/scale whose
+    bounds intersect that extent, set up once per process. From the offline
+    basemap pack when it has the layer (its bounds table; only those
+    geometries are decoded), else from Cartopy through an STRtree."""
+    key = (name, scale)
+    with _lock:
+        src = _sources.get(key)
+    if src is None:
+        pack = get_basemap_pack()
+        layer = f"{name}/{scale}"
+        if pack is not None and pack.has(layer):
+            def src(ext, pack=pack, layer=layer):
+                return pack.geometries(layer, pack.query(layer, ext))
+        else:
+            category, layer, _, _ = FEATURES[name]
+            geoms = np.array(list(cfeature.NaturalEarthFeature(category, layer, scale).geometries()), dtype=object)
+            geoms = geoms[~shapely.is_missing(geoms) & ~shapely.is_empty(geoms)] if len(geoms) else geoms
+            tree = STRtree(geoms)
+
+            def src(ext, geoms=geoms, tree=tree):
+                x0, x1, y0, y1 = ext
+                return geoms[np.sort(tree.query(shapely.box(x0, y0, x1, y1)))]
+        with _lock:
+            _sources[key] = src
+    return src
+
+
+def round_extent(extent):
+    """Extent padded by 1/4 span and rounded outward to a power-of-two grid.
+
+    The padding keeps the clipped paths covering the axes even when the
+    aspect adjustment widens the visible extent slightly.
+    """
+    x0, x1, y0, y1 = extent
+    span = max(x1 - x0, y1 - y0, 1e-6)
+    x0, x1, y0, y1 = x0 - span / 4, x1 + span / 4, y0 - span / 4, y1 + span / 4
+    step = 2.0 ** math.floor(math.log2(span / 4.0))
+    return (
+        max(-180.0, math.floor(x0 / step) * step), min(180.0, math.ceil(x1 / step) * step),
+        max(-90.0, math.floor(y0 / step) * step), min(90.0, math.ceil(y1 / step) * step),
+    )
+
+
+def geometry_path(geoms, polygons=True, lines=True):
+    """One compound Path for many geometries: polygon rings (MOVETO … CLOSEPOLY,
+    exteriors CCW, holes CW) and/or open linestrings; points are skipped.
+    None when nothing is left."""
+    parts = shapely.get_parts(geoms)
+    kinds = shapely.get_type_id(parts)
+    pieces = []
+    if polygons:
+        rings = shapely.get_rings(shapely.orient_polygons(parts[kinds == 3]))
+        pieces.append((rings, True))
+    if lines:
+        pieces.append((parts[(kinds == 1) | (kinds == 2)], False))
+
+    verts, codes = [], []
+    for sub, closed in pieces:
+        if not len(sub):
+            continue
+        xy, ring = shapely.get_coordinates(sub, return_index=True)
+        if not len(xy):
+            continue
+        c = np.full(len(xy), Path.LINETO, dtype=Path.code_type)
+        starts = np.flatnonzero(np.r_[True, ring[1:] != ring[:-1]])
+        c[starts] = Path.MOVETO
+        if closed:
+            c[np.r_[starts[1:], len(xy)] - 1] = Path.CLOSEPOLY
+        verts.append(xy)
+        codes.append(c)
+    if not verts:
+        return None
+    return Path(np.concatenate(verts), np.concatenate(codes))
+
+
+def clipped_path(name, scale, extent, tolerance=0.0):
+    """Cached compound Path of a feature clipped to extent (lon/lat) and,
+    with tolerance > 0 (degrees), simplified."""
+    global _paths_vertices
+    rext = round_extent(extent)
+    key = (name, scale, rext, tolerance)
+    with _lock:
+        hit = _paths.get(key)
+        if hit is not None:
+            _paths.move_to_end(key)
+            return hit[0]
+
+    sel = _source(name, scale)(rext)
+    x0, x1, y0, y1 = rext
+    if len(sel) and (x0 > -180 or x1 < 180 or y0 > -90 or y1 < 90):
+        sel = shapely.clip_by_rect(sel, x0, y0, x1, y1)
+        sel = sel[~shapely.is_empty(sel)]
+    if len(sel) and tolerance > 0:
+        sel = shapely.simplify(sel, tolerance, preserve_topology=FEATURES[name][2])
+        sel = sel[~shapely.is_empty(sel)]
+    poly = FEATURES[name][2]
+    path = geometry_path(sel, polygons=poly, lines=not poly) if len(sel) else None
+
+    n = len(path.vertices) if path is not None else 0
+    with _lock:
+        _paths[key] = (path, n)
+        _paths_vertices += n
+        while len(_paths) > 1 and (len(_paths) > _MAX_PATHS or _paths_vertices > _MAX_VERTICES):
+            _, (_, dropped) = _paths.popitem(last=False)
+            _paths_vertices -= dropped
+    return path
+
+
+def _is_plate_carree(ax):
+    proj = getattr(ax, "projection", None)
+    return isinstance(proj, ccrs.PlateCarree) and float(proj.proj4_params.get("lon_0", 0.0)) == 0.0
+
+
+def add_basemap_feature(ax, name, scale="auto", extent=None, simplify=False, **kwargs):
+    """Draw a Natural Earth feature on a GeoAxes like ax.add_feature(...).
+
+    scale: "10m" | "50m" | "110m" | "auto" (lod_scale for the axes' pixel size
+           at the figure DPI)
+    simplify: drop detail below SIMPLIFY_PX output pixels
+    kwargs: Matplotlib collection styling (fc/facecolor, ec, lw, ls, zorder, …)
+    """
+    if extent is None:
+        extent = ax.get_extent(ccrs.PlateCarree())
+    width_px, height_px = ax.bbox.width, ax.bbox.height
+    if scale == "auto":
+        scale = lod_scale(extent, width_px, height_px)
+    category, layer, _, style = FEATURES[name]
+    if not _is_plate_carree(ax):
+        return ax.add_feature(cfeature.NaturalEarthFeature(category, layer, scale, **style), **kwargs)
+
+    tol = simplify_tolerance(extent, width_px, height_px) if simplify else 0.0
+    path = clipped_path(name, scale, extent, tol)
+    style = {**style, **kwargs}
+    if "fc" in style:
+        style["facecolor"] = style.pop("fc")
+    if "ec" in style:
+        style["edgecolor"] = style.pop("ec")
+    coll = PathCollection([] if path is None else [path], transform=ax.transData, **style)
+    ax.add_collection(coll, autolim=False)
+    coll.set_clip_path(ax.patch)
+    return coll
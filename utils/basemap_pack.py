@@ -0,0 +1,242 @@
+# utils/basemap_pack.py — offline Natural Earth basemap pack (WKB + bounds, memory-mapped)
+"""One binary file holding every Natural Earth layer CartoZen draws.
+
+Usage:
+
+python build_basemap_pack.py                          # → assets/ne_basemap.pack
+
+from utils.basemap_pack import get_basemap_pack
+
+pack = get_basemap_pack()               # None when no pack is installed
+if pack is not None and pack.has("land/50m"):
+    idx = pack.query("land/50m", (-10, 30, 35, 60))     # lon0, lon1, lat0, lat1 → feature indices
+    geoms = pack.geometries("land/50m", idx)            # decodes only those
+    b = pack.bounds("land/50m")         # (n, 4) minx, miny, maxx, maxy
+
+Layers are "<feature>/<scale>" for the basemap features of utils/basemap.py
+(land, ocean, coastline, borders) and "countries" for admin-0 polygons with
+ADMIN / CONTINENT attributes (overview inset extents). The pack is read with
+mmap: opening it only parses a small JSON header, bounds are NumPy views
+into the file, and query() picks the features of an extent from the bounds
+table alone. Each geometry is decoded from WKB the first time it is asked
+for, so a regional map never decodes the rest of the world, and no
+shapefile, zip, fiona or network access is needed at runtime.
+
+File layout (little endian, every block 8-byte aligned):
+    b"CZBPACK1" | u64 header length | JSON header | per layer:
+    bounds float64[n, 4] | WKB offsets int64[n + 1] | WKB blob
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+import shapely
+
+MAGIC = b"CZBPACK1"
+PACK_VERSION = 1
+DEFAULT_PACK_PATH = os.path.join("assets", "ne_basemap.pack")   # or $CARTOZEN_BASEMAP_PACK
+
+_packs: dict = {}
+_packs_lock = threading.Lock()
+
+
+def default_pack_path() -> str:
+    return os.environ.get("CARTOZEN_BASEMAP_PACK", DEFAULT_PACK_PATH)
+
+
+def is_pack(path) -> bool:
+    """True if path is a basemap pack file (checked by its magic bytes)."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (OSError, TypeError):
+        return False
+
+
+def _align(n, to=8):
+    return (n + to - 1) // to * to
+
+
+def write_pack(path, layers, source=None):
+    """Write layers {name: (geometries, attrs | None)} to path atomically.
+
+    attrs: optional {column: list aligned with geometries} (JSON-serialisable).
+    Missing/empty geometries are dropped together with their attributes.
+    """
+    blocks, meta = [], {}
+    for name, (geoms, attrs) in layers.items():
+        geoms = np.asarray(list(geoms), dtype=object)
+        keep = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms)) if len(geoms) else np.zeros(0, bool)
+        geoms = geoms[keep]
+        wkb = shapely.to_wkb(geoms) if len(geoms) else np.zeros(0, dtype=object)
+        offsets = np.zeros(len(wkb) + 1, dtype="<i8")
+        offsets[1:] = np.cumsum([len(w) for w in wkb])
+        entry = {"count": int(len(geoms))}
+        if attrs:
+            entry["attrs"] = {col: [v for v, k in zip(vals, keep) if k] for col, vals in attrs.items()}
+        blocks.append((name, "bounds", shapely.bounds(geoms).astype("<f8").tobytes() if len(geoms) else b""))
+        blocks.append((name, "offsets", offsets.tobytes()))
+        blocks.append((name, "wkb", b"".join(wkb)))
+        meta[name] = entry
+
+    # header size depends on the offsets it contains: lay out until stable
+    header = {"version": PACK_VERSION, "source": source or {}, "layers": meta}
+    head_len = 0
+    while True:
+        pos = _align(len(MAGIC) + 8 + head_len)
+        for name, kind, data in blocks:
+            meta[name][kind] = pos
+            if kind == "wkb":
+                meta[name]["wkb_size"] = len(data)
+            pos = _align(pos + len(data))
+        raw = json.dumps(header, separators=(",", ":"), default=str).encode("utf-8")
+        if len(raw) == head_len:
+            break
+        head_len = len(raw)
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(raw)) + raw)
+        for _, _, data in blocks:
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(data)
+    os.replace(tmp, path)
+    return path
+
+
+class BasemapPack:
+    """Read-only, memory-mapped view of a pack file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a basemap pack")
+        (head_len,) = struct.unpack_from("<Q", self._mm, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self._mm[start:start + head_len].decode("utf-8"))
+        if header.get("version") != PACK_VERSION:
+            raise ValueError(f"{path}: unsupported pack version {header.get('version')}")
+        self.source = header.get("source", {})
+        self.layers = header["layers"]
+        self._geoms = {}
+        self._lock = threading.Lock()
+
+    def has(self, layer) -> bool:
+        return layer in self.layers
+
+    def bounds(self, layer) -> np.ndarray:
+        meta = self.layers[layer]
+        return np.frombuffer(self._mm, dtype="<f8", count=4 * meta["count"], offset=meta["bounds"]).reshape(-1, 4)
+
+    def attributes(self, layer) -> dict:
+        return self.layers[layer].get("attrs", {})
+
+    def query(self, layer, extent) -> np.ndarray:
+        """Sorted indices of the features whose bounds intersect extent
+        (min_lon, max_lon, min_lat, max_lat), from the bounds table only."""
+        x0, x1, y0, y1 = extent
+        b = self.bounds(layer)
+        return np.flatnonzero((b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0))
+
+    def geometries(self, layer, idx=None) -> np.ndarray:
+        """Geometries of a layer, all or those at idx (each decoded once, then shared)."""
+        with self._lock:
+            cache = self._geoms.get(layer)
+            if cache is None:
+                n = self.layers[layer]["count"]
+                cache = self._geoms[layer] = (np.full(n, None, dtype=object), np.zeros(n, dtype=bool))
+        geoms, decoded = cache
+        idx = np.arange(len(geoms)) if idx is None else np.asarray(idx, dtype=np.int64)
+        todo = idx[~decoded[idx]]
+        if len(todo):
+            meta = self.layers[layer]
+            offs = np.frombuffer(self._mm, dtype="<i8", count=meta["count"] + 1, offset=meta["offsets"])
+            base = meta["wkb"]
+            blobs = np.empty(len(todo), dtype=object)
+            blobs[:] = [self._mm[base + offs[i]:base + offs[i + 1]] for i in todo]
+            new = shapely.from_wkb(blobs)
+            with self._lock:
+                geoms[todo] = new
+                decoded[todo] = True
+        return geoms[idx]
+
+
+def get_basemap_pack(path=None):
+    """Process-wide BasemapPack for path (default: $CARTOZEN_BASEMAP_PACK or
+    assets/ne_basemap.pack), reopened when the file changes; None if absent
+    or unreadable."""
+    path = path or default_pack_path()
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _packs_lock:
+        pack = _packs.get(key)
+        if pack is None:
+            try:
+                pack = BasemapPack(path)
+            except (OSError, ValueError):
+                return None
+            _packs[key] = pack
+        return pack
+
+
+# ── building ────────────────────────────────────────────────────────────────
+
+def _read_layer(category, layer, scale, source_dir=None):
+    """Geometries of one Natural Earth layer: source_dir/ne_<scale>_<layer>.shp|.zip,
+    else Cartopy's data cache (downloaded once if needed)."""
+    from cartopy.io import shapereader as shpreader
+    stem = f"ne_{scale}_{layer}"
+    if source_dir:
+        for ext in (".shp", ".zip"):
+            p = os.path.join(source_dir, stem + ext)
+            if os.path.exists(p):
+                if ext == ".zip":
+                    import geopandas as gpd
+                    return list(gpd.read_file(f"zip://{p}").geometry)
+                return list(shpreader.Reader(p).geometries())
+    return list(shpreader.Reader(shpreader.natural_earth(scale, category, layer)).geometries())
+
+
+def build_pack(out_path=None, scales=("110m", "50m", "10m"), source_dir=None, countries=None, log=print):
+    """Convert Natural Earth layers into one pack file.
+
+    countries: admin-0 source — a local NE file/zip, or a scale ("110m"
+    default, the same data the overview inset reads from Cartopy).
+    """
+    from utils.basemap import FEATURES
+    from utils.inset_overview import _ci_get, _load_country_records, _name_of
+
+    out_path = out_path or default_pack_path()
+    layers = {}
+    for scale in scales:
+        for name, (category, layer, _, _) in FEATURES.items():
+            layers[f"{name}/{scale}"] = (_read_layer(category, layer, scale, source_dir), None)
+            log(f"{name}/{scale}: {len(layers[f'{name}/{scale}'][0])} geometries")
+
+    countries = countries or "110m"
+    if os.path.exists(countries):
+        countries = os.path.abspath(countries)
+        records = _load_country_records(countries)
+    else:
+        from cartopy.io import shapereader as shpreader
+        shp = shpreader.natural_earth(countries, "cultural", "admin_0_countries")
+        records = [(r.geometry, r.attributes) for r in shpreader.Reader(shp).records()]
+    if records:
+        layers["countries"] = ([g for g, _ in records], {
+            "ADMIN": [_name_of(a) for _, a in records],
+            "CONTINENT": [_ci_get(a, "CONTINENT", _ci_get(a, "continent")) for _, a in records],
+        })
+        log(f"countries: {len(records)} records")
+    write_pack(out_path, layers, source={"scales": list(scales), "countries": countries})
+    return out_path
@@ -8,13 +8,26 @@ from utils.cluster_utils import greedy_cluster
 rep_df, clusters = greedy_cluster(df, lat_col="Lat_DD", lon_col="Lon_DD", threshold_km=12)
 # plot with rep_df instead of df; clusters maps cluster_id -> original row indices
 
+For a slider over many thresholds, build the hierarchy once per dataset:
+
+from utils.cluster_utils import get_cluster_hierarchy
+
+rep_df, clusters = get_cluster_hierarchy(df, "Lat_DD", "Lon_DD").resolve(12)
+
 """
 from __future__ import annotations
+import threading
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 
+from utils.render_cache import digest_bytes
+
 EARTH_R_KM = 6371.0088
 
+# smallest 3D grid cell (unit-sphere chord, ~13 m); keeps cell keys inside int64
+_MIN_CELL = 2e-6
+
 
 def _haversine_km(lat1, lon1, lat2, lon2):
     lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
@@ -25,43 +38,276 @@ def _haversine_km(lat1, lon1, lat2, lon2):
     return EARTH_R_KM * c
 
 
+def _unit_vectors(lat, lon):
+    la, lo = np.radians(lat), np.radians(lon)
+    cl = np.cos(la)
+    return np.column_stack((cl * np.cos(lo), cl * np.sin(lo), np.sin(la)))
+
+
+def _chord_threshold(threshold_km: float) -> float:
+    """Unit-sphere chord length equivalent to a great-circle distance."""
+    theta = min(max(float(threshold_km), 0.0) / EARTH_R_KM, np.pi)
+    return 2.0 * np.sin(theta / 2.0)
+
+
+class _ChordGrid:
+    """Uniform 3D grid over unit vectors, sorted by cell key.
+
+    Cells are at least as wide as the chord threshold, so every point within
+    the threshold of a seed lies in the 3×3×3 block around the seed's cell.
+    For a fixed (x, y) column the three z-cells are contiguous in key order,
+    which turns each neighbourhood query into 9 searchsorted ranges.
+    """
+
+    def __init__(self, xyz, chord):
+        cell = max(chord * (1.0 + 1e-9) + 1e-12, _MIN_CELL)
+        ok = np.isfinite(xyz).all(axis=1)
+        ijk = np.zeros((len(xyz), 3), dtype=np.int64)
+        ijk[ok] = np.floor((xyz[ok] + 1.0) / cell).astype(np.int64) + 1
+        n_side = int(np.floor(2.0 / cell)) + 3
+        self.sy = n_side
+        self.sx = n_side * n_side
+        keys = ijk[:, 0] * self.sx + ijk[:, 1] * self.sy + ijk[:, 2]
+        keys[~ok] = -1          # NaN coordinates never match a query range
+        self.keys = keys
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+        self._cols = np.array([dx * self.sx + dy * self.sy for dx in (-1, 0, 1) for dy in (-1, 0, 1)], dtype=np.int64)
+
+    def candidates(self, i):
+        """Indices of all points in the 27 cells around point i."""
+        base = self.keys[i] + self._cols
+        lo = np.searchsorted(self.sorted_keys, base - 1, side="left")
+        hi = np.searchsorted(self.sorted_keys, base + 1, side="right")
+        parts = [self.order[a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+def _greedy_labels(lat, lon, threshold_km: float):
+    """Seed-order greedy assignment. Returns (labels, clusters)."""
+    n = len(lat)
+    grid = _ChordGrid(_unit_vectors(lat, lon), _chord_threshold(threshold_km))
+    finite = np.isfinite(lat) & np.isfinite(lon)
+
+    flags = bytearray(n)                                  # fast scalar checks
+    assigned = np.frombuffer(flags, dtype=np.uint8)       # shared view for vector updates
+    labels = np.empty(n, dtype=np.int64)
+    clusters: dict[int, list[int]] = {}
+    cid = 0
+    for i in range(n):
+        if flags[i]:
+            continue
+        # every j < i is already assigned, so the seed is the lowest unassigned index
+        members = np.empty(0, dtype=np.int64)
+        if finite[i]:
+            cand = grid.candidates(i)
+            cand = cand[(assigned[cand] == 0) & (cand != i)]
+            if len(cand):
+                d = _haversine_km(lat[i], lon[i], lat[cand], lon[cand])
+                members = np.sort(cand[d <= threshold_km])
+        flags[i] = 1
+        assigned[members] = 1
+        labels[i] = cid
+        labels[members] = cid
+        clusters[cid] = [i] + members.tolist()
+        cid += 1
+    return labels, clusters
+
+
 def greedy_cluster(df: pd.DataFrame, lat_col: str = "Lat_DD", lon_col: str = "Lon_DD", threshold_km: float = 10.0):
     """Return (rep_df, clusters)
 
     - rep_df: one centroid row per cluster with columns: Lat_DD, Lon_DD, cluster_id, cluster_size
     - clusters: dict[int, list[int]] mapping cluster_id -> original df row indices
 
-    Greedy single-linkage (O(n^2)), fine for up to a few thousand points.
+    Greedy single-linkage: the lowest unassigned row seeds a cluster and takes
+    every unassigned row within threshold_km (haversine) of it. Neighbours come
+    from a 3D grid over unit vectors (chord-distance cells), so the cost is
+    ~O(n log n) for typical station networks instead of O(n^2).
     """
-    coords = df[[lat_col, lon_col]].to_numpy()
-    n = len(coords)
-    unassigned = set(range(n))
-    clusters: dict[int, list[int]] = {}
-    cid = 0
+    lat = df[lat_col].to_numpy(dtype=float)
+    lon = df[lon_col].to_numpy(dtype=float)
+    if len(lat) == 0:
+        return pd.DataFrame(columns=["cluster_id", "cluster_size", "Lat_DD", "Lon_DD"]), {}
 
-    while unassigned:
-        i = min(unassigned)
-        unassigned.remove(i)
-        members = [i]
-        lat_i, lon_i = coords[i]
-        # expand once around seed i
-        for j in list(unassigned):
-            lat_j, lon_j = coords[j]
-            if _haversine_km(lat_i, lon_i, lat_j, lon_j) <= threshold_km:
-                members.append(j)
-                unassigned.remove(j)
-        clusters[cid] = members
-        cid += 1
+    labels, clusters = _greedy_labels(lat, lon, float(threshold_km))
+    return _representatives(lat, lon, labels), clusters
+
+
+def _representatives(lat, lon, labels):
+    """One centroid row per cluster (one vectorized groupby instead of one slice per cluster)."""
+    g = pd.DataFrame({"Lat_DD": lat, "Lon_DD": lon}).groupby(labels, sort=True)
+    means = g.mean()
+    return pd.DataFrame({
+        "cluster_id": means.index.to_numpy(dtype=np.int64),
+        "cluster_size": g.size().to_numpy(dtype=np.int64),
+        "Lat_DD": means["Lat_DD"].to_numpy(),
+        "Lon_DD": means["Lon_DD"].to_numpy(),
+    })
+
+
+def _clusters_from_labels(labels):
+    """cluster_id -> row indices; the seed (lowest index) comes first."""
+    order = np.argsort(labels, kind="stable")
+    cuts = np.flatnonzero(np.diff(labels[order])) + 1
+    return {cid: idxs.tolist() for cid, idxs in enumerate(np.split(order, cuts))}
+
+
+# ── multi-threshold hierarchy ───────────────────────────────────────────────
+
+class ClusterHierarchy:
+    """Greedy clusterings of one dataset for any threshold up to max_km.
+
+    Built once: every forward pair (i < j) within max_km, sorted by distance
+    per row (CSR). A greedy pass for threshold T then only walks the prefix
+    of each seed's row with d <= T — no grid queries and no trigonometry —
+    and its labels are memoized, so revisiting a threshold is a lookup.
+    Results are identical to greedy_cluster(df, ..., T).
+
+    Very dense inputs whose pair count exceeds max_pairs skip the CSR and
+    memoize plain greedy_cluster passes instead (those inputs have few seeds,
+    which is where the indexed pass is already fast).
+    """
 
-    # build representatives
-    rows = []
-    for cid, idxs in clusters.items():
-        sub = df.iloc[idxs]
-        rows.append({
-            "cluster_id": cid,
-            "cluster_size": int(len(idxs)),
-            "Lat_DD": float(sub[lat_col].mean()),
-            "Lon_DD": float(sub[lon_col].mean()),
-        })
-    rep_df = pd.DataFrame(rows)
-    return rep_df, clusters
+    def __init__(self, df: pd.DataFrame, lat_col: str = "Lat_DD", lon_col: str = "Lon_DD",
+                 max_km: float = 50.0, max_pairs: int = 30_000_000):
+        self.lat = df[lat_col].to_numpy(dtype=float)
+        self.lon = df[lon_col].to_numpy(dtype=float)
+        self.max_km = float(max_km)
+        self._labels: dict[float, np.ndarray] = {}
+        self._resolved: OrderedDict[float, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+        self._csr = self._build_pairs(max_pairs) if len(self.lat) else None
+
+    def _build_pairs(self, max_pairs, chunk=200_000):
+        lat, lon, n = self.lat, self.lon, len(self.lat)
+        grid = _ChordGrid(_unit_vectors(lat, lon), _chord_threshold(self.max_km))
+        rows, nbrs, dists, budget = [], [], [], max_pairs * 4
+        for c0 in range(0, n, chunk):
+            idx = np.arange(c0, min(n, c0 + chunk))
+            keys = grid.keys[idx]
+            for col in grid._cols:
+                lo = np.searchsorted(grid.sorted_keys, keys + col - 1, side="left")
+                hi = np.searchsorted(grid.sorted_keys, keys + col + 1, side="right")
+                cnt = np.where(keys < 0, 0, hi - lo)
+                total = int(cnt.sum())
+                budget -= total
+                if budget < 0:
+                    return None
+                if not total:
+                    continue
+                ii = np.repeat(idx, cnt)
+                jj = grid.order[np.repeat(lo - np.cumsum(cnt) + cnt, cnt) + np.arange(total)]
+                fwd = jj > ii
+                ii, jj = ii[fwd], jj[fwd]
+                d = _haversine_km(lat[ii], lon[ii], lat[jj], lon[jj])
+                keep = d <= self.max_km
+                rows.append(ii[keep]); nbrs.append(jj[keep]); dists.append(d[keep])
+        if not rows:
+            rows = nbrs = [np.empty(0, dtype=np.int64)]; dists = [np.empty(0)]
+        rows, nbrs, dists = np.concatenate(rows), np.concatenate(nbrs), np.concatenate(dists)
+        if len(rows) > max_pairs:
+            return None
+        order = np.lexsort((nbrs, dists, rows))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return indptr, nbrs[order], dists[order]
+
+    def _greedy_pass(self, threshold_km):
+        indptr, nbrs, dists = self._csr
+        n = len(indptr) - 1
+        within = np.concatenate(([0], np.cumsum(dists <= threshold_km)))
+        counts = (within[indptr[1:]] - within[indptr[:-1]]).tolist()
+        starts = indptr[:-1].tolist()
+        flags = bytearray(n)
+        assigned = np.frombuffer(flags, dtype=np.uint8)
+        labels = np.empty(n, dtype=np.int64)
+        cid = 0
+        for i in range(n):
+            if flags[i]:
+                continue
+            flags[i] = 1
+            labels[i] = cid
+            c = counts[i]
+            if c:
+                nb = nbrs[starts[i]:starts[i] + c]
+                nb = nb[assigned[nb] == 0]
+                assigned[nb] = 1
+                labels[nb] = cid
+            cid += 1
+        return labels
+
+    def labels(self, threshold_km: float) -> np.ndarray:
+        """Cluster id per row for threshold_km (memoized)."""
+        t = float(threshold_km)
+        lab = self._labels.get(t)
+        if lab is None:
+            if not len(self.lat):
+                lab = np.empty(0, dtype=np.int64)
+            elif self._csr is not None and 0.0 <= t <= self.max_km:
+                lab = self._greedy_pass(t)
+            else:
+                lab, _ = _greedy_labels(self.lat, self.lon, t)
+            with self._lock:
+                self._labels[t] = lab
+        return lab
+
+    def resolve(self, threshold_km: float):
+        """(rep_df, clusters) exactly as greedy_cluster returns them."""
+        t = float(threshold_km)
+        with self._lock:
+            hit = self._resolved.get(t)
+            if hit is not None:
+                self._resolved.move_to_end(t)
+                return hit
+        lab = self.labels(t)
+        if not len(lab):
+            out = (pd.DataFrame(columns=["cluster_id", "cluster_size", "Lat_DD", "Lon_DD"]), {})
+        else:
+            out = (_representatives(self.lat, self.lon, lab), _clusters_from_labels(lab))
+        with self._lock:
+            self._resolved[t] = out
+            while len(self._resolved) > 4:      # materialized dicts are big; labels stay cached
+                self._resolved.popitem(last=False)
+        return out
+
+    def precompute(self, thresholds, background: bool = False):
+        """Fill the label memo for every threshold (optionally on a daemon thread)."""
+        def _run():
+            for t in thresholds:
+                self.labels(t)
+        if background:
+            threading.Thread(target=_run, name="cz-cluster-precompute", daemon=True).start()
+        else:
+            _run()
+        return self
+
+
+_hierarchies: OrderedDict[str, ClusterHierarchy] = OrderedDict()
+_hierarchies_lock = threading.Lock()
+
+
+def get_cluster_hierarchy(df: pd.DataFrame, lat_col: str = "Lat_DD", lon_col: str = "Lon_DD",
+                          max_km: float = 50.0, warm=()) -> ClusterHierarchy:
+    """Process-wide ClusterHierarchy per coordinate set (a few datasets are kept).
+
+    warm: thresholds to precompute on a background thread when the hierarchy
+    is first built (e.g. every step of a UI slider).
+    """
+    coords = df[[lat_col, lon_col]]
+    # ordered row hashes: row positions index the hierarchy, so a reordered table is a new entry
+    rows = pd.util.hash_pandas_object(coords, index=False).to_numpy()
+    key = f"{max_km}|{digest_bytes(rows.tobytes())}|{len(coords)}"
+    with _hierarchies_lock:
+        h = _hierarchies.get(key)
+        if h is not None:
+            _hierarchies.move_to_end(key)
+            return h
+    h = ClusterHierarchy(df, lat_col, lon_col, max_km=max_km)
+    if warm:
+        h.precompute(list(warm), background=True)
+    with _hierarchies_lock:
+        _hierarchies[key] = h
+        while len(_hierarchies) > 4:
+            _hierarchies.popitem(last=False)
+    return h
@@ -1,5 +1,4 @@
 import pandas as pd
-import utm
 import re
 import numpy as np
 
@@ -27,6 +26,7 @@ def convert_coords(df, fmt, lat_col, lon_col):
         df["Lat_DD"] = pd.to_numeric(df[lat_col], errors="coerce")
         df["Lon_DD"] = pd.to_numeric(df[lon_col], errors="coerce")
     else:
+        import utm  # legacy converter only; not in requirements.txt (see coord_utils_v2.utm_to_latlon)
         df[["E", "N", "Z", "ZL"]] = df.iloc[:, :4]
         df[["Lat_DD", "Lon_DD"]] = df.apply(lambda r: pd.Series(
             utm.to_latlon(r.E, r.N, int(r.Z), r.ZL)), axis=1)
@@ -2,14 +2,17 @@
 # Robust coordinate conversion utilities for CartoZen
 # - Auto-detects & fixes Degrees+Decimal Minutes (DMM) inside "Decimal Degrees" inputs
 # - Parses DMS strings with N/S/E/W
-# - Converts UTM (E, N, Zone, Hemisphere)
+# - Converts UTM (E, N, Zone, Hemisphere) in bulk, one pyproj call per zone
 # - Always returns a DataFrame (never None)
 # - Ensures numeric dtype before clip/round to avoid TypeError
+# - Column-wise (vectorized) parsing; the scalar parsers below define the
+#   behaviour and handle every cell the fast patterns do not cover
 
 import re
+import threading
 import numpy as np
 import pandas as pd
-import utm
+from pyproj import Transformer
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Parsers & detectors
@@ -103,13 +106,8 @@ def _auto_fix_dmm_inplace(df: pd.DataFrame, lat_col: str, lon_col: str) -> None:
     Auto-detect & fix DMM values in-place for specific cells.
     Only a cell flagged by the heuristic is converted.
     """
-    lat_mask = df[lat_col].apply(is_probably_dmm, kind="lat")
-    if lat_mask.any():
-        df.loc[lat_mask, lat_col] = df.loc[lat_mask, lat_col].apply(dmm_to_dd)
-
-    lon_mask = df[lon_col].apply(is_probably_dmm, kind="lon")
-    if lon_mask.any():
-        df.loc[lon_mask, lon_col] = df.loc[lon_mask, lon_col].apply(dmm_to_dd)
+    df[lat_col] = _fix_dmm_series(df[lat_col], kind="lat")
+    df[lon_col] = _fix_dmm_series(df[lon_col], kind="lon")
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Main API
@@ -153,23 +151,189 @@ def loose_to_dd(val):
         return np.nan
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Vectorized column parsers (same results as the scalar functions above)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# DMS: one cardinal letter before or after up to three plain numbers. The
+# separator class is the complement of what dms_to_dd keeps, so tokens split
+# exactly as there; anything else (unicode digits, stray letters, 20N, ...)
+# falls back to dms_to_dd cell by cell.
+_DMS_SEP = r"[^\d.NSEWnsew]"
+_DMS_NUM = r"([0-9]+(?:\.[0-9]+)?)"
+_DMS_NUMS = rf"{_DMS_NUM}(?:{_DMS_SEP}+{_DMS_NUM})?(?:{_DMS_SEP}+{_DMS_NUM})?"
+_DMS_RE = re.compile(rf"^{_DMS_SEP}*(?:{_DMS_NUMS}{_DMS_SEP}+([NSEWnsew])"       # 20 30 15 N
+                     rf"|([NSEWnsew]){_DMS_SEP}+{_DMS_NUMS}){_DMS_SEP}*$")       # N 20 30 15
+_HAS_CARDINAL_RE = re.compile(r"[NSEWnsew]")
+
+# loose: same clean-up as loose_to_dd (degree/minute/second symbols are part
+# of "anything else", so they need no separate pass)
+_LOOSE_LETTERS_RE = re.compile(r"[NnEeWw]")
+_LOOSE_DROP_RE = re.compile(r"[^0-9\.\-\s]")
+_LOOSE_TOKENS_RE = re.compile(r"^\s*(\S+)(?:\s+(\S+))?(?:\s+(\S+))?")
+
+
+def _float_or_nan(tok):
+    try:
+        return float(tok)
+    except ValueError:
+        return np.nan
+
+
+def _float_tokens(tokens: np.ndarray) -> np.ndarray:
+    """float() of each token string; NaN for invalid ones."""
+    try:
+        return tokens.astype(float)
+    except ValueError:
+        return np.array([_float_or_nan(t) for t in tokens.ravel()]).reshape(tokens.shape)
+
+
+def dms_series_to_dd(s: pd.Series) -> pd.Series:
+    """Column-wise dms_to_dd: NaN wherever dms_to_dd returns None."""
+    values = s.astype(str).fillna("nan").tolist()    # dms_to_dd sees str(cell), missing cells included
+    groups = [m.groups("nan") if m else None for m in map(_DMS_RE.match, values)]
+    hit = np.fromiter((g is not None for g in groups), dtype=bool, count=len(groups))
+    out = np.full(len(values), np.nan)
+
+    if hit.any():
+        g = np.array([g for g in groups if g is not None], dtype=object)
+        suffix = g[:, 3] != "nan"
+        nums = np.where(suffix[:, None], g[:, 0:3], g[:, 5:8]).astype(float)
+        deg, minute, second = np.nan_to_num(nums, nan=0.0).T
+        dd = deg + minute / 60.0 + second / 3600.0
+        direction = np.where(suffix, g[:, 3], g[:, 4])
+        out[hit] = np.where(np.isin(direction, ["S", "W", "s", "w"]), -dd, dd)
+
+    # no cardinal letter at all → None; the irregular rest goes through dms_to_dd
+    for i in np.flatnonzero(~hit):
+        if _HAS_CARDINAL_RE.search(values[i]):
+            dd = dms_to_dd(values[i])
+            out[i] = np.nan if dd is None else dd
+    return pd.Series(out, index=s.index)
+
+
+def loose_series_to_dd(s: pd.Series) -> pd.Series:
+    """Column-wise loose_to_dd."""
+    values = s.astype(str).fillna("nan").tolist()
+    empty = ("nan",) * 3
+    groups = [m.groups("nan") if m else empty
+              for m in (_LOOSE_TOKENS_RE.match(_LOOSE_DROP_RE.sub(" ", _LOOSE_LETTERS_RE.sub("", v).replace(",", ".")))
+                        for v in values)]
+    tok = np.array(groups, dtype=object).reshape(len(values), 3)
+    first, minutes, seconds = _float_tokens(tok).T
+    has2 = tok[:, 1] != "nan"
+
+    # 1 token: plain DD; 2+ tokens: |deg| + min/60 (+ sec/3600), sign from deg;
+    # tokens after the third are ignored, any invalid used token gives NaN
+    minutes = np.where(has2, minutes, 0.0)
+    seconds = np.where(tok[:, 2] != "nan", seconds, 0.0)
+    dd = np.abs(first) + minutes / 60.0 + seconds / 3600.0
+    out = np.where(has2, np.where(first < 0, -dd, dd), first)
+    return pd.Series(out, index=s.index)
+
+
+def _dmm_array_to_dd(x: np.ndarray) -> np.ndarray:
+    """dmm_to_dd over a float array."""
+    ax = np.abs(x)
+    deg = np.floor(ax)
+    minutes = (ax - deg) * 100.0
+    return np.where(x < 0, -1.0, 1.0) * (deg + minutes / 60.0)
+
+
+def probably_dmm_mask(x, kind="lat") -> np.ndarray:
+    """is_probably_dmm over an array (non-finite values are never DMM)."""
+    x = np.asarray(x, dtype=float)
+    with np.errstate(invalid="ignore"):
+        ax = np.abs(x)
+        deg = np.floor(ax)
+        minutes = (ax - deg) * 100.0
+        ok = np.isfinite(x) & (deg <= (90 if kind == "lat" else 180)) & (minutes >= 0.0) & (minutes < 60.0)
+        return ok & (np.abs(x - _dmm_array_to_dd(x)) > 0.05)      # ~3 arc-min threshold
+
+
 def _fix_dmm_series(s: pd.Series, kind="lat") -> pd.Series:
     """
     Given a numeric-ish series, convert entries that 'look like' DMM to proper DD.
     """
-    def _looks_dmm(x):
-        try:
-            return is_probably_dmm(x, kind=kind)
-        except Exception:
-            return False
-
+    x = pd.to_numeric(s, errors="coerce").to_numpy(dtype=float)
+    mask = probably_dmm_mask(x, kind=kind)
     s = s.copy()
-    mask = s.apply(_looks_dmm)
     if mask.any():
-        s.loc[mask] = s.loc[mask].apply(dmm_to_dd)
+        s.loc[mask] = _dmm_array_to_dd(x[mask])
     return s
 
-def convert_coords(df, fmt, lat_col, lon_col):
+# ─────────────────────────────────────────────────────────────────────────────
+# UTM (bulk)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Transformers are not shared between threads (Streamlit reruns run in threads)
+_transformers = threading.local()
+
+_ZONE_RE = re.compile(r"^\s*(\d{1,2})(?:\.0*)?\s*([A-Za-z]*)\s*$")
+
+
+def _utm_transformer(zone: int, south: bool) -> Transformer:
+    """Cached UTM (WGS84) -> lon/lat transformer for one zone/hemisphere."""
+    cache = getattr(_transformers, "cache", None)
+    if cache is None:
+        cache = _transformers.cache = {}
+    key = (zone, south)
+    if key not in cache:
+        epsg = (32700 if south else 32600) + zone
+        cache[key] = Transformer.from_crs(f"EPSG:{epsg}", "EPSG:4326", always_xy=True)
+    return cache[key]
+
+
+def _southern(letters: pd.Series) -> pd.Series:
+    """
+    True/False per hemisphere cell, NaN when unreadable.
+    - single letters are latitude bands C–X (as in utm.to_latlon): < N is south
+    - words: 'North' / 'South'
+    """
+    h = letters.astype(str).str.strip().str.upper()
+    band = h.str.fullmatch(r"[C-HJ-NP-X]")
+    out = pd.Series(np.nan, index=h.index, dtype=object)
+    out[band] = h[band] < "N"
+    out[h.isin(["NORTH", "NORTHERN"])] = False
+    out[h.isin(["SOUTH", "SOUTHERN"])] = True
+    return out
+
+
+def utm_to_latlon(easting, northing, zone, hemisphere=None):
+    """
+    Bulk UTM -> (lat, lon) arrays. Rows are grouped by (zone, hemisphere) and
+    each group is converted with one vectorized pyproj call.
+    - zone: 1–60; with hemisphere=None a band letter may follow ("43Q")
+    - hemisphere: band letter C–X or North/South
+    Rows outside the UTM bounds used by utm.to_latlon (E 100–1000 km,
+    N 0–10000 km) or with an unreadable zone/hemisphere come back as NaN.
+    """
+    e = pd.to_numeric(pd.Series(easting), errors="coerce").to_numpy(dtype=float)
+    n = pd.to_numeric(pd.Series(northing), errors="coerce").to_numpy(dtype=float)
+    parts = pd.Series(zone).reset_index(drop=True).astype(str).str.extract(_ZONE_RE)
+    zone_num = pd.to_numeric(parts[0], errors="coerce").to_numpy(dtype=float)
+    south = _southern(parts[1] if hemisphere is None else pd.Series(hemisphere).reset_index(drop=True))
+
+    ok = (
+        (e >= 100_000) & (e < 1_000_000) & (n >= 0) & (n <= 10_000_000)
+        & (zone_num >= 1) & (zone_num <= 60)
+        & south.notna().to_numpy()
+    )
+    lat = np.full(len(e), np.nan)
+    lon = np.full(len(e), np.nan)
+    if not ok.any():
+        return lat, lon
+
+    keys = zone_num[ok].astype(np.int64) * 2 + south[ok].astype(bool).to_numpy()
+    rows = np.flatnonzero(ok)
+    for key in np.unique(keys):
+        idx = rows[keys == key]
+        x, y = _utm_transformer(int(key // 2), bool(key % 2)).transform(e[idx], n[idx])
+        lon[idx], lat[idx] = x, y
+    return lat, lon
+
+
+def convert_coords(df, fmt, lat_col, lon_col, utm_cols=None):
     """
     Convert coordinates to decimal degrees with auto-cleaning.
     Returns a DataFrame with Lat_DD, Lon_DD (may be empty but never None).
@@ -177,20 +341,22 @@ def convert_coords(df, fmt, lat_col, lon_col):
     fmt:
       - "DMS": expects N/S/E/W style strings in lat_col/lon_col
       - "Decimal Degrees": accepts DD and auto-fixes cells that look like DMM
-      - "UTM": expects first 4 columns as [E, N, Z, ZL] (hemisphere letter)
+      - "UTM": utm_cols = (easting, northing, zone, hemisphere) column names;
+        hemisphere may be None when the zone holds the letter ("43Q").
+        Without utm_cols the first 4 columns are used as [E, N, Z, ZL].
     """
     # Defensive input validation
     if not isinstance(df, pd.DataFrame):
         return pd.DataFrame(columns=["Lat_DD", "Lon_DD"])
-    if lat_col not in df.columns or lon_col not in df.columns:
+    if fmt != "UTM" and (lat_col not in df.columns or lon_col not in df.columns):
         return pd.DataFrame(columns=["Lat_DD", "Lon_DD"])
 
     df = df.copy()
 
     try:
         if fmt == "DMS":
-            df["Lat_DD"] = df[lat_col].astype(str).apply(dms_to_dd)
-            df["Lon_DD"] = df[lon_col].astype(str).apply(dms_to_dd)
+            df["Lat_DD"] = dms_series_to_dd(df[lat_col])
+            df["Lon_DD"] = dms_series_to_dd(df[lon_col])
 
         elif fmt == "Decimal Degrees":
             # Step 1: quick numeric coercion (handles commas/spaces)
@@ -200,11 +366,11 @@ def convert_coords(df, fmt, lat_col, lon_col):
             # Step 2: where still NaN, try loose parsing (tokens -> DD)
             lat_mask = lat_num.isna()
             if lat_mask.any():
-                lat_num.loc[lat_mask] = df.loc[lat_mask, lat_col].apply(loose_to_dd)
+                lat_num.loc[lat_mask] = loose_series_to_dd(df.loc[lat_mask, lat_col])
 
             lon_mask = lon_num.isna()
             if lon_mask.any():
-                lon_num.loc[lon_mask] = df.loc[lon_mask, lon_col].apply(loose_to_dd)
+                lon_num.loc[lon_mask] = loose_series_to_dd(df.loc[lon_mask, lon_col])
 
             # Step 3: auto-fix true DMM values
             lat_num = _fix_dmm_series(lat_num, kind="lat")
@@ -215,16 +381,18 @@ def convert_coords(df, fmt, lat_col, lon_col):
             df["Lon_DD"] = lon_num
 
         else:  # UTM
-            # Expect first four columns as E, N, Z, ZL (hemisphere letter)
-            try:
-                df[["E", "N", "Z", "ZL"]] = df.iloc[:, :4]
-            except Exception:
-                # If missing, return empty result with expected columns
+            if utm_cols:
+                e_col, n_col, z_col, h_col = (list(utm_cols) + [None])[:4]
+            elif df.shape[1] >= 4:
+                # Positional fallback: first four columns as E, N, Z, ZL
+                e_col, n_col, z_col, h_col = df.columns[:4]
+            else:
+                return pd.DataFrame(columns=["Lat_DD", "Lon_DD"])
+            if any(c not in df.columns for c in (e_col, n_col, z_col)) or (h_col is not None and h_col not in df.columns):
                 return pd.DataFrame(columns=["Lat_DD", "Lon_DD"])
 
-            df[["Lat_DD", "Lon_DD"]] = df.apply(
-                lambda r: pd.Series(utm.to_latlon(r.E, r.N, int(r.Z), r.ZL)),
-                axis=1
+            df["Lat_DD"], df["Lon_DD"] = utm_to_latlon(
+                df[e_col], df[n_col], df[z_col], None if h_col is None else df[h_col]
             )
 
         # Final cleanup: ensure numeric -> dropna -> clip -> round
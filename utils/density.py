@@ -0,0 +1,220 @@
+# utils/density.py — point density aggregation on an output-pixel grid
+"""Hex / square binning and KDE heatmaps of station tables.
+
+Usage (render_engine, "markers" and "heatmap" layers):
+
+from utils.density import density_active, draw_density, draw_heatmap
+
+if density_active(len(df), cfg["point_mode"], cfg["density_threshold"]):
+    draw_density(ax, df["Lon_DD"], df["Lat_DD"], cell_px=12, shape="hex", cmap="viridis")
+draw_heatmap(ax, df["Lon_DD"], df["Lat_DD"], bandwidth_km=10, cmap="YlOrRd")
+
+Above a few hundred thousand points individual markers only add up to a
+blob, and one scatter with edge strokes (plus a halo scatter) is slow to
+rasterize. Here points are binned with array arithmetic: each point goes to
+its nearest hexagon centre (two offset rectangular lattices) or square
+cell, cells are counted with one np.bincount, and only non-empty cells are
+drawn as a single colour-ramped PolyCollection, with a colour bar as the
+legend. Cells are laid out in output pixels from the axes' lower-left
+corner; cell_px is given at 100 dpi (the app preview) and scaled with the
+canvas DPI, so preview and export bin the same way.
+
+The heatmap is a Gaussian kernel density estimate: stations are counted
+onto a grid of output pixels (grid_px per cell), padded by three kernel
+widths so stations just outside the map still contribute, and smoothed by
+multiplying the grid's FFT with the Gaussian's transfer function. The cost
+depends on the grid size, not on stations × pixels as with a direct KDE.
+The bandwidth is in km, converted to degrees at the map's centre latitude
+(like the scale bar). Values are stations per km²; cells below 2 % of the
+peak are left transparent so the basemap shows through.
+"""
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import matplotlib as mpl
+import matplotlib.patheffects as pe
+from matplotlib import colors as mcolors
+from matplotlib.collections import PolyCollection
+from matplotlib.transforms import IdentityTransform
+
+POINT_MODES = ("markers", "density", "auto")
+DENSITY_SHAPES = ("hex", "square")
+REFERENCE_DPI = 100
+KM_PER_DEG = 111.32
+HEAT_FLOOR = 0.02           # share of the peak density below which the heatmap is transparent
+
+# colour bar placement, axes fraction: (x0, y0) of a bar 3 % wide and 30 % tall
+_LEGEND_POS = {
+    "upper left":   (0.02, 0.66),
+    "upper right":  (0.95, 0.66),
+    "lower left":   (0.02, 0.10),
+    "lower right":  (0.95, 0.10),
+    "center left":  (0.02, 0.35),
+    "center right": (0.95, 0.35),
+}
+
+
+def density_active(n_points: int, mode: str, threshold: int) -> bool:
+    """True when points are drawn as density cells instead of markers."""
+    if mode == "density":
+        return True
+    return mode == "auto" and n_points > threshold
+
+
+def _cell_polygon(shape, c):
+    """Cell outline around (0, 0) in pixels; c = hexagon width / square side."""
+    if shape == "hex":
+        r = c / math.sqrt(3.0)                  # pointy-top: width c, height 2r
+        a = np.radians(np.arange(30, 390, 60))
+        return np.column_stack([r * np.cos(a), r * np.sin(a)])
+    h = c / 2.0
+    return np.array([[-h, -h], [h, -h], [h, h], [-h, h]])
+
+
+def bin_points(x, y, width, height, cell, shape="hex"):
+    """Count pixel positions (x, y) into cells over a width × height area.
+
+    Returns (centres [k, 2] in pixels, counts [k]) of the non-empty cells.
+    Hex rows are cell·√3/2 apart and every other row is shifted by half a
+    cell; a point belongs to the nearer of the two candidate centres.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y) & (x >= 0) & (x <= width) & (y >= 0) & (y <= height)
+    x, y = x[keep], y[keep]
+    if shape == "hex":
+        dy = cell * math.sqrt(3.0)
+        u, v = x / cell, y / dy
+        ia, ja = np.rint(u), np.rint(v)                 # even rows: centres (i·c, j·dy)
+        ib, jb = np.floor(u), np.floor(v)               # odd rows: shifted by (c/2, dy/2)
+        da = (u - ia) ** 2 * cell ** 2 + (v - ja) ** 2 * dy ** 2
+        db = (u - ib - 0.5) ** 2 * cell ** 2 + (v - jb - 0.5) ** 2 * dy ** 2
+        odd = db < da
+        col = np.where(odd, ib, ia).astype(np.int64)
+        row = np.where(odd, 2 * jb + 1, 2 * ja).astype(np.int64)
+        ncol = int(width // cell) + 2
+        nrow = 2 * (int(height // dy) + 2)
+    else:
+        col = np.minimum(x // cell, width // cell).astype(np.int64)
+        row = np.minimum(y // cell, height // cell).astype(np.int64)
+        ncol = int(width // cell) + 1
+        nrow = int(height // cell) + 1
+    counts = np.bincount(row * ncol + col, minlength=ncol * nrow)
+    flat = np.flatnonzero(counts)
+    row, col = np.divmod(flat, ncol)
+    if shape == "hex":
+        centres = np.column_stack([(col + 0.5 * (row % 2)) * cell, row * (cell * math.sqrt(3.0) / 2.0)])
+    else:
+        centres = np.column_stack([(col + 0.5) * cell, (row + 0.5) * cell])
+    return centres, counts[flat]
+
+
+def draw_density(ax, lon, lat, cell_px=12, shape="hex", cmap="viridis", log=True,
+                 legend_pos="center right", fontsize=8, label="Stations per cell", zorder=5):
+    """Bin lon/lat (ax.transData coordinates) and draw the counts; returns the collection.
+
+    legend_pos: key of _LEGEND_POS for a colour bar inside the axes, or None.
+    """
+    ax.apply_aspect()                   # final axes box, as at draw time
+    c = cell_px * ax.figure.dpi / REFERENCE_DPI
+    x0, y0 = ax.bbox.x0, ax.bbox.y0
+    xy = ax.transData.transform(np.column_stack([np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)]))
+    centres, counts = bin_points(xy[:, 0] - x0, xy[:, 1] - y0, ax.bbox.width, ax.bbox.height, c, shape)
+    vmax = max(int(counts.max()) if len(counts) else 1, 2)
+    norm = mcolors.LogNorm(vmin=1, vmax=vmax) if log else mcolors.Normalize(vmin=0, vmax=vmax)
+    coll = PolyCollection([_cell_polygon(shape, c)], offsets=centres + (x0, y0),
+                          offset_transform=IdentityTransform(), transform=IdentityTransform(),
+                          array=counts, cmap=cmap, norm=norm, edgecolors="face", linewidths=0.25,
+                          zorder=zorder)
+    ax.add_collection(coll, autolim=False)
+    if legend_pos and len(counts):
+        _draw_colorbar(ax, coll, legend_pos, fontsize, label)
+    return coll
+
+
+def _draw_colorbar(ax, coll, legend_pos, fontsize, label):
+    xp, yp = _LEGEND_POS[legend_pos]
+    cax = ax.inset_axes([xp, yp, 0.03, 0.30])
+    side = "left" if "right" in legend_pos else "right"     # ticks face the map interior
+    cbar = ax.figure.colorbar(coll, cax=cax, ticklocation=side)
+    cbar.set_label(label, fontsize=fontsize)
+    cax.tick_params(labelsize=fontsize)
+    halo = [pe.withStroke(linewidth=2.5, foreground="white")]
+    for t in cax.get_yticklabels(which="both") + [cax.yaxis.label]:
+        t.set_path_effects(halo)
+    return cbar
+
+
+def _fast_len(n):
+    """Smallest 2^a·3^b·5^c >= n (sizes NumPy's FFT handles quickly)."""
+    best = 1 << max(int(n - 1).bit_length(), 0)
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            m = p35
+            while m < n:
+                m *= 2
+            best = min(best, m)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def kde_grid(lon, lat, extent, shape, bandwidth_km):
+    """Gaussian KDE of lon/lat over extent (x0, x1, y0, y1) on an (ny, nx) grid.
+
+    Returns stations per km² per cell, row 0 at y0. The kernel is applied
+    in frequency space, so the cost is O(grid · log grid) for any number
+    of stations.
+    """
+    x0, x1, y0, y1 = extent
+    ny, nx = shape
+    dx, dy = (x1 - x0) / nx, (y1 - y0) / ny
+    kx = KM_PER_DEG * max(math.cos(math.radians((y0 + y1) / 2)), 1e-6)
+    sx, sy = bandwidth_km / (kx * dx), bandwidth_km / (KM_PER_DEG * dy)      # kernel sigma in cells
+    px, py = min(math.ceil(3 * sx), 2 * nx), min(math.ceil(3 * sy), 2 * ny)
+    gx, gy = nx + 2 * px, ny + 2 * py
+
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    ok = np.isfinite(lon) & np.isfinite(lat)
+    ix = np.floor((lon[ok] - x0) / dx).astype(np.int64) + px
+    iy = np.floor((lat[ok] - y0) / dy).astype(np.int64) + py
+    keep = (ix >= 0) & (ix < gx) & (iy >= 0) & (iy < gy)
+    hist = np.bincount(iy[keep] * gx + ix[keep], minlength=gx * gy).reshape(gy, gx).astype(float)
+
+    fy, fx = _fast_len(gy), _fast_len(gx)
+    spec = np.fft.rfft2(hist, s=(fy, fx))
+    wy, wx = np.fft.fftfreq(fy), np.fft.rfftfreq(fx)
+    spec *= np.exp(-2 * np.pi ** 2 * (sy ** 2 * wy[:, None] ** 2 + sx ** 2 * wx[None, :] ** 2))
+    smooth = np.fft.irfft2(spec, s=(fy, fx))[py:py + ny, px:px + nx]
+    return np.maximum(smooth, 0.0) / (dx * kx * dy * KM_PER_DEG)
+
+
+def draw_heatmap(ax, lon, lat, bandwidth_km=10.0, grid_px=1, cmap="YlOrRd", alpha=0.7,
+                 legend_pos=None, fontsize=8, label="Stations per km²", zorder=2.5):
+    """Draw kde_grid over the visible axes as one image; returns it (None without stations).
+
+    grid_px: grid cell size in output pixels (1 = one cell per pixel).
+    """
+    ax.apply_aspect()
+    bbox = ax.bbox
+    nx = max(int(math.ceil(bbox.width / grid_px)), 1)
+    ny = max(int(math.ceil(bbox.height / grid_px)), 1)
+    (x0, y0), (x1, y1) = ax.transData.inverted().transform([[bbox.x0, bbox.y0], [bbox.x1, bbox.y1]])
+    z = kde_grid(lon, lat, (x0, x1, y0, y1), (ny, nx), bandwidth_km)
+    peak = float(z.max())
+    if not peak > 0:
+        return None
+    ramp = mpl.colormaps[cmap].with_extremes(under=(0, 0, 0, 0))
+    img = ax.imshow(z, extent=(x0, x1, y0, y1), origin="lower", cmap=ramp,
+                    norm=mcolors.Normalize(vmin=HEAT_FLOOR * peak, vmax=peak), alpha=alpha,
+                    interpolation="nearest" if grid_px <= 1 else "bilinear", zorder=zorder)
+    ax.set_xlim(x0, x1)
+    ax.set_ylim(y0, y1)
+    if legend_pos:
+        _draw_colorbar(ax, img, legend_pos, fontsize, label)
+    return img
@@ -0,0 +1,140 @@
+# utils/ingest.py — parse each uploaded station table once
+"""Fingerprinted, column-pruned ingestion of station tables.
+
+Usage in app.py:
+
+from utils.ingest import table_columns, ingest_stations
+
+cols = table_columns(raw, name)                 # header only, for the selectboxes
+df = ingest_stations(raw, name, "DMS", keep=(stn, at, lab))
+
+ingest_stations reads only the coordinate columns plus `keep`, converts them
+to Lat_DD/Lon_DD in row blocks and compacts the result: float64 coordinates
+(full precision for clustering, cache digests and coordinate output), text
+columns as strings (categorical when values repeat). The compact table is
+stored as an uncompressed, single-batch Feather file under
+$CARTOZEN_CACHE_DIR/tables, keyed by the upload digest, coordinate format
+and column set, and memory-mapped on later reruns and sessions instead of
+re-parsing: numeric columns are used straight from the mapping
+(split_blocks, no copy), only text columns are decoded. Without
+pyarrow, only the in-process cache is used. Treat returned frames as
+read-only: they are shared between callers.
+"""
+from __future__ import annotations
+
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.coord_utils_v2 import convert_coords
+from utils.render_cache import digest_bytes, get_render_cache
+from utils.render_engine import check_stations, coord_columns, coord_spec, read_station_table
+
+# bump when the compact layout changes so stale tables are never read
+INGEST_VERSION = 2
+
+CHUNK_ROWS = 250_000        # conversion block size (bounds temporary string copies)
+CATEGORY_RATIO = 0.5        # text column → categorical when unique/rows is at most this
+
+_frames: OrderedDict[str, pd.DataFrame] = OrderedDict()
+_frames_lock = threading.Lock()
+
+
+def table_columns(raw: bytes, name: str) -> list:
+    """Column names of an uploaded table (header only for CSV)."""
+    return list(read_station_table(io.BytesIO(raw), name, nrows=0).columns)
+
+
+def _source_columns(columns, coord_fmt, utm_cols):
+    """(lat_col, lon_col, utm_cols) with the positional UTM default made explicit."""
+    lat_col, lon_col = coord_columns(columns, coord_fmt)
+    if coord_fmt == "UTM":
+        utm_cols = list(utm_cols) if utm_cols else (list(columns[:4]) if len(columns) >= 4 else None)
+    return lat_col, lon_col, (utm_cols if coord_fmt == "UTM" else None)
+
+
+def compact_stations(df: pd.DataFrame, keep=()) -> pd.DataFrame:
+    """Lat_DD/Lon_DD as float64 plus the `keep` columns; text as str/categorical."""
+    out = {}
+    for col in dict.fromkeys(keep):
+        if col is None or col not in df.columns or col in ("Lat_DD", "Lon_DD"):
+            continue
+        s = df[col]
+        if not (pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s)):
+            s = s.astype(str)               # renders identically (labels/legend use str())
+            if s.nunique(dropna=False) <= CATEGORY_RATIO * max(len(s), 1):
+                s = s.astype("category")
+        out[col] = s.reset_index(drop=True)
+    out["Lat_DD"] = df["Lat_DD"].to_numpy(dtype=np.float64)
+    out["Lon_DD"] = df["Lon_DD"].to_numpy(dtype=np.float64)
+    return pd.DataFrame(out)
+
+
+def _parse(raw, name, coord_fmt, utm_cols, keep):
+    header = table_columns(raw, name)
+    lat_col, lon_col, utm_cols = _source_columns(header, coord_fmt, utm_cols)
+    wanted = {c for c in (lat_col, lon_col, *(utm_cols or ()), *keep) if c is not None}
+    df0 = read_station_table(io.BytesIO(raw), name, usecols=[c for c in header if c in wanted])
+
+    parts = [
+        convert_coords(df0.iloc[start:start + CHUNK_ROWS], coord_fmt, lat_col, lon_col, utm_cols=utm_cols)
+        for start in range(0, max(len(df0), 1), CHUNK_ROWS)
+    ]
+    df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    return compact_stations(check_stations(df), keep)
+
+
+def _disk_get(cache, key):
+    path = cache.disk_path(key)
+    if path is None:
+        return None
+    try:
+        from pyarrow import feather
+        # one record batch + split_blocks: numeric columns stay views of the mapping
+        return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True, self_destruct=True)
+    except Exception:            # pyarrow missing or a truncated file → re-parse
+        return None
+
+
+def _disk_put(cache, key, df):
+    try:
+        import pyarrow as pa
+        from pyarrow import feather
+        sink = pa.BufferOutputStream()
+        feather.write_feather(df, sink, compression="uncompressed", chunksize=max(len(df), 1))
+    except Exception:
+        return
+    cache.put(key, sink.getvalue().to_pybytes())
+
+
+def ingest_stations(raw: bytes, name: str, coord_fmt: str, utm_cols=None, keep=(), digest=None) -> pd.DataFrame:
+    """Compact station table for an upload (parsed once per upload + column set).
+
+    Raises ValueError with a user-facing message when the table is unusable
+    (same messages as render_engine.prepare_stations).
+    """
+    keep = tuple(dict.fromkeys(c for c in keep if c is not None))
+    blob = f"ingest|v{INGEST_VERSION}|{digest or digest_bytes(raw)}|{name.lower().rsplit('.', 1)[-1]}" \
+           f"|{coord_spec(coord_fmt, utm_cols)}|{'|'.join(map(str, keep))}"
+    key = digest_bytes(blob.encode("utf-8"))
+
+    with _frames_lock:
+        df = _frames.get(key)
+        if df is not None:
+            _frames.move_to_end(key)
+            return df
+
+    cache = get_render_cache("tables", max_mem_bytes=0)     # disk only; frames live in _frames
+    df = _disk_get(cache, key)
+    if df is None:
+        df = _parse(raw, name, coord_fmt, utm_cols, keep)
+        _disk_put(cache, key, df)
+
+    with _frames_lock:
+        _frames[key] = df
+        while len(_frames) > 4:
+            _frames.popitem(last=False)
+    return df
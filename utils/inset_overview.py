@@ -1,12 +1,19 @@
 # utils/inset_overview.py — Safe-extent + robust country/continent + color wiring
 # Ensures inset extents never go out of PlateCarree bounds and avoids wrap issues.
+# Country/continent lookups go through a process-wide STRtree index (CountryIndex),
+# read from the offline basemap pack when one is installed (build_basemap_pack.py).
 
 import os
+import threading
+import numpy as np
+import shapely
 import cartopy.crs as ccrs
-import cartopy.feature as cfeature
 from matplotlib.patches import Rectangle
+from shapely import STRtree
 from shapely.geometry import Point, box as _box
-from shapely.prepared import prep
+
+from utils.basemap import add_basemap_feature, simplify_tolerance
+from utils.basemap_pack import get_basemap_pack, is_pack
 
 
 # ── helpers ─────────────────────────────────────────────────────────────────
@@ -62,22 +69,52 @@ def _normalize_longitudes(a, b):
     return a, b
 
 
-def _country_and_continent_boxes(bounds, ne_countries_path=None, country_hint=None):
-    """Return (country_box, continent_box, continent_name) in set_extent order.
-    Uses local NE zip if provided, else Cartopy cache; robust to offshore AOIs.
-    """
-    cx = (bounds[0] + bounds[1]) / 2.0
-    cy = (bounds[2] + bounds[3]) / 2.0
-    pt = Point(cx, cy)
-    aoi_box_geom = _box(bounds[0], bounds[2], bounds[1], bounds[3])
+_NAME_KEYS = ("ADMIN","NAME","SOVEREIGNT","BRK_NAME","NAME_LONG","NAME_EN","ADMIN_EN")
+
 
+def _name_of(attrs):
+    for k in _NAME_KEYS:
+        v = _ci_get(attrs, k)
+        if v: return str(v)
+    return None
+
+
+def _country_source(ne_countries_path=None):
+    """Where countries come from: ("pack", path) | ("file", path) | ("cartopy", None).
+
+    A basemap pack given explicitly, then a local NE file/zip (served from the
+    installed pack when the pack was built from that file), then the
+    installed pack (utils/basemap_pack.py), then the Cartopy 110m cache.
+    """
+    pack = get_basemap_pack()
+    if ne_countries_path and os.path.exists(ne_countries_path):
+        if is_pack(ne_countries_path):
+            return "pack", ne_countries_path
+        if pack is not None and pack.has("countries") and \
+                pack.source.get("countries") == os.path.abspath(ne_countries_path):
+            return "pack", pack.path
+        return "file", ne_countries_path
+    if pack is not None and pack.has("countries"):
+        return "pack", pack.path
+    return "cartopy", None
+
+
+def _load_country_records(ne_countries_path=None):
+    """[(geometry, attrs)] from a basemap pack, a local NE file/zip, else the Cartopy 110m cache."""
     records = []
     try:
-        if ne_countries_path and os.path.exists(ne_countries_path):
+        kind, path = _country_source(ne_countries_path)
+        if kind == "pack":
+            pack = get_basemap_pack(path)
+            attrs = pack.attributes("countries")
+            cols = list(attrs)
+            for i, g in enumerate(pack.geometries("countries")):
+                records.append((g, {c: attrs[c][i] for c in cols}))
+        elif kind == "file":
             import geopandas as gpd
             gdf = gpd.read_file(f"zip://{ne_countries_path}") if ne_countries_path.lower().endswith(".zip") else gpd.read_file(ne_countries_path)
             cont_col = next((c for c in ["CONTINENT","continent","Continent"] if c in gdf.columns), None)
-            name_col = next((c for c in ["ADMIN","NAME","SOVEREIGNT","BRK_NAME","NAME_LONG","NAME_EN","ADMIN_EN"] if c in gdf.columns), None)
+            name_col = next((c for c in _NAME_KEYS if c in gdf.columns), None)
             for row in gdf.itertuples(index=False):
                 attrs = {"CONTINENT": getattr(row, cont_col) if cont_col else None}
                 if name_col: attrs[name_col] = getattr(row, name_col)
@@ -91,71 +128,119 @@ def _country_and_continent_boxes(bounds, ne_countries_path=None, country_hint=No
                 records.append((r.geometry, a))
     except Exception:
         records = []
+    return records
 
-    def _name_of(attrs):
-        for k in ("ADMIN","NAME","SOVEREIGNT","BRK_NAME","NAME_LONG","NAME_EN","ADMIN_EN"):
-            v = _ci_get(attrs, k)
-            if v: return str(v)
-        return None
 
-    if country_hint:
-        filt = [(g,a) for (g,a) in records if (nm:=_name_of(a)) and country_hint.lower() in nm.lower()]
-        if filt: records = filt
+class CountryIndex:
+    """Countries of one Natural Earth source behind an STRtree.
 
-    hit_g = hit_a = None
-    for g,a in records:
-        if g is None: continue
-        try:
-            if prep(g).contains(pt): hit_g, hit_a = g, a; break
-        except Exception: pass
-    if hit_g is None:
-        for g,a in records:
-            try:
-                if g is not None and g.intersects(aoi_box_geom): hit_g, hit_a = g, a; break
-            except Exception: pass
-    if hit_g is None:
-        pbuf = pt.buffer(1e-6)
-        for g,a in records:
-            try:
-                if g is not None and g.intersects(pbuf): hit_g, hit_a = g, a; break
-            except Exception: pass
-    if hit_g is None:
-        for g,a in records:
-            try:
-                mnx,mny,mxx,mxy = g.bounds
-                if mnx <= cx <= mxx and mny <= cy <= mxy: hit_g, hit_a = g, a; break
-            except Exception: pass
-    if hit_g is None:
-        best = (1e18, None, None)
-        for g,a in records:
-            try:
-                if g is None: continue
-                d = g.distance(aoi_box_geom)
-                if d < best[0]: best = (d, g, a)
-            except Exception: pass
-        _, hit_g, hit_a = best
-
-    if hit_g is None:
-        return None, None, None
+    Built once per process and source file; lookups return the first record
+    (in file order) that matches, exactly like a linear scan, but only test
+    the few candidates whose envelopes qualify. Continent boxes are
+    precomputed from the per-record bounds.
+    """
+
+    def __init__(self, records):
+        self.attrs = [a for _, a in records]
+        self.geoms = np.array([g for g, _ in records], dtype=object)
+        self.names = [_name_of(a) for a in self.attrs]
+        self.continents = [_ci_get(a, "CONTINENT", _ci_get(a, "continent")) for a in self.attrs]
+        self.bounds = shapely.bounds(self.geoms)           # NaN rows for missing geometries
+        self.tree = STRtree(self.geoms)
+        self.continent_bounds = {}
+        for cont in set(self.continents):
+            if cont is not None:
+                self.continent_bounds[cont] = self._union_bounds(
+                    np.array([c == cont for c in self.continents]))
+
+    def _union_bounds(self, mask):
+        b = self.bounds[mask]
+        b = b[~np.isnan(b).any(axis=1)]
+        if not len(b):
+            return None
+        return (float(b[:, 0].min()), float(b[:, 2].max()), float(b[:, 1].min()), float(b[:, 3].max()))
+
+    def _first(self, idx, allowed):
+        idx = np.asarray(idx, dtype=np.int64)
+        if allowed is not None:
+            idx = idx[allowed[idx]]
+        return int(idx.min()) if len(idx) else None
+
+    def lookup(self, bounds, country_hint=None):
+        """Index of the country for an AOI (contains → intersects → bbox → nearest)."""
+        cx = (bounds[0] + bounds[1]) / 2.0
+        cy = (bounds[2] + bounds[3]) / 2.0
+        pt = Point(cx, cy)
+        aoi = _box(bounds[0], bounds[2], bounds[1], bounds[3])
+
+        allowed = None
+        if country_hint:
+            allowed = np.array([bool(nm) and country_hint.lower() in nm.lower() for nm in self.names])
+            if not allowed.any():
+                allowed = None
+
+        for geom, predicate in ((pt, "within"), (aoi, "intersects"), (pt.buffer(1e-6), "intersects"), (pt, None)):
+            hit = self._first(self.tree.query(geom, predicate=predicate), allowed)
+            if hit is not None:
+                return hit
+
+        # nearest to the AOI; ties resolve to the first record
+        if allowed is None:
+            return self._first(self.tree.query_nearest(aoi, all_matches=True), None)
+        idx = np.flatnonzero(allowed & ~shapely.is_missing(self.geoms))
+        if not len(idx):
+            return None
+        return int(idx[np.argmin(shapely.distance(self.geoms[idx], aoi))])
+
+    def boxes(self, bounds, country_hint=None):
+        """(country_box, continent_box, continent_name) in set_extent order."""
+        hit = self.lookup(bounds, country_hint)
+        if hit is None:
+            return None, None, None
+        mnx, mny, mxx, mxy = self.bounds[hit]
+        cb = None if np.isnan(mnx) else (float(mnx), float(mxx), float(mny), float(mxy))
+
+        cont_name = _ci_get(self.attrs[hit], "CONTINENT", None) or _ci_get(self.attrs[hit], "continent", None)
+        cont_box = None
+        if cont_name is not None:
+            if country_hint and any(country_hint.lower() in (nm or "").lower() for nm in self.names):
+                # hinted lookups only see the matching records, continent box included
+                cont_box = self._union_bounds(np.array([
+                    c == cont_name and bool(nm) and country_hint.lower() in nm.lower()
+                    for c, nm in zip(self.continents, self.names)]))
+            else:
+                cont_box = self.continent_bounds.get(cont_name)
+        return cb, cont_box, cont_name
+
+
+_country_indexes = {}
+_country_indexes_lock = threading.Lock()
+
+
+def get_country_index(ne_countries_path=None):
+    """Process-wide CountryIndex per source (pack or local NE file keyed by size + mtime)."""
+    key = "cartopy-110m"
+    kind, path = _country_source(ne_countries_path)
+    if path is not None:
+        st = os.stat(path)
+        key = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+    with _country_indexes_lock:
+        index = _country_indexes.get(key)
+        if index is None:
+            index = CountryIndex(_load_country_records(ne_countries_path))
+            if index.names:                 # a failed/empty read is retried next time
+                _country_indexes[key] = index
+        return index
 
+
+def _country_and_continent_boxes(bounds, ne_countries_path=None, country_hint=None):
+    """Return (country_box, continent_box, continent_name) in set_extent order.
+    Uses local NE zip if provided, else Cartopy cache; robust to offshore AOIs.
+    """
     try:
-        cb = _to_set_extent_box_from_shapely(hit_g.bounds)
+        cb, cont_box, cont_name = get_country_index(ne_countries_path).boxes(bounds, country_hint)
     except Exception:
-        cb = None
-
-    cont_name = _ci_get(hit_a, "CONTINENT", None) or _ci_get(hit_a, "continent", None)
-    cont_box = None
-    if cont_name is not None:
-        xs_min, xs_max, ys_min, ys_max = [], [], [], []
-        for g,a in records:
-            if _ci_get(a, "CONTINENT", _ci_get(a, "continent")) == cont_name and g is not None:
-                try:
-                    mnx,mny,mxx,mxy = g.bounds
-                    xs_min.append(mnx); xs_max.append(mxx)
-                    ys_min.append(mny); ys_max.append(mxy)
-                except Exception: pass
-        if xs_min:
-            cont_box = (min(xs_min), max(xs_max), min(ys_min), max(ys_max))
+        return None, None, None
 
     if cb is not None:
         a,b = _normalize_longitudes(cb[0], cb[1]); cb = (a,b,cb[2],cb[3])
@@ -176,8 +261,11 @@ def draw_inset_overview(
     inset_size_pct=20,
     aoi_edge_color="#ff0000",       # AOI rectangle
     overlay_edge_color="#0000ff",   # overlay outline inside inset
+    overlay_simplify_px=1.0,        # overlay simplification in inset pixels (0 = off)
     land_color="#f0e8d8",
     ocean_color="#cce6ff",
+    basemap_scale="auto",           # "auto" = LOD from inset size/DPI, or "10m"|"50m"|"110m"
+    basemap_simplify=False,
     aoi_fill_alpha=0.0,
     extent_mode="global",           # global | aoi | country | continent
     extent_pad_deg=3.0,
@@ -216,10 +304,6 @@ def draw_inset_overview(
     ax_inset.set_zorder(99)
     ax_inset.patch.set_alpha(1.0)
 
-    ax_inset.add_feature(cfeature.OCEAN.with_scale("110m"), fc=ocean_color, lw=0)
-    ax_inset.add_feature(cfeature.LAND.with_scale("110m"), fc=land_color, lw=0)
-    ax_inset.add_feature(cfeature.COASTLINE.with_scale("110m"), lw=0.5)
-
     def _pad(box):
         mnx, mxx, mny, mxy = box
         return (mnx - extent_pad_deg, mxx + extent_pad_deg, mny - extent_pad_deg, mxy + extent_pad_deg)
@@ -241,13 +325,17 @@ def draw_inset_overview(
     if set_global:
         ax_inset.set_global()
 
+    # basemap once the extent is known (shared clipped-path cache)
+    view = (-180.0, 180.0, -90.0, 90.0) if set_global else ax_inset.get_extent(ccrs.PlateCarree())
+    add_basemap_feature(ax_inset, "ocean", basemap_scale, view, basemap_simplify, fc=ocean_color, lw=0)
+    add_basemap_feature(ax_inset, "land", basemap_scale, view, basemap_simplify, fc=land_color, lw=0)
+    add_basemap_feature(ax_inset, "coastline", basemap_scale, view, basemap_simplify, lw=0.5)
+
     if plot_overlay and overlay_path is not None:
         try:
-            from utils.overlay_loader import overlay_gdf
-            overlay_gdf(overlay_path).to_crs("EPSG:4326").plot(
-                ax=ax_inset, edgecolor=overlay_edge_color, facecolor="none", lw=1.0,
-                transform=ccrs.PlateCarree(), zorder=100,
-            )
+            from utils.overlay_loader import draw_overlay
+            tol = simplify_tolerance(view, ax_inset.bbox.width, ax_inset.bbox.height, px=overlay_simplify_px)
+            draw_overlay(ax_inset, overlay_path, view, tol, edgecolor=overlay_edge_color, lw=1.0, zorder=100)
         except Exception:
             pass
 
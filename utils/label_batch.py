@@ -0,0 +1,310 @@
+# utils/label_batch.py — station labels as one artist: all halos, then all fills
+"""Batched station labels (LabelCollection).
+
+Usage (render_engine._draw_labels, local_inset_clusters):
+
+from utils.label_batch import LabelCollection
+
+coll = ax.add_artist(LabelCollection(lon, lat, names, fontsize=8, transform=ax.transData))
+texts = coll.labels()          # Text-like handles for declutter_texts / place_labels
+
+A Text with a pe.withStroke halo is drawn as a glyph path twice: stroked
+and filled, then filled again, each time after its own layout. Here every
+unique string is laid out once into a Path (glyph outlines cached per font
+and character, pair kerning as FreeType reports it) and all labels are
+drawn with two PathCollection passes: halos (fill + stroke), then fills.
+Strings that need real text shaping (ligatures, non-Latin scripts, glyphs
+from fallback fonts) use Matplotlib's own TextToPath layout instead.
+
+Vertical alignment is taken from Text's own layout (one probe per distinct
+ascent/descent), so labels land where ax.text(..., path_effects=
+[withStroke]) puts them; widths for centre/right alignment are glyph
+advances (within ~1 px of Text's hinted width). Where labels overlap,
+fills now always sit above every halo.
+"""
+from __future__ import annotations
+
+import re
+import threading
+
+import numpy as np
+import matplotlib as mpl
+import matplotlib.patheffects as pe
+from matplotlib import ft2font
+from matplotlib.artist import Artist
+from matplotlib.collections import PathCollection
+from matplotlib.font_manager import FontProperties, findfont, get_font
+from matplotlib.path import Path
+from matplotlib.text import Text
+from matplotlib.textpath import TextToPath, text_to_path
+from matplotlib.transforms import Affine2D, Bbox, IdentityTransform
+
+FONT_SCALE = TextToPath.FONT_SCALE      # glyph units: points of a FONT_SCALE-pt font
+
+_HA = {"left": 0.0, "center": 0.5, "right": 1.0}
+_VA = ("baseline", "bottom", "center", "top", "center_baseline")
+
+# ligature pairs (fi, fl, ff) and anything beyond Latin Extended-B go through TextToPath
+_SHAPED = re.compile(r"f[fil]|[^\u0000-\u024f]")
+
+# font file → ({char: (verts, codes, advance, glyph index)}, {(left, right): kerning})
+_glyphs: dict = {}
+_glyphs_lock = threading.Lock()
+
+
+def needs_text_artist(s: str) -> bool:
+    """True for labels LabelCollection cannot draw (multi-line or mathtext)."""
+    return "\n" in s or "$" in s
+
+
+def _font_properties(fp):
+    """A private FontProperties from None, a FontProperties, a dict of its
+    keywords or a fontconfig pattern string (as Text's fontproperties=)."""
+    if fp is None:
+        return FontProperties()
+    if isinstance(fp, FontProperties):
+        return fp.copy()
+    if isinstance(fp, dict):
+        return FontProperties(**fp)
+    return FontProperties(fp)
+
+
+def _font(prop):
+    font = get_font(findfont(prop))
+    font.set_size(FONT_SCALE, TextToPath.DPI)
+    return font
+
+
+def _string_layout(prop, s):
+    """(Path | None, advance width, ymin, ymax) of s in glyph units."""
+    font = _font(prop)
+    with _glyphs_lock:
+        glyphs, kerns = _glyphs.setdefault(font.fname, ({}, {}))
+    verts, codes, x, prev = [], [], 0.0, None
+    for c in s:
+        g = glyphs.get(c)
+        if g is None:
+            gi = font.get_char_index(ord(c))
+            if not gi:                                  # missing glyph: let TextToPath pick a fallback font
+                return _shaped_layout(prop, s)
+            adv = font.load_glyph(gi, ft2font.LoadFlags.NO_HINTING).linearHoriAdvance / 65536
+            v, k = font.get_path()
+            g = glyphs[c] = (np.asarray(v, dtype=float), np.asarray(k, dtype=np.uint8), adv, gi)
+        v, k, adv, gi = g
+        if prev is not None:
+            kern = kerns.get((prev, gi))
+            if kern is None:
+                kern = kerns[(prev, gi)] = font.get_kerning(prev, gi, ft2font.Kerning.DEFAULT) / 64
+            x += kern
+        if len(v):
+            verts.append(v + (x, 0.0))
+            codes.append(k)
+        x += adv
+        prev = gi
+    if not verts:
+        return None, x, 0.0, 0.0
+    v = np.concatenate(verts)
+    return Path(v, np.concatenate(codes)), x, float(v[:, 1].min()), float(v[:, 1].max())
+
+
+def _shaped_layout(prop, s):
+    v, k = text_to_path.get_text_path(prop, s)
+    if not len(v):
+        return None, 0.0, 0.0, 0.0
+    v = np.asarray(v, dtype=float)
+    font = _font(prop)
+    font.set_text(s, 0.0, flags=ft2font.LoadFlags.NO_HINTING)
+    return Path(v, np.asarray(k, dtype=np.uint8)), font.get_width_height()[0] / 64, \
+        float(v[:, 1].min()), float(v[:, 1].max())
+
+
+class LabelCollection(Artist):
+    """Many single-line, unrotated labels with one font, colour and halo.
+
+    x, y: anchor positions in `transform` coordinates; ha/va: alignment
+    shared by all labels (per label via the handles from labels());
+    halo_width: stroke width in points (0/None: no halo pass).
+    """
+
+    zorder = 3
+
+    def __init__(self, x, y, strings, fontsize=10, color=None, ha="left", va="baseline",
+                 halo_width=3.0, halo_color="white", fontproperties=None, transform=None, **kwargs):
+        super().__init__()
+        self._xy = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+        strings = np.asarray(strings, dtype=object).astype(str)
+        self._uniq, self._inv = np.unique(strings, return_inverse=True)
+        self._inv = self._inv.ravel()
+        self._fp = _font_properties(fontproperties)
+        self._fp.set_size(fontsize)
+        self._color = mpl.rcParams["text.color"] if color is None else color
+        self._halo_width = float(halo_width or 0.0)
+        self._halo_color = halo_color
+        n = len(self._xy)
+        self._ha = np.full(n, _HA[ha])
+        self._va = np.full(n, _VA.index(va), dtype=np.int8)
+        self._shown = np.ones(n, dtype=bool)
+        self._layout = None                     # per unique string: paths, width, ymin, ymax (glyph units)
+        self._vmetrics = None                   # (scale key, per unique string height/descent px)
+        if transform is not None:
+            self.set_transform(transform)
+        self._internal_update(kwargs)
+
+    def __len__(self):
+        return len(self._xy)
+
+    def labels(self) -> list:
+        """Text-like handles (position, alignment, visibility) for the declutter helpers."""
+        return [_Label(self, i) for i in range(len(self._xy))]
+
+    # ── layout ──────────────────────────────────────────────────────────────
+
+    def _layouts(self):
+        if self._layout is None:
+            out = [(_shaped_layout if _SHAPED.search(s) else _string_layout)(self._fp, s) for s in self._uniq]
+            self._layout = ([o[0] for o in out],) + tuple(np.array([o[i] for o in out]) for i in (1, 2, 3))
+        return self._layout
+
+    def _metrics(self, renderer):
+        """Per unique string (width, height, descent) of its Text box in display px.
+
+        Text's line box depends on the version's layout rules and on the
+        string's ascent/descent only, so one probe Text per distinct
+        (ascent, descent) pair (whole px, like the hinted Agg metrics)
+        gives every string's box; widths are glyph advances.
+        """
+        _, adv, ymin, ymax = self._layouts()
+        scale = renderer.points_to_pixels(self._fp.get_size_in_points()) / FONT_SCALE
+        key = (scale, renderer.points_to_pixels(72.0))
+        if self._vmetrics is None or self._vmetrics[0] != key:
+            ink = np.column_stack([np.round(ymax * scale), np.round(np.maximum(-ymin, 0.0) * scale)])
+            groups, first, inv = np.unique(ink, axis=0, return_index=True, return_inverse=True)
+            hd = np.empty((len(groups), 2))
+            for g, i in enumerate(first):
+                probe = Text(0, 0, self._uniq[i], fontproperties=self._fp, va="baseline", transform=IdentityTransform())
+                probe.set_figure(self.get_figure(root=False))
+                e = probe.get_window_extent(renderer=renderer)
+                hd[g] = e.height, -e.y0
+            self._vmetrics = (key, hd[inv.ravel()])
+        hd = self._vmetrics[1]
+        return adv * scale, hd[:, 0], hd[:, 1], scale
+
+    def _baselines(self, renderer, idx):
+        """Baseline-left display position of labels idx, plus (w, h, d) of each."""
+        w, h, d, scale = self._metrics(renderer)
+        u = self._inv[idx]
+        w, h, d = w[u], h[u], d[u]
+        va = self._va[idx]
+        dy = np.select([va == 1, va == 2, va == 3, va == 4], [d, d - h / 2, -(h - d), -(h - d) / 2], 0.0)
+        anchor = self.get_transform().transform(self._xy[idx])
+        return anchor + np.column_stack([-self._ha[idx] * w, dy]), w, h, d, scale
+
+    def _extents(self, renderer, idx):
+        base, w, h, d, _ = self._baselines(renderer, idx)
+        return np.column_stack([base[:, 0], base[:, 1] - d, base[:, 0] + w, base[:, 1] - d + h])
+
+    def get_window_extent(self, renderer=None):
+        idx = np.flatnonzero(self._shown)
+        if not self.get_visible() or not len(idx):
+            return Bbox.null()
+        renderer = renderer or self.get_figure(root=True).canvas.get_renderer()
+        b = self._extents(renderer, idx)
+        return Bbox([b[:, :2].min(axis=0), b[:, 2:].max(axis=0)])
+
+    # ── drawing ─────────────────────────────────────────────────────────────
+
+    def _collection(self, paths, offsets, scale, **kw):
+        coll = PathCollection(paths, offsets=offsets, offset_transform=IdentityTransform(),
+                              transform=Affine2D().scale(scale), **kw)
+        coll.set_figure(self.get_figure(root=False))
+        coll.set_clip_on(self.get_clip_on())
+        coll.set_clip_box(self.get_clip_box())
+        coll.set_clip_path(self.get_clip_path())
+        coll.set_alpha(self.get_alpha())
+        return coll
+
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
+        paths = self._layouts()[0]
+        drawable = np.array([p is not None for p in paths])[self._inv] & self._shown
+        idx = np.flatnonzero(drawable)
+        if len(idx):
+            base, _, _, _, scale = self._baselines(renderer, idx)
+            ok = np.isfinite(base).all(axis=1)
+            idx, base = idx[ok], base[ok]
+        if len(idx):
+            label_paths = [paths[u] for u in self._inv[idx]]
+            renderer.open_group("labels", gid=self.get_gid())
+            if self._halo_width > 0:
+                self._collection(label_paths, base, scale, facecolors=self._color, edgecolors=self._halo_color,
+                                 linewidths=self._halo_width).draw(renderer)
+            self._collection(label_paths, base, scale, facecolors=self._color, edgecolors="none",
+                             linewidths=0.0).draw(renderer)
+            renderer.close_group("labels")
+        self.stale = False
+
+
+class _Label:
+    """One label of a LabelCollection, with the Text methods the declutter helpers use."""
+
+    __slots__ = ("_coll", "_i")
+
+    def __init__(self, coll, i):
+        self._coll, self._i = coll, i
+
+    def get_text(self):
+        return self._coll._uniq[self._coll._inv[self._i]]
+
+    def get_position(self):
+        x, y = self._coll._xy[self._i]
+        return float(x), float(y)
+
+    def set_position(self, xy):
+        self._coll._xy[self._i] = xy
+        self._coll.stale = True
+
+    def get_transform(self):
+        return self._coll.get_transform()
+
+    def get_figure(self, root=False):
+        return self._coll.get_figure(root=root)
+
+    def get_fontproperties(self):
+        return self._coll._fp
+
+    def get_fontsize(self):
+        return self._coll._fp.get_size_in_points()
+
+    def get_color(self):
+        return self._coll._color
+
+    def get_rotation(self):
+        return 0.0
+
+    def get_path_effects(self):
+        c = self._coll
+        return [pe.withStroke(linewidth=c._halo_width, foreground=c._halo_color)] if c._halo_width > 0 else []
+
+    def get_horizontalalignment(self):
+        return {v: k for k, v in _HA.items()}[float(self._coll._ha[self._i])]
+
+    def set_horizontalalignment(self, ha):
+        self._coll._ha[self._i] = _HA[ha]
+
+    def get_verticalalignment(self):
+        return _VA[self._coll._va[self._i]]
+
+    def set_verticalalignment(self, va):
+        self._coll._va[self._i] = _VA.index(va)
+
+    def get_visible(self):
+        return bool(self._coll._shown[self._i])
+
+    def set_visible(self, b):
+        self._coll._shown[self._i] = bool(b)
+        self._coll.stale = True
+
+    def get_window_extent(self, renderer=None):
+        renderer = renderer or self._coll.get_figure(root=True).canvas.get_renderer()
+        return Bbox(self._coll._extents(renderer, np.array([self._i])).reshape(2, 2))
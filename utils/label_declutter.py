@@ -6,48 +6,451 @@ Usage in app.py (after placing texts = [ax.text(...), ...]):
 from utils.label_declutter import declutter_texts
 
 _ = declutter_texts(ax, texts)  # modifies positions in-place
+
+# or: candidate placement (no repulsion); labels that do not fit are hidden
+# (dropped="count": replaced by "+k" markers where room allows)
+extra = place_labels(ax, texts, points=np.c_[lon, lat], marker_px=7.0)
+
+The fallback measures every label once, then repels overlapping pairs as
+NumPy array steps; overlaps are found through a uniform grid hash instead
+of testing all pairs, and positions are written back to the Text objects
+only at the end.
+
+Both engines honour a wall-clock budget (time_budget=, seconds) and fill
+an optional report dict (engine, iterations, stop reason, seconds,
+overlapping pairs before/after, label displacement in px):
+
+rep = {}
+declutter_texts(ax, texts, time_budget=5.0, report=rep)
+# {"engine": "fallback", "iterations": 143, "stopped": "budget", "overlaps_after": 12, ...}
+
+place_labels never moves labels iteratively: each label, in input order
+(the priority), takes the first of up to 8 candidate positions around its
+station (NE, SE, NW, SW, E, W, N, S) whose box stays inside the axes and
+hits no marker or already placed label in a uniform grid index. The result
+is deterministic and costs O(labels × candidates).
 """
 from __future__ import annotations
+import inspect
+import time
 from typing import List
 
+import numpy as np
+from matplotlib.text import Text
+from matplotlib.transforms import IdentityTransform
+
+# lower-left corner of a w×h label relative to its station, for marker radius r
+CANDIDATES = (
+    lambda w, h, r: (r, r),                  # NE
+    lambda w, h, r: (r, -h - r),             # SE
+    lambda w, h, r: (-w - r, r),             # NW
+    lambda w, h, r: (-w - r, -h - r),        # SW
+    lambda w, h, r: (r, -h / 2),             # E
+    lambda w, h, r: (-w - r, -h / 2),        # W
+    lambda w, h, r: (-w / 2, r),             # N
+    lambda w, h, r: (-w / 2, -h - r),        # S
+)
+
+# adjustText 1.x checks its time limit only between iterations, and one
+# iteration over a dense set can take seconds and gigabytes; beyond this many
+# labels the fallback runs instead
+ADJUSTTEXT_MAX_LABELS = 500
+
 
-def declutter_texts(ax, texts: List, max_iter: int = 200) -> bool:
+def uses_adjusttext(n_labels: int) -> bool:
+    """True when declutter_texts would hand n_labels Text objects to adjustText."""
+    if n_labels > ADJUSTTEXT_MAX_LABELS:
+        return False
+    try:
+        import adjustText  # noqa: F401  optional dependency
+    except ImportError:
+        return False
+    return True
+
+
+def declutter_texts(ax, texts: List, max_iter: int = 200, time_budget: float | None = None,
+                    report: dict | None = None) -> bool:
     """Attempt to reduce overlaps for a list of matplotlib Text objects on ax.
-    Returns True if adjustText was used, False if fallback ran.
+    Returns True if adjustText was used, False if fallback ran. Handles from
+    LabelCollection.labels() always take the fallback.
+
+    time_budget: wall-clock limit in seconds for the iterations (None: only
+    max_iter); report: optional dict, filled with the run report (see
+    _finish_report).
     """
+    t0 = time.perf_counter()
+    report = {} if report is None else report
+    report.clear()
+    report.update(engine="fallback", labels=len(texts), budget_s=time_budget, iterations=0)
+    if not texts:
+        _finish_report(report, t0, None, None, "converged")
+        return False
+    renderer = ax.figure.canvas.get_renderer()
+    before = _text_boxes(texts, renderer)
+    if not isinstance(texts[0], Text) or not uses_adjusttext(len(texts)):
+        return _fallback(ax, texts, max_iter, time_budget, t0, before, before, report)
+    from adjustText import adjust_text  # optional dependency
+    t_run = time.perf_counter()
     try:
-        from adjustText import adjust_text  # optional dependency
-        adjust_text(
-            texts,
-            ax=ax,
-            only_move={"points": "y", "texts": "xy"},
-            autoalign=True,
-            expand_points=(1.05, 1.2),
-            expand_text=(1.05, 1.2),
-            force_points=0.2,
-            force_text=0.2,
-            arrowprops=dict(arrowstyle="-", lw=0.6, alpha=0.7),
-        )
-        return True
+        timed = "time_lim" in inspect.signature(adjust_text).parameters
+        if timed:                                                       # adjustText >= 1.0 (default limit: 1 s)
+            adjust_text(
+                texts,
+                ax=ax,
+                only_move={"text": "xy", "static": "y"},
+                expand=(1.05, 1.2),
+                force_text=0.2,
+                force_static=0.2,
+                arrowprops=dict(arrowstyle="-", lw=0.6, alpha=0.7),
+                **({} if time_budget is None else {"time_lim": time_budget}),
+            )
+        else:                                                           # 0.x: no time limit
+            adjust_text(
+                texts,
+                ax=ax,
+                only_move={"points": "y", "texts": "xy"},
+                autoalign=True,
+                expand_points=(1.05, 1.2),
+                expand_text=(1.05, 1.2),
+                force_points=0.2,
+                force_text=0.2,
+                arrowprops=dict(arrowstyle="-", lw=0.6, alpha=0.7),
+                lim=max_iter,
+            )
     except Exception:
-        # lightweight fallback: iterative bbox repulsion
-        fig = ax.figure
-        renderer = fig.canvas.get_renderer()
-        for _ in range(max_iter):
-            moved = False
-            bbs = [t.get_window_extent(renderer=renderer).expanded(1.05, 1.2) for t in texts]
-            for i in range(len(texts)):
-                for j in range(i + 1, len(texts)):
-                    if bbs[i].overlaps(bbs[j]):
-                        xi, yi = texts[i].get_position()
-                        xj, yj = texts[j].get_position()
-                        dx, dy = (xi - xj), (yi - yj)
-                        if dx == 0 and dy == 0:
-                            dx, dy = 0.0005, 0.0005
-                        s = 0.002
-                        texts[i].set_position((xi + s * dx, yi + s * dy))
-                        texts[j].set_position((xj - s * dx, yj - s * dy))
-                        moved = True
-            if not moved:
+        # a genuine adjustText failure: it may have moved texts part-way, so re-measure
+        return _fallback(ax, texts, max_iter, time_budget, t0, before, None, report)
+    elapsed = time.perf_counter() - t_run
+    after = _text_boxes(texts, renderer)
+    if not len(_overlap_pairs(*after.T)[0]):
+        stopped = "converged"
+    elif not timed:
+        stopped = "max_iter"
+    else:
+        # overlaps left: only a run that used up time_lim stopped on the budget
+        stopped = "budget" if elapsed >= (1.0 if time_budget is None else time_budget) else "residual_overlap"
+    report.update(engine="adjustText", iterations=None)         # adjustText does not expose its step count
+    _finish_report(report, t0, before, after, stopped)
+    return True
+
+
+def _fallback(ax, texts, max_iter, time_budget, t0, before, boxes, report):
+    """Run _repel_fallback for declutter_texts and fill its report; returns False."""
+    iterations, stopped, after = _repel_fallback(ax, texts, max_iter, time_budget=time_budget, t0=t0, boxes=boxes)
+    report["iterations"] = iterations
+    _finish_report(report, t0, before, after, stopped)
+    return False
+
+
+def _finish_report(report, t0, before, after, stopped):
+    """Complete a declutter run report.
+
+    Keys: engine ("adjustText" | "fallback"), labels, budget_s, iterations
+    (None for adjustText), stopped ("converged": no overlaps left |
+    "budget" | "max_iter" | "stalled": no progress | "residual_overlap":
+    adjustText finished within its budget with overlaps left), seconds,
+    overlaps_before / overlaps_after (overlapping label pairs),
+    displacement_px / max_displacement_px (label centre moves).
+    """
+    report["stopped"] = stopped
+    report["seconds"] = round(time.perf_counter() - t0, 4)
+    if before is None:
+        report.update(overlaps_before=0, overlaps_after=0, displacement_px=0.0, max_displacement_px=0.0)
+        return report
+    moved = np.hypot(*((after[:, :2] + after[:, 2:]) / 2 - (before[:, :2] + before[:, 2:]) / 2).T)
+    report.update(
+        overlaps_before=int(len(_overlap_pairs(*before.T)[0])),
+        overlaps_after=int(len(_overlap_pairs(*after.T)[0])),
+        displacement_px=round(float(moved.sum()), 1),
+        max_displacement_px=round(float(moved.max()), 1),
+    )
+    return report
+
+
+def _overlap_pairs(x0, y0, x1, y1):
+    """(i, j) index arrays (i < j) of overlapping boxes, via a uniform grid.
+
+    The cell size is the largest box side, so a box can only meet boxes
+    whose lower-left corner lies in its own or one of the 8 neighbouring cells.
+    """
+    n = len(x0)
+    empty = np.zeros(0, np.int64)
+    if n < 2:
+        return empty, empty
+    cell = max(float((x1 - x0).max()), float((y1 - y0).max()), 1e-9)
+    cx = np.floor(x0 / cell).astype(np.int64)
+    cy = np.floor(y0 / cell).astype(np.int64)
+    cx -= cx.min() - 1
+    cy -= cy.min() - 1
+    ny = int(cy.max()) + 2
+    key = cx * ny + cy
+    order = np.argsort(key, kind="stable")
+    skey = key[order]
+
+    ii, jj = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            nk = key + dx * ny + dy
+            lo = np.searchsorted(skey, nk, "left")
+            cnt = np.searchsorted(skey, nk, "right") - lo
+            total = int(cnt.sum())
+            if not total:
+                continue
+            i = np.repeat(np.arange(n), cnt)
+            run = np.arange(total) - np.repeat(np.cumsum(cnt) - cnt, cnt)   # position within each run
+            j = order[np.repeat(lo, cnt) + run]
+            keep = i < j
+            ii.append(i[keep])
+            jj.append(j[keep])
+    if not ii:
+        return empty, empty
+    i, j = np.concatenate(ii), np.concatenate(jj)
+    hit = (x0[i] < x1[j]) & (x0[j] < x1[i]) & (y0[i] < y1[j]) & (y0[j] < y1[i])
+    return i[hit], j[hit]
+
+
+def _repel_fallback(ax, texts, max_iter=200, step=0.002, time_budget=None, t0=None, boxes=None, patience=50):
+    """Iterative bbox repulsion on arrays; Text objects are updated once at the end.
+
+    Stops when no overlaps remain, after max_iter steps, once time_budget
+    seconds (from t0) are spent, or when the overlap count has not improved
+    for `patience` steps. Returns (iterations, stop reason, final label
+    boxes in display px).
+    """
+    if boxes is None:
+        boxes = _text_boxes(texts, ax.figure.canvas.get_renderer())
+    if len(texts) < 2:
+        return 0, "converged", boxes
+    deadline = None if time_budget is None else (t0 or time.perf_counter()) + time_budget
+    pos = np.array([t.get_position() for t in texts], dtype=float)
+    trans = [t.get_transform() for t in texts]
+    shared = all(tr == trans[0] for tr in trans)
+
+    def to_display(p):
+        if shared:
+            return trans[0].transform(p)
+        return np.array([tr.transform(q) for tr, q in zip(trans, p)])
+
+    # label boxes (display px, expanded like before) relative to their anchors; sizes never change
+    w, h = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+    grow = np.c_[-0.025 * w, -0.1 * h, 0.025 * w, 0.1 * h]
+    rel = boxes + grow - np.tile(to_display(pos), 2)
+
+    stopped, done, best, since = "max_iter", max_iter, None, 0
+    for it in range(max_iter):
+        anchor = np.tile(to_display(pos), 2)
+        x0, y0, x1, y1 = (rel + anchor).T
+        i, j = _overlap_pairs(x0, y0, x1, y1)
+        if not len(i):
+            stopped, done = "converged", it
+            break
+        if best is None or len(i) < best:
+            best, since = len(i), 0
+        else:
+            since += 1
+            if since >= patience:
+                stopped, done = "stalled", it
                 break
+        if deadline is not None and time.perf_counter() >= deadline:
+            stopped, done = "budget", it
+            break
+        d = pos[i] - pos[j]
+        d[(d == 0).all(axis=1)] = 0.0005
+        move = np.zeros_like(pos)
+        np.add.at(move, i, step * d)
+        np.add.at(move, j, -step * d)
+        pos += move
+
+    for t, p in zip(texts, pos):
+        t.set_position((float(p[0]), float(p[1])))
+    return done, stopped, rel - grow + np.tile(to_display(pos), 2)
+
+
+class _BoxGrid:
+    """Uniform grid of axis-aligned boxes (display px) for collision tests."""
+
+    def __init__(self, cell):
+        self.cell = float(cell)
+        self.cells = {}
+        self.boxes = []
+
+    def _keys(self, b):
+        c = self.cell
+        for gx in range(int(b[0] // c), int(b[2] // c) + 1):
+            for gy in range(int(b[1] // c), int(b[3] // c) + 1):
+                yield gx, gy
+
+    def hits(self, b):
+        boxes = self.boxes
+        for k in self._keys(b):
+            for i in self.cells.get(k, ()):
+                o = boxes[i]
+                if b[0] < o[2] and o[0] < b[2] and b[1] < o[3] and o[1] < b[3]:
+                    return True
         return False
+
+    def add(self, b):
+        self.boxes.append(b)
+        i = len(self.boxes) - 1
+        for k in self._keys(b):
+            self.cells.setdefault(k, []).append(i)
+
+
+def _try_place(grid, bounds, px, py, w, h, r, pad, n_candidates):
+    """Lower-left corner (display px) of the first free candidate, else None."""
+    for cand in CANDIDATES[:n_candidates]:
+        ox, oy = cand(w, h, r + pad)                # clear of the station's own marker
+        b = (px + ox - pad, py + oy - pad, px + ox + w + pad, py + oy + h + pad)
+        if b[0] < bounds[0] or b[1] < bounds[1] or b[2] > bounds[2] or b[3] > bounds[3]:
+            continue
+        if not grid.hits(b):
+            grid.add(b)
+            return px + ox, py + oy
+    return None
+
+
+def _is_plain(t):
+    s = t.get_text()
+    return not ("\n" in s or "$" in s or t.get_rotation() % 360)
+
+
+def _label_sizes(texts, renderer):
+    """(n, 2) label width/height in display px.
+
+    Single-line, unrotated plain labels are measured by summing cached glyph
+    advances per font (≤ ~1 px wider than Matplotlib's layout, no kerning);
+    a full layout per label is ~1 ms. The height comes from one laid-out
+    label per font. Anything else falls back to get_window_extent.
+    """
+    sizes = np.zeros((len(texts), 2))
+    fonts = {}
+    for k, t in enumerate(texts):
+        s = t.get_text()
+        if not _is_plain(t):
+            e = t.get_window_extent(renderer=renderer)
+            sizes[k] = e.width, e.height
+            continue
+        fp = t.get_fontproperties()
+        font = fonts.get(fp)
+        if font is None:
+            font = fonts[fp] = ({}, t.get_window_extent(renderer=renderer).height)
+        glyphs, height = font
+        w = 0.0
+        for c in s:
+            g = glyphs.get(c)
+            if g is None:
+                g = glyphs[c] = renderer.get_text_width_height_descent(c, fp, ismath=False)[0]
+            w += g
+        sizes[k] = w, height
+    return sizes
+
+
+def _text_boxes(texts, renderer):
+    """(n, 4) x0, y0, x1, y1 display boxes of texts at their current position
+    and alignment, from _label_sizes (no layout per plain label)."""
+    sizes = _label_sizes(texts, renderer)
+    pos = np.array([t.get_position() for t in texts], dtype=float)
+    trans = texts[0].get_transform()
+    if all(t.get_transform() == trans for t in texts):
+        anchor = trans.transform(pos)
+    else:
+        anchor = np.array([t.get_transform().transform(p) for t, p in zip(texts, pos)])
+    boxes = np.empty((len(texts), 4))
+    descents = {}
+    for k, t in enumerate(texts):
+        if not _is_plain(t):
+            boxes[k] = t.get_window_extent(renderer=renderer).extents
+            continue
+        (w, h), (ax_, ay) = sizes[k], anchor[k]
+        ha, va = t.get_horizontalalignment(), t.get_verticalalignment()
+        dx = {"center": w / 2, "right": w}.get(ha, 0.0)
+        if va in ("baseline", "center_baseline"):
+            fp = t.get_fontproperties()
+            d = descents.get(fp)
+            if d is None:
+                probe = Text(0, 0, t.get_text(), fontproperties=fp, va="baseline", transform=IdentityTransform())
+                probe.set_figure(t.get_figure())
+                d = descents[fp] = -probe.get_window_extent(renderer=renderer).y0
+            dy = d if va == "baseline" else (h - d) / 2 + d
+        else:
+            dy = {"center": h / 2, "top": h}.get(va, 0.0)
+        boxes[k] = ax_ - dx, ay - dy, ax_ - dx + w, ay - dy + h
+    return boxes
+
+
+def place_labels(ax, texts: List, points, marker_px: float = 5.0, pad_px: float = 2.0,
+                 n_candidates: int = 8, dropped: str = "hide", report: dict | None = None) -> list:
+    """Candidate-position placement with a collision grid.
+
+    points: (n, 2) station positions in the texts' coordinates (one per text);
+    marker_px: marker radius in display pixels (markers are obstacles too);
+    dropped: "hide" | "count" — count adds a "+k" text per grid cell of
+    dropped labels where one still fits.
+    Texts are re-anchored left/bottom; unplaced ones are hidden. Returns the
+    added count texts. report: optional dict, filled with engine ("place"),
+    labels, placed, dropped, count_labels and seconds.
+    """
+    t0 = time.perf_counter()
+    report = {} if report is None else report
+    report.clear()
+    report.update(engine="place", labels=len(texts), placed=0, dropped=0, count_labels=0)
+    if not texts:
+        report["seconds"] = 0.0
+        return []
+    renderer = ax.figure.canvas.get_renderer()
+    trans = texts[0].get_transform()
+    for t in texts:
+        t.set_horizontalalignment("left")
+        t.set_verticalalignment("bottom")
+    sizes = _label_sizes(texts, renderer)
+    disp = trans.transform(np.asarray(points, dtype=float))
+    inv = trans.inverted()
+    bounds = ax.bbox.extents
+    r = float(marker_px)
+
+    grid = _BoxGrid(max(4.0 * float(np.median(sizes[:, 1])), 2.0 * r, 1.0))
+    for px, py in disp:                                    # markers are obstacles
+        if np.isfinite(px) and np.isfinite(py):
+            grid.add((px - r, py - r, px + r, py + r))
+
+    lower_left = np.full((len(texts), 2), np.nan)
+    for k, ((px, py), (w, h)) in enumerate(zip(disp, sizes)):
+        if not (np.isfinite(px) and np.isfinite(py)) or w <= 0:
+            continue
+        hit = _try_place(grid, bounds, px, py, w, h, r, pad_px, n_candidates)
+        if hit is not None:
+            lower_left[k] = hit
+
+    ok = ~np.isnan(lower_left[:, 0])
+    data = inv.transform(np.where(ok[:, None], lower_left, 0.0))
+    for t, placed, p in zip(texts, ok, data):
+        if placed:
+            t.set_position((float(p[0]), float(p[1])))
+        else:
+            t.set_visible(False)
+
+    added = []
+    lost = np.flatnonzero(~ok & np.isfinite(disp).all(axis=1))
+    if dropped == "count" and len(lost):
+        ref = texts[lost[0]]
+        cell = grid.cell
+        keys = np.floor(disp[lost] / cell).astype(np.int64)
+        groups = {}
+        for i, key in zip(lost, map(tuple, keys)):
+            groups.setdefault(key, []).append(i)
+        for key in sorted(groups):
+            members = groups[key]
+            cx, cy = disp[members].mean(axis=0)
+            t = ax.text(0, 0, f"+{len(members)}", fontsize=ref.get_fontsize(), color=ref.get_color(),
+                        transform=trans, path_effects=ref.get_path_effects(), clip_on=True,
+                        ha="left", va="bottom")
+            e = t.get_window_extent(renderer=renderer)
+            hit = _try_place(grid, bounds, cx, cy, e.width, e.height, r, pad_px, n_candidates)
+            if hit is None:
+                t.remove()
+                continue
+            t.set_position(tuple(inv.transform(hit)))
+            added.append(t)
+    report.update(placed=int(ok.sum()), dropped=int(len(texts) - ok.sum()), count_labels=len(added),
+                  seconds=round(time.perf_counter() - t0, 4))
+    return added
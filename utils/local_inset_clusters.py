@@ -8,7 +8,9 @@
 import matplotlib.pyplot as plt
 import matplotlib.patheffects as pe
 import cartopy.crs as ccrs
-import cartopy.feature as cfeature
+
+from utils.basemap import add_basemap_feature
+from utils.label_batch import LabelCollection, needs_text_artist
 
 
 def _data_to_fig_xy(ax, lon, lat):
@@ -78,6 +80,8 @@ def draw_cluster_insets(
     box_frac=0.18,
     land_color="#f0e8d8",
     ocean_color="#cce6ff",
+    basemap_scale="auto",        # "auto" = LOD from inset size/DPI, or "10m"|"50m"|"110m"
+    basemap_simplify=False,
     marker_color="#6a5acd",
     marker_size=16,
     # label options inside the mini‑inset
@@ -117,41 +121,52 @@ def draw_cluster_insets(
     h = mb.height * float(box_frac)
 
     axes = []
+    labelled = show_labels and label_col and (label_col in df.columns)
     for cid, size in big:
-        sub = df.iloc[clusters[cid]][["Lon_DD", "Lat_DD"]]
-        mnx, mxx = float(sub["Lon_DD"].min()), float(sub["Lon_DD"].max())
-        mny, mxy = float(sub["Lat_DD"].min()), float(sub["Lat_DD"].max())
-        cx, cy   = float(sub["Lon_DD"].mean()), float(sub["Lat_DD"].mean())
+        # one positional lookup per cluster: coordinates (+ label strings) as arrays
+        lon = df["Lon_DD"].iloc[clusters[cid]].to_numpy(dtype=float)
+        lat = df["Lat_DD"].iloc[clusters[cid]].to_numpy(dtype=float)
+        mnx, mxx = float(lon.min()), float(lon.max())
+        mny, mxy = float(lat.min()), float(lat.max())
+        cx, cy   = float(lon.mean()), float(lat.mean())
 
         rect = _place_rect_near(ax_main, cx, cy, w, h, anchor=_resolve_anchor(anchor), offset=float(offset_frac))
         axx = fig.add_axes(rect, projection=ccrs.PlateCarree())
         axx.set_in_layout(False)
         axx.set_zorder(90)
 
-        # basemap
-        axx.add_feature(cfeature.OCEAN.with_scale("110m"), fc=ocean_color, lw=0)
-        axx.add_feature(cfeature.LAND.with_scale("110m"), fc=land_color, lw=0)
-        axx.add_feature(cfeature.COASTLINE.with_scale("110m"), lw=0.5)
-
         # extent
-        axx.set_extent((mnx - pad_deg, mxx + pad_deg, mny - pad_deg, mxy + pad_deg), crs=ccrs.PlateCarree())
+        extent = (mnx - pad_deg, mxx + pad_deg, mny - pad_deg, mxy + pad_deg)
+        axx.set_extent(extent, crs=ccrs.PlateCarree())
+
+        # basemap (shared clipped-path cache)
+        add_basemap_feature(axx, "ocean", basemap_scale, extent, basemap_simplify, fc=ocean_color, lw=0)
+        add_basemap_feature(axx, "land", basemap_scale, extent, basemap_simplify, fc=land_color, lw=0)
+        add_basemap_feature(axx, "coastline", basemap_scale, extent, basemap_simplify, lw=0.5)
 
         # points
-        axx.scatter(sub["Lon_DD"], sub["Lat_DD"], s=marker_size**2, c=marker_color, transform=ccrs.PlateCarree())
+        axx.scatter(lon, lat, s=marker_size**2, c=marker_color, transform=ccrs.PlateCarree())
 
         # labels (optional) — style similar to marker: same color by default + white halo
-        if show_labels and label_col and (label_col in df.columns):
+        if labelled:
             ha = {"left": "left", "center": "center", "right": "right"}.get(str(label_align).lower(), "left")
             peff = [pe.withStroke(linewidth=label_halo_width, foreground=label_halo_color)] if label_halo else None
             col = label_color or marker_color
             dx_px, dy_px = label_offset_px
-            for idx in clusters[cid]:
-                axx.text(
-                    float(df.iloc[idx]["Lon_DD"]), float(df.iloc[idx]["Lat_DD"]),
-                    str(df.iloc[idx][label_col]), fontsize=label_fontsize,
-                    color=col, transform=ccrs.PlateCarree(), ha=ha, va="bottom",
-                    path_effects=peff,
-                )
+            labels = df[label_col].iloc[clusters[cid]].astype(str).tolist()
+            trans = axx.transData     # PlateCarree axes: data coordinates are lon/lat
+            if any(needs_text_artist(s) for s in labels):
+                for x, y, s in zip(lon.tolist(), lat.tolist(), labels):
+                    axx.text(
+                        x, y, s, fontsize=label_fontsize,
+                        color=col, transform=trans, ha=ha, va="bottom",
+                        path_effects=peff,
+                    )
+            else:
+                axx.add_artist(LabelCollection(
+                    lon, lat, labels, fontsize=label_fontsize, color=col, transform=trans, ha=ha, va="bottom",
+                    halo_width=label_halo_width if label_halo else 0, halo_color=label_halo_color,
+                ))
 
         # frame
         axx.set_xticks([]); axx.set_yticks([])
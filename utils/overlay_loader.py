@@ -1,16 +1,252 @@
-import geopandas as gpd
+# utils/overlay_loader.py — read overlay uploads once, reproject once, share
+"""Overlay (shapefile zip / GeoJSON / KML / GeoParquet / FlatGeobuf) loading.
+
+Usage:
+
+from utils.basemap import simplify_tolerance
+from utils.overlay_loader import draw_overlay, load_overlay
+
+extent = ax.get_extent(ccrs.PlateCarree())
+tol = simplify_tolerance(extent, ax.bbox.width, ax.bbox.height, px=0.5)
+draw_overlay(ax, cfg["overlay"], extent, tol, edgecolor="#0000ff", lw=1)   # only what is visible
+
+gdf = load_overlay(cfg["overlay"], bbox=extent)     # EPSG:4326 GeoDataFrame, shared; read-only
+
+load_overlay keeps the parsed and reprojected GeoDataFrame in a process-wide
+LRU keyed by the upload digest (or path + size + mtime for plain paths),
+bounded by entry count and total vertex bytes, so every rerun, the main map
+and the overview inset reuse one object. Treat it as read-only. Zip uploads
+are unpacked through a temporary file that is removed right after reading;
+GeoJSON, KML, FlatGeobuf and GeoParquet are read straight from the upload
+buffer. overlay_gdf(src) still returns the raw, unprojected frame.
+
+With bbox (lon/lat extent, rounded outward like the basemap cache) only
+intersecting features are kept: filtered in memory through the spatial
+index when the whole overlay is already cached, else read with a bbox
+filter: GDAL's (spatially indexed for shapefiles, FlatGeobuf, GeoPackage)
+or GeoParquet's covering column / row-group statistics (files without
+one are read whole and filtered in memory), geometry column only.
+overlay_view additionally clips to that extent and simplifies to a
+tolerance in degrees (e.g. half an output pixel of the target axes), and
+caches the result per (overlay, rounded extent, tolerance), so a
+national-scale layer costs only the vertices that can be seen.
+
+draw_overlay turns such a view into one prebuilt compound Path (polygon
+rings + lines, from shapely.get_coordinates offsets) cached alongside it,
+and adds it as a single PathCollection (plus one scatter for point
+features), instead of GeoDataFrame.plot's per-geometry artists.
+"""
+import io
+import os
 import tempfile
+import threading
+from collections import OrderedDict
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from matplotlib.collections import PathCollection
+
+from utils.basemap import geometry_path, round_extent
+from utils.render_cache import buffer_digest
+
+MAX_OVERLAYS = 8
+MAX_OVERLAY_BYTES = 512 << 20       # ~16 bytes per vertex
+
+_overlays: OrderedDict = OrderedDict()
+_overlays_bytes = 0
+_overlays_lock = threading.Lock()
+
+
+PARQUET_EXT = (".parquet", ".geoparquet")
+FLATGEOBUF_EXT = (".fgb",)
+
+
+def _geoparquet_meta(src):
+    """(CRS, column name, bbox-filterable) of a GeoParquet file's primary geometry column.
+
+    CRS None = OGC:CRS84. bbox-filterable: the file has a bbox covering
+    column or point encoding, which gpd.read_parquet(bbox=) requires.
+    """
+    import json
+    import pyarrow.parquet as pq
+    geo = json.loads(pq.read_schema(src).metadata[b"geo"])
+    col = geo["columns"][geo["primary_column"]]
+    indexed = "bbox" in (col.get("covering") or {}) or col.get("encoding") == "point"
+    return col.get("crs", "OGC:CRS84"), geo["primary_column"], indexed
+
+
+def _read_geoparquet(src, bbox=None, geometry_only=False):
+    """GeoParquet from a path or buffer: bbox uses the covering column (with
+    row-group statistics) when the file has one, else the file is read whole
+    and filtered in memory through its spatial index; geometry_only skips
+    attribute columns."""
+    crs, geom_col, indexed = _geoparquet_meta(src)
+    kw = {"columns": [geom_col]} if geometry_only else {}
+    file_bbox = None
+    if bbox is not None:
+        # bbox GeoSeries (any CRS) → bounds in the file CRS, densified so curved edges stay inside
+        b = bbox.to_crs("EPSG:4326").total_bounds
+        edge = shapely.segmentize(shapely.box(*b), max(b[2] - b[0], b[3] - b[1]) / 16)
+        file_bbox = tuple(gpd.GeoSeries([edge], crs="EPSG:4326").to_crs(crs or "OGC:CRS84").total_bounds)
+        if indexed:
+            kw["bbox"] = file_bbox
+    if hasattr(src, "seek"):
+        src.seek(0)
+    gdf = gpd.read_parquet(src, **kw)
+    if file_bbox is not None and not indexed:
+        # plain to_parquet() output has no covering column: read_parquet(bbox=) would raise
+        gdf = gdf.iloc[np.sort(gdf.sindex.query(shapely.box(*file_bbox), predicate="intersects"))]
+    return gdf
+
 
-def overlay_gdf(file_obj):
+def overlay_gdf(file_obj, bbox=None, geometry_only=False):
+    # bbox: optional read filter (a GeoSeries is reprojected to the layer CRS);
+    # geometry_only: skip attribute columns
+    kw = {} if bbox is None else {"bbox": bbox}
+    if geometry_only:
+        kw["columns"] = []
+    # Plain paths (batch/CLI renders) go straight to GDAL / Arrow
+    if isinstance(file_obj, (str, os.PathLike)):
+        path = os.fspath(file_obj)
+        if path.lower().endswith(PARQUET_EXT):
+            return _read_geoparquet(path, bbox, geometry_only)
+        return gpd.read_file(f"zip://{path}", **kw) if path.lower().endswith(".zip") else gpd.read_file(path, **kw)
     name = file_obj.name.lower()
-    if name.endswith(".geojson"):
-        return gpd.read_file(file_obj)
-    elif name.endswith(".kml"):
-        return gpd.read_file(f"/vsizip/{file_obj.name}")
+    if name.endswith(PARQUET_EXT):
+        return _read_geoparquet(io.BytesIO(file_obj.getvalue()), bbox, geometry_only)
+    elif name.endswith((".geojson", ".kml") + FLATGEOBUF_EXT):
+        # read straight from the upload buffer (GDAL /vsimem, spatial index used for FlatGeobuf)
+        return gpd.read_file(io.BytesIO(file_obj.getvalue()), **kw)
     elif name.endswith(".zip"):
-        tmp = tempfile.mktemp(suffix=".zip")
-        with open(tmp, "wb") as f:
-            f.write(file_obj.getbuffer())
-        return gpd.read_file(f"zip://{tmp}")
+        fd, tmp = tempfile.mkstemp(suffix=".zip")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(file_obj.getbuffer())
+            return gpd.read_file(f"zip://{tmp}", **kw)
+        finally:
+            os.remove(tmp)
     else:
-        return gpd.read_file(file_obj)
+        return gpd.read_file(file_obj, **kw)
+
+
+def overlay_key(src) -> str:
+    """Cache key of an overlay source: upload digest (hashed once per upload
+    object, see buffer_digest), or path + size + mtime."""
+    if isinstance(src, (str, os.PathLike)):
+        st = os.stat(src)
+        return f"{os.path.abspath(src)}:{st.st_size}:{st.st_mtime_ns}"
+    return f"{getattr(src, 'name', '')}:{buffer_digest(src)}"
+
+
+def _cached(key):
+    with _overlays_lock:
+        hit = _overlays.get(key)
+        if hit is not None:
+            _overlays.move_to_end(key)
+            return hit[0]
+    return None
+
+
+def _store(key, gdf, nbytes=None):
+    global _overlays_bytes
+    if nbytes is None:
+        nbytes = 16 * int(shapely.get_num_coordinates(gdf.geometry.to_numpy()).sum())
+    with _overlays_lock:
+        if key not in _overlays:
+            _overlays[key] = (gdf, nbytes)
+            _overlays_bytes += nbytes
+        while len(_overlays) > 1 and (len(_overlays) > MAX_OVERLAYS or _overlays_bytes > MAX_OVERLAY_BYTES):
+            _, (_, dropped) = _overlays.popitem(last=False)
+            _overlays_bytes -= dropped
+        return _overlays[key][0]
+
+
+def _is_world(rext):
+    return rext == (-180.0, 180.0, -90.0, 90.0)
+
+
+def load_overlay(src, bbox=None):
+    """Overlay as a shared EPSG:4326 GeoDataFrame, parsed and reprojected once.
+
+    bbox: (min_lon, max_lon, min_lat, max_lat) — keep only features that
+    intersect it (rounded outward); None for the whole overlay.
+    """
+    return _load(src, overlay_key(src), bbox)
+
+
+def _load(src, key, bbox):
+    rext = None if bbox is None else round_extent(bbox)
+    if rext is not None and _is_world(rext):
+        rext = None
+    ckey = key if rext is None else f"{key}|{rext}"
+    gdf = _cached(ckey)
+    if gdf is not None:
+        return gdf
+
+    full = _cached(key) if rext is not None else None
+    if full is not None:
+        x0, x1, y0, y1 = rext
+        idx = np.sort(full.sindex.query(shapely.box(x0, y0, x1, y1), predicate="intersects"))
+        gdf = full.iloc[idx]
+    else:
+        if hasattr(src, "seek"):
+            src.seek(0)
+        mask = None
+        if rext is not None:
+            x0, x1, y0, y1 = rext
+            mask = gpd.GeoSeries([shapely.box(x0, y0, x1, y1)], crs="EPSG:4326")
+        gdf = overlay_gdf(src, bbox=mask, geometry_only=True).to_crs("EPSG:4326")
+    return _store(ckey, gdf)
+
+
+def overlay_view(src, extent, tolerance=0.0):
+    """Overlay geometries (EPSG:4326 GeoSeries) intersecting extent, clipped to
+    it (rounded outward) and simplified with tolerance in degrees; cached."""
+    rext = round_extent(extent)
+    key = overlay_key(src)
+    vkey = f"{key}|view|{rext}|{tolerance!r}"
+    view = _cached(vkey)
+    if view is not None:
+        return view
+
+    geoms = _load(src, key, extent).geometry.to_numpy()
+    if len(geoms) and not _is_world(rext):
+        x0, x1, y0, y1 = rext
+        geoms = shapely.clip_by_rect(geoms, x0, y0, x1, y1)
+    if len(geoms) and tolerance > 0:
+        geoms = shapely.simplify(geoms, tolerance, preserve_topology=False)
+    geoms = geoms[~(shapely.is_missing(geoms) | shapely.is_empty(geoms))] if len(geoms) else geoms
+    return _store(vkey, gpd.GeoSeries(geoms, crs="EPSG:4326"))
+
+
+def overlay_path(src, extent, tolerance=0.0):
+    """(compound Path | None, point xy array) of overlay_view(...); cached."""
+    vkey = f"{overlay_key(src)}|path|{round_extent(extent)}|{tolerance!r}"
+    hit = _cached(vkey)
+    if hit is not None:
+        return hit
+    geoms = overlay_view(src, extent, tolerance).to_numpy()
+    path = geometry_path(geoms) if len(geoms) else None
+    parts = shapely.get_parts(geoms)
+    points = shapely.get_coordinates(parts[shapely.get_type_id(parts) == 0])
+    nbytes = 16 * (len(points) + (len(path.vertices) if path is not None else 0))
+    return _store(vkey, (path, points), nbytes)
+
+
+def draw_overlay(ax, src, extent, tolerance=0.0, edgecolor="#0000ff", lw=1.0, zorder=2, transform=None):
+    """Draw an overlay's visible part with one PathCollection (lines and polygon
+    outlines) and one scatter for points; returns the artists."""
+    path, points = overlay_path(src, extent, tolerance)
+    transform = ax.transData if transform is None else transform
+    artists = []
+    if path is not None:
+        coll = PathCollection([path], facecolor="none", edgecolor=edgecolor, linewidths=lw,
+                              zorder=zorder, transform=transform)
+        ax.add_collection(coll, autolim=False)
+        artists.append(coll)
+    if len(points):
+        artists.append(ax.scatter(points[:, 0], points[:, 1], facecolors="none", edgecolors=edgecolor,
+                                  linewidths=lw, zorder=zorder, transform=transform))
+    return artists
@@ -0,0 +1,257 @@
+# utils/render_cache.py — content-addressed cache for rendered maps
+"""Two-tier (memory LRU + on-disk) cache of encoded map images.
+
+Usage in app.py / batch_render.py:
+
+from utils.render_cache import digest_bytes, render_key, get_render_cache
+
+key = render_key(digest_bytes(raw_upload), coord_fmt, config)
+img = get_render_cache().get(key)
+if img is None:
+    img = render_map(df, config)
+    get_render_cache().put(key, img)
+
+Keys are hashes of the uploaded bytes, the coordinate format and the full
+style config, so an identical request is served without touching pandas,
+Cartopy or Matplotlib. The disk tier lives in $CARTOZEN_CACHE_DIR
+(default ~/.cache/cartozen/renders) and is shared by all processes.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+# bump when rendering output changes so stale disk entries are never served
+#   2: overlays/insets drawn as PathCollections, off-extent labels culled,
+#      batched label halos, density / heatmap / symbology defaults
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cartozen")
+
+
+def _nbytes(data) -> int:
+    return int(getattr(data, "nbytes", None) or len(data))
+
+
+def digest_bytes(data) -> str:
+    """Stable hex digest of raw bytes (or a bytes-like buffer)."""
+    return hashlib.blake2b(bytes(data), digest_size=20).hexdigest()
+
+
+_buffer_digests = weakref.WeakKeyDictionary()      # upload buffer → (size, digest)
+_buffer_digests_lock = threading.Lock()
+
+
+def buffer_digest(buf) -> str:
+    """digest_bytes(buf.getvalue()), computed once per buffer object and size.
+
+    An uploaded overlay is hashed by config_digest for every layer key and
+    by the overlay cache for every axes it is drawn on; this keeps it to one
+    pass over the bytes for as long as the upload object lives.
+    """
+    try:
+        with buf.getbuffer() as view:
+            size = view.nbytes
+        with _buffer_digests_lock:
+            hit = _buffer_digests.get(buf)
+    except (AttributeError, TypeError):     # no getbuffer() or not weak-referenceable
+        return digest_bytes(buf.getvalue())
+    if hit is not None and hit[0] == size:
+        return hit[1]
+    digest = digest_bytes(buf.getvalue())
+    with _buffer_digests_lock:
+        _buffer_digests[buf] = (size, digest)
+    return digest
+
+
+def _file_digest(path) -> str:
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def _canonical(value):
+    """JSON fallback for config values that are not plain data."""
+    if isinstance(value, os.PathLike):
+        value = os.fspath(value)
+    if hasattr(value, "getvalue"):          # uploaded file / BytesIO
+        return {"bytes": buffer_digest(value)}
+    if hasattr(value, "item"):              # numpy scalars
+        return value.item()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return repr(value)
+
+
+def config_digest(config: dict) -> str:
+    """Digest of a style config; file paths hash by path + size + mtime."""
+    canon = {}
+    for k, v in config.items():
+        if isinstance(v, (str, os.PathLike)) and k in ("overlay", "ne_countries_path"):
+            v = _file_digest(v) if os.path.exists(v) else os.fspath(v)
+        canon[k] = v
+    blob = json.dumps(canon, sort_keys=True, default=_canonical, ensure_ascii=False)
+    return digest_bytes(blob.encode("utf-8"))
+
+
+def render_key(data_digest: str, coord_fmt: str, config: dict, namespace: str = "map") -> str:
+    """Cache key for one rendered image."""
+    blob = f"{namespace}|v{CACHE_VERSION}|{data_digest}|{coord_fmt}|{config_digest(config)}"
+    return digest_bytes(blob.encode("utf-8"))
+
+
+class RenderCache:
+    """Memory LRU in front of a size-bounded directory of blobs.
+
+    - memory tier: bounded by entry count and total bytes, LRU eviction;
+      also holds NumPy arrays (e.g. raster layers), which never go to disk
+    - disk tier: one file per key, oldest-used files removed once the
+      directory exceeds max_disk_bytes (mtime is bumped on every hit)
+    Thread-safe; the disk tier is safe to share between processes.
+    """
+
+    def __init__(self, disk_dir=None, max_items=64, max_mem_bytes=256 << 20, max_disk_bytes=1 << 30):
+        self.disk_dir = disk_dir
+        self.max_items = int(max_items)
+        self.max_mem_bytes = int(max_mem_bytes)
+        self.max_disk_bytes = int(max_disk_bytes)
+        self._mem: OrderedDict[str, bytes] = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+            except OSError:     # read-only home etc. → memory tier only
+                self.disk_dir = None
+
+    # ── memory tier ──
+    def _mem_put(self, key, data):
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= _nbytes(old)
+        if _nbytes(data) > self.max_mem_bytes:
+            return
+        self._mem[key] = data
+        self._mem_bytes += _nbytes(data)
+        while self._mem and (len(self._mem) > self.max_items or self._mem_bytes > self.max_mem_bytes):
+            _, dropped = self._mem.popitem(last=False)
+            self._mem_bytes -= _nbytes(dropped)
+
+    # ── disk tier ──
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _disk_put(self, key, data):
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            return
+        self._disk_evict()
+
+    def _disk_evict(self):
+        entries, total = [], 0
+        try:
+            with os.scandir(self.disk_dir) as it:
+                for e in it:
+                    if e.name.endswith(".bin"):
+                        st = e.stat()
+                        entries.append((st.st_mtime, st.st_size, e.path))
+                        total += st.st_size
+        except OSError:
+            return
+        if total <= self.max_disk_bytes:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    # ── public API ──
+    def get(self, key):
+        """Return cached bytes or None."""
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+                return data
+        if not self.disk_dir:
+            return None
+        data = self._disk_get(key)
+        if data is not None:
+            with self._lock:
+                self._mem_put(key, data)
+        return data
+
+    def put(self, key, data):
+        to_disk = isinstance(data, (bytes, bytearray, memoryview))
+        if to_disk:
+            data = bytes(data)
+        with self._lock:
+            self._mem_put(key, data)
+        if self.disk_dir and to_disk:
+            self._disk_put(key, data)
+
+    def disk_path(self, key):
+        """Path of the on-disk entry for key (for memory-mapped reads), or None."""
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def get_or_render(self, key, render):
+        """Return cached bytes for key, calling render() and storing on a miss."""
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear(); self._mem_bytes = 0
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".bin"):
+                    try: os.remove(os.path.join(self.disk_dir, name))
+                    except OSError: pass
+
+
+_caches: dict[str, RenderCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_render_cache(subdir: str = "renders", **kwargs) -> RenderCache:
+    """Process-wide cache instance per subdir (disk tier under $CARTOZEN_CACHE_DIR).
+    kwargs are passed to RenderCache on first use only.
+    """
+    with _caches_lock:
+        cache = _caches.get(subdir)
+        if cache is None:
+            root = os.environ.get("CARTOZEN_CACHE_DIR", DEFAULT_CACHE_DIR)
+            cache = _caches[subdir] = RenderCache(disk_dir=os.path.join(root, subdir), **kwargs)
+        return cache
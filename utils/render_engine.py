@@ -0,0 +1,940 @@
+# utils/render_engine.py — headless CartoZen renderer
+"""Build and export a CartoZen station map without a Streamlit session.
+
+Usage (app.py, batch_render.py, notebooks):
+
+from utils.render_engine import prepare_stations, read_station_table, render_map
+
+df = prepare_stations(read_station_table("stations.csv"), "DMS")
+png = render_map(df, {"marker_color": "#ff0000", "dpi": 150})
+
+`config` is a flat dict; any key missing falls back to DEFAULT_CONFIG, which
+mirrors the defaults of the sidebar widgets in app.py.
+"""
+from __future__ import annotations
+
+import io
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import cartopy.crs as ccrs
+import matplotlib.patheffects as pe
+from matplotlib.lines import Line2D
+from matplotlib import ticker as mticker
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+from utils.coord_utils_v2 import convert_coords, get_buffered_extent
+from utils.overlay_loader import draw_overlay
+from utils.plot_helpers import dd_fmt_lon, dd_fmt_lat, dms_fmt_lon, dms_fmt_lat, draw_scale_bar
+from utils.config import shape_map, get_page_size
+from utils.basemap import add_basemap_feature, simplify_tolerance
+from utils.inset_overview import draw_inset_overview
+from utils.cluster_utils import get_cluster_hierarchy, greedy_cluster
+from utils.density import density_active, draw_density, draw_heatmap
+from utils.label_batch import LabelCollection, needs_text_artist
+from utils.label_declutter import declutter_texts, place_labels, uses_adjusttext
+from utils.local_inset_clusters import draw_cluster_insets
+from utils.render_cache import RenderCache, config_digest, digest_bytes
+from utils.symbology import NO_DATA_COLOR, class_colors, class_sizes, classify
+
+NE_COUNTRIES_ZIP = "assets/ne_10m_admin_0_countries.zip"
+WATERMARK = "CartoZen v1.1.0"
+
+# cluster distance slider range (km); the hierarchy precomputes every step
+CLUSTER_KM_RANGE = (1, 50)
+
+LAT_CANDIDATES = ["lat", "latitude", "lat_dd", "y", "ycoord", "y_coord"]
+LON_CANDIDATES = ["lon", "long", "longitude", "lon_dd", "x", "xcoord", "x_coord"]
+UTM_CANDIDATES = (
+    ["e", "easting", "east", "utm_e", "utm_easting", "x"],
+    ["n", "northing", "north", "utm_n", "utm_northing", "y"],
+    ["z", "zone", "utm_zone", "zone_number"],
+    ["zl", "hemisphere", "hemi", "zone_letter", "band", "h"],
+)
+
+DEFAULT_CONFIG = {
+    # extent
+    "auto_extent": True,
+    "margin_pct": 10,
+    "buffer_deg": 5,
+    # overlay (uploaded file object or path)
+    "overlay": None,
+    "show_overlay": True,
+    "overlay_color": "#0000ff",
+    # overlay simplification tolerance in output pixels (0 = off); the inset has its own
+    "overlay_simplify_px": 0.5,
+    "inset_overlay_simplify_px": 1.0,
+    # map colours
+    "land_color": "#f0e8d8",
+    "ocean_color": "#cce6ff",
+    # basemap detail: "auto" (from degrees per output pixel) | "10m" | "50m" | "110m"
+    "basemap_scale": "auto",
+    "basemap_simplify": False,
+    # markers & labels
+    "markers_on": True,
+    "marker_shape": "Circle",
+    "marker_color": "#00cc44",
+    "marker_size": 10,
+    "marker_edge_on": True,
+    "marker_edge_color": "#000000",
+    "marker_edge_width": 0.8,
+    "marker_halo_on": False,
+    "marker_halo_color": "#FFFFFF",
+    "marker_halo_width": 2.0,
+    # attribute symbology: single (marker_color / marker_size) | graduated | categorical
+    "symbology": "single",
+    "symbology_col": None,          # None → attribute_col
+    "class_method": "quantile",     # graduated breaks: quantile | jenks | equal
+    "class_count": 5,
+    "class_cmap": "viridis",        # graduated colour ramp
+    "category_cmap": "tab10",       # categorical palette
+    "max_categories": 10,           # less frequent values are drawn as "Other"
+    "class_sizes": False,           # graduated: marker size grows with the class
+    "class_size_min": 5,
+    "class_size_max": 16,
+    # point rendering: markers | density (hex / square cell counts) | auto (density above the threshold)
+    "point_mode": "auto",
+    "density_threshold": 100_000,
+    "density_shape": "hex",         # hex | square
+    "density_cell_px": 12,          # cell size in pixels at 100 dpi, scaled with the output DPI
+    "density_cmap": "viridis",
+    "density_log": True,            # logarithmic colour ramp
+    "density_legend_pos": "center right",   # colour bar position (None → no colour bar)
+    # KDE heatmap layer (behind labels and markers)
+    "heatmap_on": False,
+    "heatmap_bandwidth_km": 10.0,
+    "heatmap_grid_px": 1,           # grid cell in output pixels
+    "heatmap_cmap": "YlOrRd",
+    "heatmap_alpha": 0.7,
+    "heatmap_legend_pos": "center left",    # colour bar position (None → no colour bar)
+    "show_labels": True,
+    "label_dx": 0.01,
+    "label_dy": 0.05,
+    # grid & axis
+    "grid_on": False,
+    "grid_interval": 1.0,
+    "grid_color": "#666666",
+    "grid_style": "solid",
+    "grid_width": 1.0,
+    "axis_format": "Decimal",
+    # legend / label columns (None → first column of the table)
+    "station_col": None,
+    "attribute_col": None,
+    "label_col": None,
+    "legend_header": None,          # list of header lines; None → "<station> – <attribute>"
+    # elements
+    "legend_on": False,
+    "legend_pos": "upper left",
+    "scalebar_on": False,
+    "scalebar_length": 50,
+    "scalebar_segments": 3,
+    "scalebar_thickness": 3,
+    "scalebar_pos": "Bottom-Left",
+    "scalebar_unit": "km",
+    "north_on": True,
+    "north_pos": "Top-Right",
+    "north_color": "#000000",
+    "north_arrow_halo_on": True,
+    "north_arrow_halo_color": "#FFFFFF",
+    "north_arrow_halo_width": 2.5,
+    # inset overview
+    "inset_on": False,
+    "inset_pos": "top right",
+    "inset_size_pct": 20,
+    "inset_extent_mode": "global",
+    "inset_extent_pad": 3.0,
+    "inset_rect_color": "#ff0000",
+    "inset_overlay": True,
+    "inset_overlay_color": "#0000ff",
+    "inset_frame": True,
+    "inset_frame_lw": 0.8,
+    "ne_countries_path": NE_COUNTRIES_ZIP,
+    # declutter & cluster
+    "declutter_on": False,
+    "declutter_mode": "repel",       # repel (adjustText / fallback) | place (candidate positions)
+    "label_drop": "hide",            # place mode: labels that do not fit → hide | count ("+k")
+    "declutter_budget_s": 5.0,       # wall-clock limit for repel iterations (None = iteration limit only)
+    "cluster_on": False,
+    "cluster_km": 12,
+    "cluster_hierarchy": False,     # interactive use: resolve thresholds from a per-dataset hierarchy
+    "show_cluster_counts": True,
+    "local_insets": False,
+    "max_insets": 2,
+    "cluster_anchor": "top right",
+    "connector_color": "#444444",
+    "connector_lw": 0.8,
+    "inset_label_color": "#6a5acd",
+    "inset_label_halo": True,
+    "inset_label_halo_width": 2.5,
+    "inset_label_align": "left",
+    "inset_label_dx": 6,
+    "inset_label_dy": 4,
+    "cluster_inset_size_pct": 18,
+    "cluster_marker_size": 16,
+    "cluster_label_size": 6,
+    "cluster_frame_lw": 0.6,
+    "cluster_offset_frac": 0.012,
+    # custom text
+    "custom_on": False,
+    "custom_text": "",
+    "custom_x": 0.5,
+    "custom_y": 0.95,
+    "custom_fontsize": 16,
+    "custom_color": "#000000",
+    "custom_bold": False,
+    "custom_italic": False,
+    "custom_rotation": 0,
+    "custom_ha": "center",
+    "custom_va": "top",
+    "custom_box": False,
+    "custom_box_fc": "#FFFFFF",
+    "custom_box_ec": "#000000",
+    "custom_box_alpha": 0.8,
+    "custom_halo": False,
+    "custom_halo_width": 0.0,
+    "custom_halo_color": "#FFFFFF",
+    # font sizes
+    "axis_fontsize": 8,
+    "label_fontsize": 8,
+    "legend_fontsize": 8,
+    "scalebar_fontsize": 8,
+    "north_fontsize": 18,
+    # export
+    "format": "PNG",
+    "dpi": 300,
+    "page_size": "A4",
+    "orientation": "Landscape",
+}
+
+
+class RenderWarning(UserWarning):
+    """Non-fatal rendering problem (e.g. an overlay that could not be drawn)."""
+
+
+# ── data preparation ────────────────────────────────────────────────────────
+
+def _find_col(cols, candidates):
+    lower = {c.lower(): c for c in cols}
+    for cand in candidates:
+        if cand in lower:
+            return lower[cand]
+    return None
+
+
+def read_station_table(src, name=None, usecols=None, nrows=None):
+    """Read a CSV/XLSX station table from a path or an uploaded file object."""
+    name = str(name or getattr(src, "name", None) or src).lower()
+    if name.endswith(".csv"):
+        return pd.read_csv(src, usecols=usecols, nrows=nrows)
+    return pd.read_excel(src, usecols=usecols, nrows=nrows)
+
+
+def detect_utm_columns(cols) -> list:
+    """[easting, northing, zone, hemisphere] column names; positional where not found."""
+    cols = list(cols)
+    return [_find_col(cols, cands) or (cols[i] if i < len(cols) else None)
+            for i, cands in enumerate(UTM_CANDIDATES)]
+
+
+def coord_spec(coord_fmt: str, utm_cols=None) -> str:
+    """Coordinate format + UTM column choice as one string (for cache keys)."""
+    return f"UTM:{'|'.join(map(str, utm_cols))}" if coord_fmt == "UTM" and utm_cols else coord_fmt
+
+
+def coord_columns(columns, coord_fmt: str):
+    """(lat_col, lon_col) detected in a table header; raises ValueError unless UTM."""
+    lat_col = _find_col(columns, LAT_CANDIDATES)
+    lon_col = _find_col(columns, LON_CANDIDATES)
+    if coord_fmt != "UTM" and (not lat_col or not lon_col):
+        raise ValueError("Couldn’t detect latitude/longitude columns.")
+    return lat_col, lon_col
+
+
+def check_stations(df: pd.DataFrame) -> pd.DataFrame:
+    """Raise ValueError with a user-facing message unless convert_coords succeeded."""
+    if df is None or "Lat_DD" not in df.columns or "Lon_DD" not in df.columns:
+        raise ValueError("Converted coordinate columns not found.")
+    if df["Lat_DD"].isnull().all() or df["Lon_DD"].isnull().all():
+        raise ValueError("Coordinate conversion failed. Make sure you've selected the proper coordinate format as per your data")
+    return df
+
+
+def prepare_stations(df0: pd.DataFrame, coord_fmt: str, utm_cols=None) -> pd.DataFrame:
+    """Detect lat/lon columns and convert them to Lat_DD/Lon_DD.
+
+    For UTM, utm_cols = (easting, northing, zone, hemisphere) column names
+    (hemisphere may be None); without it the first four columns are used.
+    Raises ValueError with a user-facing message when the table is unusable.
+    """
+    lat_col, lon_col = coord_columns(df0.columns, coord_fmt)
+    return check_stations(convert_coords(df0, coord_fmt, lat_col, lon_col, utm_cols=utm_cols))
+
+
+def resolve_config(df: pd.DataFrame, config: dict | None) -> dict:
+    """Merge config over DEFAULT_CONFIG and fill in table-dependent defaults."""
+    cfg = {**DEFAULT_CONFIG, **(config or {})}
+    first = df.columns[0] if len(df.columns) else None
+    for key in ("station_col", "attribute_col", "label_col"):
+        if not cfg[key]:
+            cfg[key] = first
+    if not cfg["symbology_col"]:
+        cfg["symbology_col"] = cfg["attribute_col"]
+    if cfg["legend_header"] is None:
+        cfg["legend_header"] = [f"{cfg['station_col']} – {cfg['attribute_col']}"]
+    return cfg
+
+
+def _safe_extent(b):
+    lo, hi, la, lb = map(float, b)
+    lo = max(-179.999, min(179.999, lo))
+    hi = max(-179.999, min(179.999, hi))
+    la = max(-89.9,   min(89.9,   la))
+    lb = max(-89.9,   min(89.9,   lb))
+    if hi <= lo: hi = lo + 0.01
+    if lb <= la: lb = la + 0.01
+    return (lo, hi, la, lb)
+
+
+def compute_bounds(df: pd.DataFrame, cfg: dict):
+    """Return the safe (min_lon, max_lon, min_lat, max_lat) map extent."""
+    if cfg["auto_extent"]:
+        margin = cfg["margin_pct"]
+        lo, hi = df["Lon_DD"].agg(["min","max"]) ; la, lb = df["Lat_DD"].agg(["min","max"])
+        if hi == lo: hi, lo = hi + 0.01, lo - 0.01
+        if lb == la: lb, la = lb + 0.01, la - 0.01
+        bounds = (
+            lo - (hi - lo) * margin / 100.0,
+            hi + (hi - lo) * margin / 100.0,
+            la - (lb - la) * margin / 100.0,
+            lb + (lb - la) * margin / 100.0,
+        )
+    else:
+        bounds = get_buffered_extent(df, cfg["buffer_deg"])
+    return _safe_extent(bounds)
+
+
+# ── drawing steps ───────────────────────────────────────────────────────────
+
+def _draw_basemap(ax, cfg):
+    scale, simp = cfg["basemap_scale"], cfg["basemap_simplify"]
+    add_basemap_feature(ax, "land", scale, fc=cfg["land_color"], simplify=simp)
+    add_basemap_feature(ax, "ocean", scale, fc=cfg["ocean_color"], simplify=simp)
+    add_basemap_feature(ax, "borders", scale, ls=":", simplify=simp)
+    add_basemap_feature(ax, "coastline", scale, simplify=simp)
+
+
+def _draw_grid(ax, bounds, cfg):
+    g_int, g_col, g_wid = cfg["grid_interval"], cfg["grid_color"], cfg["grid_width"]
+    dms = cfg["axis_format"] == "DMS"
+    tol = 1e-9
+    xt = np.arange(bounds[0], bounds[1] + g_int, g_int)
+    yt = np.arange(bounds[2], bounds[3] + g_int, g_int)
+    # keep only interior ticks (remove edges)
+    xt_in = xt[(xt > bounds[0] + tol) & (xt < bounds[1] - tol)]
+    yt_in = yt[(yt > bounds[2] + tol) & (yt < bounds[3] - tol)]
+    if cfg["grid_on"]:
+        gl = ax.gridlines(draw_labels=True, xlocs=xt, ylocs=yt, color=g_col, ls=cfg["grid_style"], lw=g_wid)
+        gl.top_labels = gl.right_labels = True
+        gl.xlabel_style = gl.ylabel_style = {"size": cfg["axis_fontsize"]}
+        gl.xformatter = mticker.FuncFormatter(dms_fmt_lon if dms else dd_fmt_lon)
+        gl.yformatter = mticker.FuncFormatter(dms_fmt_lat if dms else dd_fmt_lat)
+    else:
+        ax.set_xticks(xt_in, crs=ccrs.PlateCarree()); ax.set_yticks(yt_in, crs=ccrs.PlateCarree())
+        ax.xaxis.set_major_formatter(mticker.FuncFormatter(dms_fmt_lon if dms else dd_fmt_lon))
+        ax.yaxis.set_major_formatter(mticker.FuncFormatter(dms_fmt_lat if dms else dd_fmt_lat))
+        ax.tick_params(
+            axis="both", direction="out", length=4, width=g_wid, color=g_col,
+            labelsize=cfg["axis_fontsize"],
+        )
+
+
+def _draw_overlay(ax, cfg):
+    if cfg["overlay"] is None or not cfg["show_overlay"]:
+        return
+    try:
+        extent = ax.get_extent(ccrs.PlateCarree())
+        tol = simplify_tolerance(extent, ax.bbox.width, ax.bbox.height, px=cfg["overlay_simplify_px"])
+        draw_overlay(ax, cfg["overlay"], extent, tol, edgecolor=cfg["overlay_color"], lw=1)
+    except Exception as e:
+        warnings.warn(f"Overlay could not be rendered: {e}", RenderWarning)
+
+
+def _symbol_classes(df, cfg):
+    """Attribute classes of every station: dict(codes, labels, colors, sizes), or None.
+
+    colors / sizes have one extra trailing entry for code -1 (no data).
+    """
+    mode = cfg["symbology"]
+    if mode == "single":
+        return None
+    col = cfg["symbology_col"]
+    if col not in df.columns:
+        warnings.warn(f"Symbology column {col!r} not found; drawing single-colour markers", RenderWarning)
+        return None
+    try:
+        codes, labels = classify(df[col], mode, cfg["class_method"], int(cfg["class_count"]), int(cfg["max_categories"]))
+    except ValueError as e:
+        warnings.warn(f"{e}; using categorical classes", RenderWarning)
+        mode = "categorical"
+        codes, labels = classify(df[col], mode, max_categories=int(cfg["max_categories"]))
+    n = len(labels)
+    if mode == "graduated":
+        colors = class_colors(cfg["class_cmap"], n)
+    else:
+        colors = class_colors(cfg["category_cmap"], n, categorical=True)
+    if mode == "graduated" and cfg["class_sizes"]:
+        sizes = class_sizes(n, cfg["class_size_min"], cfg["class_size_max"])
+    else:
+        sizes = [cfg["marker_size"]] * n
+    return dict(codes=codes, labels=labels, colors=colors + [NO_DATA_COLOR], sizes=sizes + [cfg["marker_size"]])
+
+
+def _cluster_reps(plot_df, clusters):
+    """Row position in df of each plotted cluster's first member (-1 if unknown)."""
+    n = len(plot_df)
+    cid = plot_df["cluster_id"].to_numpy() if "cluster_id" in plot_df else np.full(n, -1)
+    return np.array([(clusters.get(int(c)) or [-1])[0] for c in cid], dtype=np.int64)
+
+
+def _draw_markers(ax, df, plot_df, clusters, cfg):
+    marker = shape_map[cfg["marker_shape"]]
+    lon, lat = plot_df["Lon_DD"].to_numpy(), plot_df["Lat_DD"].to_numpy()
+    classes = _symbol_classes(df, cfg) if len(plot_df) else None
+    if classes is None:
+        groups = [(np.arange(len(plot_df)), cfg["marker_color"], cfg["marker_size"] ** 2)]
+    else:
+        codes = classes["codes"]
+        if clusters is not None:        # a cluster takes the class of its first member, like its label
+            rep = _cluster_reps(plot_df, clusters)
+            codes = np.where(rep >= 0, codes[np.maximum(rep, 0)], -1)
+        # one collection per class, no-data first (underneath)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(-1, len(classes["labels"]) + 1))
+        groups = [(order[a:b], classes["colors"][c], classes["sizes"][c] ** 2)
+                  for c, a, b in zip(range(-1, len(classes["labels"])), bounds[:-1], bounds[1:]) if b > a]
+
+    # Optional halo stroke (draw first, underneath)
+    if cfg["marker_halo_on"] and cfg["marker_halo_width"] > 0:
+        for idx, color, size in groups:
+            ax.scatter(
+                lon[idx], lat[idx],
+                s=size, c=color, marker=marker,
+                edgecolors=cfg["marker_halo_color"], linewidths=cfg["marker_halo_width"],
+                transform=ccrs.PlateCarree(), zorder=4
+            )
+
+    # Main markers (+ optional border)
+    edge_on = cfg["marker_edge_on"] and cfg["marker_edge_width"] > 0
+    for idx, color, size in groups:
+        ax.scatter(
+            lon[idx], lat[idx],
+            s=size, c=color, marker=marker,
+            edgecolors=cfg["marker_edge_color"] if edge_on else "none",
+            linewidths=cfg["marker_edge_width"] if edge_on else 0.0,
+            transform=ccrs.PlateCarree(), zorder=5
+        )
+
+
+def _use_density(df, cfg):
+    return density_active(len(df), cfg["point_mode"], cfg["density_threshold"])
+
+
+def _draw_density(ax, df, cfg):
+    draw_density(ax, df["Lon_DD"].to_numpy(), df["Lat_DD"].to_numpy(), cell_px=cfg["density_cell_px"],
+                 shape=cfg["density_shape"], cmap=cfg["density_cmap"], log=cfg["density_log"],
+                 legend_pos=cfg["density_legend_pos"], fontsize=cfg["legend_fontsize"])
+
+
+def _draw_heatmap(ax, df, cfg):
+    draw_heatmap(ax, df["Lon_DD"].to_numpy(), df["Lat_DD"].to_numpy(), bandwidth_km=cfg["heatmap_bandwidth_km"],
+                 grid_px=cfg["heatmap_grid_px"], cmap=cfg["heatmap_cmap"], alpha=cfg["heatmap_alpha"],
+                 legend_pos=cfg["heatmap_legend_pos"], fontsize=cfg["legend_fontsize"])
+
+
+def _label_arrays(df, plot_df, clusters, cfg):
+    """(lon, lat, label strings) of every plotted point, looked up in bulk.
+
+    Clusters: the count when size > 1 and counts are shown, else the label
+    of the cluster's first member.
+    """
+    lon = plot_df["Lon_DD"].to_numpy(dtype=float)
+    lat = plot_df["Lat_DD"].to_numpy(dtype=float)
+    lab = cfg["label_col"]
+    if clusters is None:
+        return lon, lat, plot_df[lab].astype(str).to_numpy()
+    n = len(plot_df)
+    size = plot_df["cluster_size"].to_numpy() if "cluster_size" in plot_df else np.ones(n, dtype=int)
+    labels = np.full(n, "", dtype=object)
+    if lab in df.columns:
+        rep_idx = _cluster_reps(plot_df, clusters)
+        has = rep_idx >= 0
+        labels[has] = df[lab].iloc[rep_idx[has]].astype(str).to_numpy()
+    if cfg["show_cluster_counts"]:
+        multi = size > 1
+        labels[multi] = size[multi].astype(int).astype(str)
+    return lon, lat, labels
+
+
+def _draw_labels(ax, df, plot_df, clusters, cfg, bounds=None, report=None):
+    """Counts for clusters; label-of-representative otherwise. Returns the Text list.
+
+    Labels of points outside bounds (lon0, lon1, lat0, lat1) are not created.
+    report: optional dict, filled with the declutter run report.
+    """
+    texts = []
+    if not cfg["show_labels"]:
+        return texts
+    halo = [pe.withStroke(linewidth=3, foreground="white")]
+    dx, dy, fs = cfg["label_dx"], cfg["label_dy"], cfg["label_fontsize"]
+    lon, lat, labels = _label_arrays(df, plot_df, clusters, cfg)
+    keep = np.isfinite(lon) & np.isfinite(lat)
+    if bounds is not None:
+        x0, x1, y0, y1 = bounds
+        keep &= (lon >= x0) & (lon <= x1) & (lat >= y0) & (lat <= y1)
+    lon, lat, labels = lon[keep], lat[keep], labels[keep]
+    trans = ax.transData          # PlateCarree axes: data coordinates are lon/lat
+    repel_adjusttext = cfg["declutter_on"] and cfg["declutter_mode"] != "place" and uses_adjusttext(len(labels))
+    if repel_adjusttext or any(needs_text_artist(s) for s in labels):
+        # adjustText moves real Text objects; multi-line / mathtext labels need Text layout
+        texts = [ax.text(x, y, s, fontsize=fs, transform=trans, path_effects=halo, clip_on=True)
+                 for x, y, s in zip((lon + dx).tolist(), (lat + dy).tolist(), labels.tolist())]
+    else:
+        # one batched artist: labels laid out once per unique string, halos then fills
+        coll = ax.add_artist(LabelCollection(lon + dx, lat + dy, labels, fontsize=fs, transform=trans,
+                                             halo_width=3, halo_color="white"))
+        texts = coll.labels()
+    if cfg["declutter_on"] and texts:
+        if cfg["declutter_mode"] == "place":
+            # stations are the anchors; label_dx/dy are replaced by the candidate offsets
+            points = np.c_[lon, lat]
+            marker_px = cfg["marker_size"] / 2.0 * ax.figure.dpi / 72.0
+            texts += place_labels(ax, texts, points, marker_px=marker_px, dropped=cfg["label_drop"], report=report)
+        else:
+            declutter_texts(ax, texts, time_budget=cfg["declutter_budget_s"], report=report)
+    return texts
+
+
+def _draw_local_insets(ax, df, clusters, cfg):
+    draw_cluster_insets(
+        ax, df, clusters,
+        max_insets=cfg["max_insets"], pad_deg=0.2, box_frac=float(cfg["cluster_inset_size_pct"])/100.0,
+        land_color=cfg["land_color"], ocean_color=cfg["ocean_color"],
+        basemap_scale=cfg["basemap_scale"], basemap_simplify=cfg["basemap_simplify"],
+        marker_color=cfg["marker_color"], marker_size=int(cfg["cluster_marker_size"]),
+        show_labels=True, label_col=cfg["label_col"], label_fontsize=int(cfg["cluster_label_size"]),
+        label_color=cfg["inset_label_color"], label_align=cfg["inset_label_align"],
+        label_halo=cfg["inset_label_halo"], label_halo_width=float(cfg["inset_label_halo_width"]),
+        label_offset_px=(cfg["inset_label_dx"], cfg["inset_label_dy"]),
+        anchor=cfg["cluster_anchor"], offset_frac=float(cfg["cluster_offset_frac"]),
+        frame_lw=float(cfg["cluster_frame_lw"]), link=True,
+        link_color=cfg["connector_color"], link_lw=float(cfg["connector_lw"]),
+    )
+
+
+def _draw_overview_inset(ax, bounds, cfg):
+    inset_ov = cfg["inset_overlay"]
+    draw_inset_overview(
+        ax_main=ax, bounds=bounds,
+        overlay_path=cfg["overlay"] if inset_ov else None, plot_overlay=inset_ov,
+        inset_pos=cfg["inset_pos"], inset_size_pct=cfg["inset_size_pct"],
+        aoi_edge_color=cfg["inset_rect_color"], overlay_edge_color=cfg["inset_overlay_color"],
+        overlay_simplify_px=cfg["inset_overlay_simplify_px"],
+        land_color=cfg["land_color"], ocean_color=cfg["ocean_color"],
+        basemap_scale=cfg["basemap_scale"], basemap_simplify=cfg["basemap_simplify"],
+        extent_mode=cfg["inset_extent_mode"], extent_pad_deg=cfg["inset_extent_pad"],
+        inset_frame=cfg["inset_frame"], inset_frame_lw=cfg["inset_frame_lw"],
+        ne_countries_path=cfg["ne_countries_path"],
+    )
+
+
+def _draw_class_legend(ax, df, cfg):
+    """Legend with one marker symbol per attribute class and its station count."""
+    classes = _symbol_classes(df, cfg)
+    if classes is None:
+        return False
+    n = len(classes["labels"])
+    counts = np.bincount(classes["codes"] + 1, minlength=n + 1)      # [no data, class 0, ...]
+    edge_on = cfg["marker_edge_on"] and cfg["marker_edge_width"] > 0
+    entries = [(c, lab) for c, lab in enumerate(classes["labels"])]
+    if counts[0]:
+        entries.append((-1, "No data"))
+    handles = [Line2D([], [], ls="", marker=shape_map[cfg["marker_shape"]], ms=classes["sizes"][c],
+                      mfc=classes["colors"][c], mec=cfg["marker_edge_color"] if edge_on else "none",
+                      mew=cfg["marker_edge_width"] if edge_on else 0.0) for c, _ in entries]
+    texts = [f"{lab} ({counts[c + 1]:,})" for c, lab in entries]
+    title = "\n".join(h for h in cfg["legend_header"] if h) or None
+    leg = ax.legend(handles, texts, loc=cfg["legend_pos"], fontsize=cfg["legend_fontsize"], title=title,
+                    title_fontproperties={"weight": "bold", "size": cfg["legend_fontsize"]},
+                    alignment="left", fancybox=True, framealpha=0.8, edgecolor="black", facecolor="white")
+    leg.set_clip_on(True); leg.set_clip_path(ax.patch)
+    return True
+
+
+def _draw_legend(ax, df, cfg):
+    # Attribute classes → symbol legend; otherwise one text row per station
+    if cfg["symbology"] != "single" and not _use_density(df, cfg) and _draw_class_legend(ax, df, cfg):
+        return
+    # Build rows + bold header text
+    stn, at, leg_pos = cfg["station_col"], cfg["attribute_col"], cfg["legend_pos"]
+    rows = df[[stn, at]].astype(str).agg(" – ".join, axis=1)
+    max_items = 50
+    rows = list(rows.head(max_items)) + ([f"... (+{len(df)-max_items} more)"] if len(df) > max_items else [])
+    header_lines = [h for h in cfg["legend_header"] if h]
+    if header_lines:
+        def _mt(s): return s.replace("{","\\{").replace("}","\\}")
+        bold_header = "\n".join([rf"$\bf{{{_mt(h)}}}$" for h in header_lines])
+        leg_text = "\n".join([bold_header] + rows)
+    else:
+        leg_text = "\n".join(rows)
+
+    box = dict(boxstyle="round", fc="white", ec="black", alpha=0.8)
+    pos_map = {
+        "upper left":  (0.01, 0.99),
+        "upper right": (0.99, 0.99),
+        "lower left":  (0.01, 0.01),
+        "lower right": (0.99, 0.01),
+        "center left": (0.01, 0.50),
+        "center right":(0.99, 0.50),
+    }
+    xp, yp = pos_map[leg_pos]
+    lt = ax.text(
+        xp, yp, leg_text, transform=ax.transAxes, fontsize=cfg["legend_fontsize"],
+        ha=("left" if "left" in leg_pos else "right"),
+        va=("top"  if "upper" in leg_pos else "bottom" if "lower" in leg_pos else "center"),
+        bbox=box
+    )
+    lt.set_clip_on(True); lt.set_clip_path(ax.patch)
+
+
+def _draw_scale_bar(ax, bounds, cfg):
+    sb_len, unit = cfg["scalebar_length"], cfg["scalebar_unit"]
+    km_len = sb_len if unit == "km" else sb_len * 1.60934
+    draw_scale_bar(ax, bounds, km_len, cfg["scalebar_segments"], cfg["scalebar_thickness"],
+                   cfg["scalebar_pos"], unit, cfg["scalebar_fontsize"])
+
+
+def _draw_north_arrow(ax, cfg):
+    col = cfg["north_color"]
+    pos = {"Top-Right": (0.95, 0.95), "Top-Left": (0.05, 0.95), "Bottom-Right": (0.95, 0.05), "Bottom-Left": (0.05, 0.05)}[cfg["north_pos"]]
+    na = ax.annotate("N", xy=pos, xytext=(pos[0], pos[1] - 0.1), xycoords="axes fraction", ha="center", va="center",
+                     fontsize=cfg["north_fontsize"], color=col, arrowprops=dict(facecolor=col, width=5, headwidth=15))
+    na.set_clip_on(True); na.set_clip_path(ax.patch)
+
+    # Halo around the arrow patch
+    patch = getattr(na, "arrow_patch", None)
+    if patch is not None and cfg["north_arrow_halo_on"] and cfg["north_arrow_halo_width"] > 0:
+        patch.set_path_effects([pe.withStroke(linewidth=cfg["north_arrow_halo_width"], foreground=cfg["north_arrow_halo_color"])])
+
+
+def _draw_custom_text(ax, cfg):
+    txt = cfg["custom_text"] or ""
+    if not txt.strip():
+        return
+    box = cfg["custom_box"]
+    style = dict(boxstyle="round", fc=cfg["custom_box_fc"], ec=cfg["custom_box_ec"], alpha=cfg["custom_box_alpha"]) if box else None
+    txt_obj = ax.text(
+        cfg["custom_x"], cfg["custom_y"], txt,
+        transform=ax.transAxes, ha=cfg["custom_ha"], va=cfg["custom_va"],
+        fontsize=cfg["custom_fontsize"], color=cfg["custom_color"], rotation=cfg["custom_rotation"],
+        fontweight=("bold" if cfg["custom_bold"] else "normal"),
+        style=("italic" if cfg["custom_italic"] else "normal"),
+        bbox=style
+    )
+    txt_obj.set_clip_on(True); txt_obj.set_clip_path(ax.patch)
+    if cfg["custom_halo"] and cfg["custom_halo_width"] > 0:
+        txt_obj.set_path_effects([pe.withStroke(linewidth=cfg["custom_halo_width"], foreground=cfg["custom_halo_color"])])
+
+
+def _draw_watermark(ax):
+    wm = ax.text(0.99, 0.01, WATERMARK, transform=ax.transAxes, ha="right", va="bottom", fontsize=11, color="gray", alpha=0.6)
+    wm.set_clip_on(True); wm.set_clip_path(ax.patch)
+
+
+# ── layers ──────────────────────────────────────────────────────────────────
+# The map is split into raster layers that are drawn on identical, transparent
+# canvases, cached independently and alpha-composited at export. Each layer is
+# keyed only by the settings (and data columns) it depends on, so e.g. a marker
+# colour change re-rasterizes the markers and reuses the cached basemap.
+
+_CANVAS_KEYS = ("page_size", "orientation", "dpi")
+
+# name → config keys that affect it (canvas + bounds are always included)
+LAYER_KEYS = {
+    "basemap": ("land_color", "ocean_color", "basemap_scale", "basemap_simplify", "grid_on", "grid_interval", "grid_color", "grid_style",
+                "grid_width", "axis_format", "axis_fontsize"),
+    "overlay": ("overlay", "show_overlay", "overlay_color", "overlay_simplify_px"),
+    "heatmap": ("heatmap_on", "heatmap_bandwidth_km", "heatmap_grid_px", "heatmap_cmap", "heatmap_alpha",
+                "heatmap_legend_pos", "legend_fontsize"),
+    "labels": ("show_labels", "label_col", "label_dx", "label_dy", "label_fontsize", "declutter_on",
+               "declutter_mode", "label_drop", "declutter_budget_s", "marker_size",
+               "cluster_on", "cluster_km", "show_cluster_counts",
+               "point_mode", "density_threshold"),
+    "markers": ("marker_shape", "marker_color", "marker_size", "marker_edge_on", "marker_edge_color",
+                "marker_edge_width", "marker_halo_on", "marker_halo_color", "marker_halo_width",
+                "cluster_on", "cluster_km", "point_mode", "density_threshold", "density_shape",
+                "density_cell_px", "density_cmap", "density_log", "density_legend_pos", "legend_fontsize",
+                "symbology", "symbology_col", "class_method", "class_count", "class_cmap", "category_cmap",
+                "max_categories", "class_sizes", "class_size_min", "class_size_max"),
+    "furniture": ("station_col", "attribute_col", "legend_header", "legend_on", "legend_pos", "legend_fontsize",
+                  "scalebar_on", "scalebar_length", "scalebar_segments", "scalebar_thickness", "scalebar_pos",
+                  "scalebar_unit", "scalebar_fontsize", "north_on", "north_pos", "north_color", "north_fontsize",
+                  "north_arrow_halo_on", "north_arrow_halo_color", "north_arrow_halo_width",
+                  "custom_on", "custom_text", "custom_x", "custom_y", "custom_fontsize", "custom_color",
+                  "custom_bold", "custom_italic", "custom_rotation", "custom_ha", "custom_va", "custom_box",
+                  "custom_box_fc", "custom_box_ec", "custom_box_alpha", "custom_halo", "custom_halo_width",
+                  "custom_halo_color", "symbology", "symbology_col", "class_method", "class_count", "class_cmap",
+                  "category_cmap", "max_categories", "class_sizes", "class_size_min", "class_size_max",
+                  "marker_shape", "marker_size", "marker_edge_on", "marker_edge_color", "marker_edge_width",
+                  "point_mode", "density_threshold"),
+    "insets": ("land_color", "ocean_color", "basemap_scale", "basemap_simplify", "marker_color", "label_col", "overlay",
+               "cluster_on", "cluster_km", "local_insets", "max_insets", "cluster_anchor", "connector_color",
+               "connector_lw", "inset_label_color", "inset_label_halo", "inset_label_halo_width",
+               "inset_label_align", "inset_label_dx", "inset_label_dy", "cluster_inset_size_pct",
+               "cluster_marker_size", "cluster_label_size", "cluster_frame_lw", "cluster_offset_frac",
+               "inset_on", "inset_pos", "inset_size_pct", "inset_extent_mode", "inset_extent_pad",
+               "inset_rect_color", "inset_overlay", "inset_overlay_color", "inset_overlay_simplify_px", "inset_frame", "inset_frame_lw",
+               "ne_countries_path"),
+}
+
+# bottom → top; labels sit under markers as in the single-figure zorder
+LAYER_ORDER = ("basemap", "overlay", "heatmap", "labels", "markers", "furniture", "insets")
+
+# raw RGBA layers, memory only (an A4 page at 300 dpi is ~35 MB per layer)
+_LAYER_CACHE = RenderCache(disk_dir=None, max_items=48, max_mem_bytes=1 << 30)
+
+# declutter run reports of cached label layers, by layer key
+_LAYER_REPORTS: OrderedDict = OrderedDict()
+_MAX_LAYER_REPORTS = 64
+
+
+def _layer_columns(name, cfg):
+    """Data columns a layer reads (None → independent of the station table)."""
+    if name in ("basemap", "overlay"):
+        return None
+    if name == "heatmap":
+        return ["Lat_DD", "Lon_DD"]
+    if name == "markers":
+        return ["Lat_DD", "Lon_DD"] + ([cfg["symbology_col"]] if cfg["symbology"] != "single" else [])
+    if name == "furniture":
+        return [cfg["station_col"], cfg["attribute_col"], cfg["symbology_col"]]
+    return ["Lat_DD", "Lon_DD", cfg["label_col"]]
+
+
+def _layer_enabled(name, cfg, df):
+    if name == "overlay":
+        return cfg["overlay"] is not None and cfg["show_overlay"]
+    if name == "labels":
+        # density cells replace the stations, so there is nothing to label
+        return cfg["show_labels"] and not _use_density(df, cfg)
+    if name == "heatmap":
+        return cfg["heatmap_on"]
+    if name == "markers":
+        return cfg["markers_on"]
+    if name == "insets":
+        return cfg["inset_on"] or (cfg["cluster_on"] and cfg["local_insets"])
+    return True
+
+
+def _frame_digest(df, cols):
+    cols = [c for c in dict.fromkeys(cols) if c in df.columns]
+    hashed = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+    return digest_bytes(hashed.tobytes() + repr(cols).encode("utf-8"))
+
+
+def layer_key(name, df, cfg, bounds):
+    """Cache key of one raster layer."""
+    sub = {k: cfg[k] for k in _CANVAS_KEYS + LAYER_KEYS[name]}
+    cols = _layer_columns(name, cfg)
+    data = _frame_digest(df, cols) if cols else "-"
+    blob = f"{name}|{tuple(round(b, 9) for b in bounds)}|{data}|{config_digest(sub)}"
+    return digest_bytes(blob.encode("utf-8"))
+
+
+def _new_canvas(cfg, bounds):
+    fig = Figure(figsize=get_page_size(cfg["page_size"], cfg["orientation"]), dpi=cfg["dpi"])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111, projection=ccrs.PlateCarree())
+    ax.set_extent(bounds, crs=ccrs.PlateCarree())
+    fig.subplots_adjust(left=0.05, right=0.95, top=0.95, bottom=0.05)
+    return fig, ax
+
+
+def _draw_layer(name, ax, df, cfg, bounds, clustered, report=None):
+    if name == "basemap":
+        _draw_basemap(ax, cfg)
+        _draw_grid(ax, bounds, cfg)
+    elif name == "overlay":
+        _draw_overlay(ax, cfg)
+    elif name == "heatmap":
+        _draw_heatmap(ax, df, cfg)
+    elif name == "markers":
+        if _use_density(df, cfg):
+            _draw_density(ax, df, cfg)      # every station, not cluster representatives
+        else:
+            plot_df, clusters = clustered()
+            _draw_markers(ax, df, plot_df, clusters, cfg)
+    elif name == "labels":
+        plot_df, clusters = clustered()
+        _draw_labels(ax, df, plot_df, clusters, cfg, bounds, report)
+    elif name == "furniture":
+        # Legend / Scale / North Arrow (clip to axes)
+        if cfg["legend_on"]:
+            _draw_legend(ax, df, cfg)
+        if cfg["scalebar_on"]:
+            _draw_scale_bar(ax, bounds, cfg)
+        if cfg["north_on"]:
+            _draw_north_arrow(ax, cfg)
+        if cfg["custom_on"]:
+            _draw_custom_text(ax, cfg)
+        _draw_watermark(ax)
+    elif name == "insets":
+        # Local mini-insets for biggest clusters, then the global overview (figure-level)
+        if cfg["cluster_on"] and cfg["local_insets"]:
+            _, clusters = clustered()
+            if clusters:
+                _draw_local_insets(ax, df, clusters, cfg)
+        if cfg["inset_on"]:
+            _draw_overview_inset(ax, bounds, cfg)
+
+
+def _clusterer(df, cfg):
+    """Memoized (plot_df, clusters) so clustering runs at most once per render."""
+    memo = []
+    def clustered():
+        if not memo:
+            km = float(cfg["cluster_km"])
+            if cfg["cluster_on"] and cfg["cluster_hierarchy"]:
+                lo, hi = CLUSTER_KM_RANGE
+                h = get_cluster_hierarchy(df, "Lat_DD", "Lon_DD", max_km=max(hi, km), warm=range(lo, hi + 1))
+                memo.append(h.resolve(km))
+            elif cfg["cluster_on"]:
+                memo.append(greedy_cluster(df, "Lat_DD", "Lon_DD", km))
+            else:
+                memo.append((df, None))
+        return memo[0]
+    return clustered
+
+
+def _rasterize_layer(name, df, cfg, bounds, clustered, report=None):
+    fig, ax = _new_canvas(cfg, bounds)
+    fig.patch.set_alpha(0.0)
+    if name != "basemap":
+        ax.set_axis_off()       # frame, ticks and background belong to the basemap
+    _draw_layer(name, ax, df, cfg, bounds, clustered, report)
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+
+def render_layers(df: pd.DataFrame, cfg: dict, bounds, report: dict | None = None):
+    """Return [(name, RGBA array)] bottom → top, drawing only uncached layers.
+
+    report: optional dict; gets "declutter" (see label_declutter) when
+    labels were decluttered, also when the label layer came from the cache.
+    """
+    clustered = _clusterer(df, cfg)
+    out = []
+    for name in LAYER_ORDER:
+        if not _layer_enabled(name, cfg, df):
+            continue
+        key = layer_key(name, df, cfg, bounds)
+        arr = _LAYER_CACHE.get(key)
+        if arr is None:
+            info = {}
+            arr = _rasterize_layer(name, df, cfg, bounds, clustered, info)
+            _LAYER_CACHE.put(key, arr)
+            if info:
+                _LAYER_REPORTS[key] = info
+                while len(_LAYER_REPORTS) > _MAX_LAYER_REPORTS:
+                    _LAYER_REPORTS.popitem(last=False)
+        if report is not None and key in _LAYER_REPORTS:
+            report["declutter"] = dict(_LAYER_REPORTS[key])
+        out.append((name, arr))
+    return out
+
+
+def composite_layers(layers, cfg: dict, tight: bool) -> bytes:
+    """Alpha-composite RGBA layers onto the white page and encode PNG/JPEG.
+
+    tight mimics savefig(bbox_inches="tight", pad_inches=0.3): crop to the
+    painted area plus the pad.
+    """
+    img = None
+    for _, arr in layers:
+        layer = Image.fromarray(arr, "RGBA")
+        img = layer if img is None else Image.alpha_composite(img, layer)
+    dpi = cfg["dpi"]
+    if tight:
+        bbox = img.getchannel("A").getbbox()
+        if bbox is not None:
+            pad = int(round(0.3 * dpi))
+            img = img.crop((bbox[0] - pad, bbox[1] - pad, bbox[2] + pad, bbox[3] + pad))
+    page = Image.new("RGBA", img.size, (255, 255, 255, 255))
+    page.alpha_composite(img)
+
+    fmt = cfg["format"].lower()
+    buf = io.BytesIO()
+    if fmt in ("jpeg", "jpg"):
+        page.convert("RGB").save(buf, format="JPEG", dpi=(dpi, dpi))
+    else:
+        page.save(buf, format="PNG", dpi=(dpi, dpi))
+    return buf.getvalue()
+
+
+def _has_insets(cfg):
+    return bool(cfg["inset_on"] or (cfg["cluster_on"] and cfg["local_insets"]))
+
+
+# ── main API ────────────────────────────────────────────────────────────────
+
+def build_map_figure(df: pd.DataFrame, config: dict | None = None, report: dict | None = None):
+    """Draw the full map on a single figure. Returns (fig, cfg).
+
+    Same drawing steps as render_map, without layer caching; handy for
+    notebooks or custom savefig calls. The figure is not attached to
+    pyplot, so it is safe in worker processes and threads.
+    """
+    cfg = resolve_config(df, config)
+    bounds = compute_bounds(df, cfg)
+    fig, ax = _new_canvas(cfg, bounds)
+    clustered = _clusterer(df, cfg)
+    info = {}
+    for name in LAYER_ORDER:
+        if _layer_enabled(name, cfg, df):
+            _draw_layer(name, ax, df, cfg, bounds, clustered, info)
+    if report is not None and info:
+        report["declutter"] = info
+    return fig, cfg
+
+
+def export_figure(fig, cfg: dict) -> bytes:
+    """Encode the figure as PNG/JPEG bytes (avoid tight bbox when any inset present)."""
+    fmt, dpi = cfg["format"].lower(), cfg["dpi"]
+    buf = io.BytesIO()
+    fig.canvas.draw()
+    try:
+        if _has_insets(cfg) or getattr(fig, "_cz_has_local_insets", False):
+            fig.savefig(buf, format=fmt, dpi=dpi)
+        else:
+            fig.savefig(buf, bbox_inches="tight", pad_inches=0.3, format=fmt, dpi=dpi)
+    except Exception:
+        buf = io.BytesIO()
+        fig.savefig(buf, format=fmt, dpi=dpi)
+    return buf.getvalue()
+
+
+def render_map(df: pd.DataFrame, config: dict | None = None, report: dict | None = None) -> bytes:
+    """Render a converted station table (Lat_DD/Lon_DD) to encoded image bytes.
+
+    Layers whose settings did not change since an earlier call are reused
+    from the in-memory layer cache. report: optional dict, filled with
+    per-render diagnostics ("declutter": engine, iterations, seconds,
+    remaining overlaps, ...).
+    """
+    cfg = resolve_config(df, config)
+    bounds = compute_bounds(df, cfg)
+    layers = render_layers(df, cfg, bounds, report)
+    return composite_layers(layers, cfg, tight=not _has_insets(cfg))
@@ -0,0 +1,147 @@
+# utils/symbology.py — attribute classes for graduated / categorical markers
+"""Vectorized classification of a station attribute into marker classes.
+
+Usage (render_engine, "markers" and "furniture" layers):
+
+from utils.symbology import classify, class_colors, class_sizes
+
+codes, labels = classify(df["Depth"], "graduated", method="quantile", k=5)
+colors = class_colors("viridis", len(labels))
+for c, (lab, col) in enumerate(zip(labels, colors)):
+    sel = codes == c
+    ax.scatter(lon[sel], lat[sel], c=[col], label=lab)      # one collection per class
+
+Graduated classes come from breaks over the numeric values: quantile
+(np.quantile), equal interval (np.linspace) or Jenks natural breaks.
+Jenks is the Fisher optimal partition, solved by dynamic programming on
+the distinct values weighted by how many stations hold each (at most
+JENKS_SAMPLE groups of them), so ties count and it stays cheap at 100k+
+stations. Values are then assigned with one np.searchsorted. Categorical
+classes are the most frequent values (up to max_categories, the rest as
+"Other"), found with pd.factorize. Missing / non-numeric values get code
+-1 ("No data").
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import matplotlib as mpl
+
+SYMBOLOGY_MODES = ("single", "graduated", "categorical")
+CLASS_METHODS = ("quantile", "jenks", "equal")
+JENKS_SAMPLE = 1000
+NO_DATA_COLOR = "#bbbbbb"
+
+
+def _fmt(v):
+    return f"{v:,.4g}"
+
+
+def jenks_breaks(values, k):
+    """Fisher-Jenks natural breaks of values: k + 1 edges (class maxima).
+
+    Minimises the within-class squared deviation over all values, ties
+    included: the DP runs on the distinct values weighted by their counts,
+    or on at most JENKS_SAMPLE groups of neighbouring distinct values (equal
+    station counts) whose exact sums are kept, so breaks fall between groups.
+    """
+    v, w = np.unique(np.asarray(values, dtype=float), return_counts=True)
+    w = w.astype(float)
+    if len(v) > JENKS_SAMPLE:
+        before = np.cumsum(w) - w
+        group = np.floor(before / w.sum() * JENKS_SAMPLE).astype(np.int64)
+        last = np.flatnonzero(np.r_[group[1:] != group[:-1], True])
+        sw, swv, swvv = (np.bincount(group, weights=x) for x in (w, w * v, w * v * v))
+        sw, swv, swvv = sw[group[last]], swv[group[last]], swvv[group[last]]
+        top = v[last]                                       # largest value of each group
+    else:
+        sw, swv, swvv, top = w, w * v, w * v * v, v
+    m = len(top)
+    k = min(k, m)
+    if k <= 1:
+        return np.array([v[0], v[-1]], dtype=float)
+    s0, s1, s2 = (np.concatenate([[0.0], np.cumsum(x)]) for x in (sw, swv, swvv))
+    # ssd[i, j]: weighted squared deviation of groups i..j (i <= j)
+    i, j = np.triu_indices(m)
+    ssd = np.full((m, m), np.inf)
+    ssd[i, j] = (s2[j + 1] - s2[i]) - (s1[j + 1] - s1[i]) ** 2 / (s0[j + 1] - s0[i])
+    # cost[c, j]: best total for groups :j + 1 in c + 1 classes; start[c, j]: first group of the last class
+    cost = np.empty((k, m))
+    start = np.zeros((k, m), dtype=np.int64)
+    cost[0] = ssd[0]
+    for c in range(1, k):
+        # last class i..j after c classes on groups :i
+        total = cost[c - 1][:-1, None] + ssd[1:, :]
+        start[c] = np.argmin(total, axis=0) + 1
+        cost[c] = total[start[c] - 1, np.arange(m)]
+    edges, j = [v[-1]], m - 1
+    for c in range(k - 1, 0, -1):
+        j = start[c, j] - 1
+        edges.append(top[j])
+    edges.append(v[0])
+    return np.array(edges[::-1], dtype=float)
+
+
+def class_breaks(values, k=5, method="quantile"):
+    """Ascending class edges of the finite values, at most k + 1.
+
+    Repeated edges are merged, except that the second edge may equal the
+    first: the lowest class is closed ([b0, b1]), so b0 == b1 is a class
+    holding only the minimum (e.g. many tied stations at it).
+    """
+    v = np.asarray(values, dtype=float)
+    v = v[np.isfinite(v)]
+    if not len(v):
+        return np.array([], dtype=float)
+    if method == "quantile":
+        edges = np.quantile(v, np.linspace(0, 1, k + 1))
+    elif method == "equal":
+        edges = np.linspace(v.min(), v.max(), k + 1)
+    elif method == "jenks":
+        edges = jenks_breaks(v, k)
+    else:
+        raise ValueError(f"Unknown class method {method!r} (use one of {CLASS_METHODS})")
+    return np.r_[edges[0], np.unique(edges[1:])]
+
+
+def classify(series: pd.Series, mode="graduated", method="quantile", k=5, max_categories=10):
+    """(codes [n] int, class labels) of an attribute column; code -1 = no data.
+
+    graduated: classes (b0, b1], (b1, b2], ... with b0 included; raises
+    ValueError when the column has no numeric values.
+    categorical: the max_categories most frequent values, then "Other".
+    """
+    if mode == "graduated":
+        values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=float)
+        edges = class_breaks(values, k, method)
+        if not len(edges):
+            raise ValueError(f"Column {series.name!r} has no numeric values to classify")
+        labels = [_fmt(a) if a == b else f"{_fmt(a)} – {_fmt(b)}" for a, b in zip(edges[:-1], edges[1:])]
+        codes = np.clip(np.searchsorted(edges, values, side="left") - 1, 0, len(labels) - 1)
+        codes[~np.isfinite(values)] = -1
+        return codes, labels
+    if mode == "categorical":
+        codes, uniques = pd.factorize(series.astype("string"), sort=True)
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        order = np.argsort(-counts, kind="stable")
+        keep = np.sort(order[:max_categories])              # most frequent, in sorted value order
+        remap = np.full(len(uniques) + 1, len(keep), dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        remap[-1] = -1                                      # pd.factorize's -1 (missing) → no data
+        out = remap[codes]
+        labels = [str(uniques[i]) for i in keep] + (["Other"] if len(uniques) > len(keep) else [])
+        return out, labels
+    raise ValueError(f"Unknown symbology {mode!r} (use one of {SYMBOLOGY_MODES})")
+
+
+def class_colors(cmap, n, categorical=False):
+    """n colours: evenly spaced along a ramp, or cycled from a qualitative palette."""
+    ramp = mpl.colormaps[cmap]
+    if categorical and hasattr(ramp, "colors") and ramp.N < 256:
+        return [mpl.colors.to_hex(ramp.colors[i % ramp.N]) for i in range(n)]
+    return [mpl.colors.to_hex(ramp(x)) for x in (np.linspace(0, 1, n) if n > 1 else [0.5])]
+
+
+def class_sizes(n, smallest, largest):
+    """n marker sizes (points) from smallest to largest, one per graduated class."""
+    return list(np.linspace(smallest, largest, n)) if n > 1 else [largest]